@@ -3,7 +3,7 @@
 
 static char PyPgBytea_doc[] = "XXX bytea objects";
 
-static PyTypeObject PyPgBytea_Type = {
+PyTypeObject PyPgBytea_Type = {
 	PyVarObject_HEAD_INIT(NULL, 0)
 	MODULE_NAME ".bytea",			/* tp_name */
 	sizeof(PyPgBytea),			/* tp_basicsize */
@@ -51,6 +51,19 @@ PyPgBytea_Check(PyObject *op)
 	return op->ob_type == &PyPgBytea_Type;
 }
 
+PyObject *
+PyPgBytea_FromStringAndSize(const char *value, Py_ssize_t len)
+{
+	PyObject *str, *result;
+
+	if ((str = PyBytes_FromStringAndSize(value, len)) == NULL)
+		return NULL;
+	result = PyObject_CallFunctionObjArgs((PyObject *)&PyPgBytea_Type,
+					      str, NULL);
+	Py_DECREF(str);
+	return result;
+}
+
 void
 pg_bytea_init(PyObject *module)
 {
@@ -31,9 +31,13 @@ init_module_members(PyObject *module)
 {
 	pg_constants_init(module);
 	pg_bytea_init(module);
+	pg_decode_init(module);
+	pg_encode_init(module);
+	pg_buffer_init(module);
 	pg_exception_init(module);
 	pg_cell_init(module);
 	pg_result_init(module);
+	pg_row_init(module);
 	pg_connection_init(module);
 }
 
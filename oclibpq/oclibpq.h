@@ -16,6 +16,7 @@
 #define PyString_FromString PyUnicode_FromString
 #define PyString_Check PyUnicode_Check
 #define PyString_FromFormat PyUnicode_FromFormat
+#define PyString_Format PyUnicode_Format
 #define PyString_InternFromString PyUnicode_InternFromString
 #define PyString_Join PyUnicode_Join
 #define PyInt_Type PyLong_Type
@@ -74,6 +75,22 @@ typedef int Py_ssize_t;
 
 #define MODULE_NAME "oclibpq"
 
+/* Built-in type OIDs (from the server's catalog/pg_type.h) */
+#define BOOLOID		16
+#define BYTEAOID	17
+#define INT8OID		20
+#define INT2OID		21
+#define INT4OID		23
+#define TEXTOID		25
+#define OIDOID		26
+#define FLOAT4OID	700
+#define FLOAT8OID	701
+#define DATEOID		1082
+#define TIMEOID		1083
+#define TIMESTAMPOID	1114
+#define TIMESTAMPTZOID	1184
+#define NUMERICOID	1700
+
 typedef struct {
 	char		*name;
 	int	 	value;
@@ -147,6 +164,14 @@ extern void pg_connection_init(PyObject *module);
 /* pqresult.c */
 extern void pg_result_init(PyObject *module);
 extern PyObject *PyPgResult_New(PyPgConnection *connection, PGresult *result);
+extern int pg_result_decode_kind(PyPgResult *self, int col, PyObject *cvt);
+extern PyObject *pg_result_decode_cell(PyPgResult *self, PyObject *cvt,
+				       int kind, int row_number, int col);
+
+/* pqrow.c */
+extern void pg_row_init(PyObject *module);
+extern PyObject *PyPgRow_New(PyPgResult *result, PyObject *converters,
+			     int row_number);
 #define PyPgResult_Check(op) ((op)->ob_type == &PyPgResult_Type)
 
 /* pqexception.c */
@@ -159,5 +184,46 @@ extern void pg_cell_init(PyObject *module);
 extern int PyPgCell_Check(PyObject *);
 
 /* bytea.c */
+extern PyTypeObject PyPgBytea_Type;
 extern void pg_bytea_init(PyObject *module);
 extern int PyPgBytea_Check(PyObject *);
+extern PyObject *PyPgBytea_FromStringAndSize(const char *, Py_ssize_t);
+
+/* pqdecode.c */
+enum {
+	PGDECODE_PYTHON,	/* call the converter from Python */
+	PGDECODE_BOOL,
+	PGDECODE_INT2,
+	PGDECODE_INT4,
+	PGDECODE_INT8,
+	PGDECODE_OID,
+	PGDECODE_FLOAT4,
+	PGDECODE_FLOAT8,
+	PGDECODE_UTF8,
+	PGDECODE_BYTES,
+	PGDECODE_BYTEA,
+	PGDECODE_MEMORYVIEW,	/* result rows only - see pqbuffer.c */
+	PGDECODE_RAW,
+};
+extern void pg_decode_init(PyObject *module);
+extern int pg_decode_kind(PyObject *cvt);
+extern PyObject *pg_decode_value(int kind, const char *value, int len);
+extern void pg_convert_error(const char *value, int len, PyObject *column);
+extern PyObject *pg_bytes_to_array(char *typecode, PyObject *buf);
+extern PyObject *pg_decode_column(PGresult *result, int col, int start,
+				  int integer_datetimes);
+
+/* pqbuffer.c */
+extern void pg_buffer_init(PyObject *module);
+extern PyObject *pg_result_memoryview(PyObject *result, char *value, int len);
+extern int pg_raw_kind(PyObject *cvt);
+extern PyObject *pg_raw_decode(int kind, PyObject *cvt, PyObject *result,
+			       char *value, int len);
+
+/* pqencode.c */
+#define PGENCODE_SCRATCH 8	/* scratch bytes needed per parameter */
+extern void pg_encode_init(PyObject *module);
+extern int pg_encode_param(PyObject *param, Oid *oid, char **value, int *len,
+			   char *scratch, PyObject **owned);
+extern int pg_encode_buffer(PyObject *param, char **value, int *len,
+			    PyObject **owned);
@@ -0,0 +1,249 @@
+/* vi:set sw=8 ts=8 noet showmode ai: */
+
+/*
+ * Zero-copy access to result values.
+ *
+ * Cells of columns whose from_db converter is the memoryview type are
+ * returned as read-only memoryviews of the PGresult memory, and converters
+ * wrapped in raw_converter() are called with such a memoryview rather than
+ * a bytes copy. Each memoryview holds a reference to the PgResult (via a
+ * small buffer exporter object), so the PGresult stays allocated for as
+ * long as any view of it is alive.
+ */
+
+#include "oclibpq.h"
+
+typedef struct {
+	PyObject_HEAD
+	PyObject	*result;
+	char		*value;
+	Py_ssize_t	 len;
+} PyPgResultBuffer;
+
+typedef struct {
+	PyObject_HEAD
+	PyObject	*func;
+} PyPgRawConverter;
+
+static void
+PyPgResultBuffer_dealloc(PyPgResultBuffer *self)
+{
+	Py_XDECREF(self->result);
+	Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static int
+PyPgResultBuffer_getbuffer(PyPgResultBuffer *self, Py_buffer *view, int flags)
+{
+	return PyBuffer_FillInfo(view, (PyObject *)self, self->value,
+				 self->len, 1, flags);
+}
+
+static PyBufferProcs PyPgResultBuffer_as_buffer = {
+#if PY_MAJOR_VERSION < 3
+	0,					/* bf_getreadbuffer */
+	0,					/* bf_getwritebuffer */
+	0,					/* bf_getsegcount */
+	0,					/* bf_getcharbuffer */
+#endif
+	(getbufferproc)PyPgResultBuffer_getbuffer, /* bf_getbuffer */
+	0,					/* bf_releasebuffer */
+};
+
+#if PY_MAJOR_VERSION < 3
+#define BUFFER_TPFLAGS (Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_NEWBUFFER)
+#else
+#define BUFFER_TPFLAGS Py_TPFLAGS_DEFAULT
+#endif
+
+static PyTypeObject PyPgResultBuffer_Type = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	MODULE_NAME ".PgResultBuffer",		/* tp_name */
+	sizeof(PyPgResultBuffer),		/* tp_basicsize */
+	0,					/* tp_itemsize */
+	(destructor)PyPgResultBuffer_dealloc,	/* tp_dealloc */
+	0,					/* tp_print */
+	0,					/* tp_getattr */
+	0,					/* tp_setattr */
+	0,					/* tp_compare */
+	0,					/* tp_repr */
+	0,					/* tp_as_number */
+	0,					/* tp_as_sequence */
+	0,					/* tp_as_mapping */
+	0,					/* tp_hash */
+	0,					/* tp_call */
+	0,					/* tp_str */
+	0,					/* tp_getattro */
+	0,					/* tp_setattro */
+	&PyPgResultBuffer_as_buffer,		/* tp_as_buffer */
+	BUFFER_TPFLAGS,				/* tp_flags */
+	0,					/* tp_doc */
+};
+
+/*
+ * Return a read-only memoryview of len bytes at value, which must point
+ * into the PGresult of the given PgResult.
+ */
+PyObject *
+pg_result_memoryview(PyObject *result, char *value, int len)
+{
+	PyPgResultBuffer *buffer;
+	PyObject *view;
+
+	buffer = PyObject_New(PyPgResultBuffer, &PyPgResultBuffer_Type);
+	if (buffer == NULL)
+		return NULL;
+	Py_INCREF(result);
+	buffer->result = result;
+	buffer->value = value;
+	buffer->len = len;
+	view = PyMemoryView_FromObject((PyObject *)buffer);
+	Py_DECREF(buffer);
+	return view;
+}
+
+static void
+PyPgRawConverter_dealloc(PyPgRawConverter *self)
+{
+	Py_XDECREF(self->func);
+	Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static PyObject *
+PyPgRawConverter_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+	PyPgRawConverter *self;
+	PyObject *func;
+
+	if (!PyArg_ParseTuple(args, "O:raw_converter", &func))
+		return NULL;
+	if (!PyCallable_Check(func)) {
+		PyErr_SetString(PyExc_TypeError,
+				"raw_converter argument must be callable");
+		return NULL;
+	}
+	if ((self = (PyPgRawConverter *)type->tp_alloc(type, 0)) == NULL)
+		return NULL;
+	Py_INCREF(func);
+	self->func = func;
+	return (PyObject *)self;
+}
+
+/* Called directly (eg, for COPY data), the converter is passed bytes */
+static PyObject *
+PyPgRawConverter_call(PyPgRawConverter *self, PyObject *args, PyObject *kwds)
+{
+	return PyObject_Call(self->func, args, kwds);
+}
+
+static PyObject *
+PyPgRawConverter_repr(PyPgRawConverter *self)
+{
+	PyObject *func_repr, *repr;
+
+	if ((func_repr = PyObject_Repr(self->func)) == NULL)
+		return NULL;
+#if PY_MAJOR_VERSION >= 3
+	repr = PyUnicode_FromFormat("raw_converter(%U)", func_repr);
+#else
+	repr = PyString_FromFormat("raw_converter(%s)",
+				   PyString_AS_STRING(func_repr));
+#endif
+	Py_DECREF(func_repr);
+	return repr;
+}
+
+#define MO(m) offsetof(PyPgRawConverter, m)
+static PyMemberDef PyPgRawConverter_members[] = {
+	{"func",	T_OBJECT,	MO(func),	READONLY},
+	{NULL}
+};
+#undef MO
+
+PyDoc_STRVAR(PyPgRawConverter_doc,
+"raw_converter(func) -- Wrap a from_db converter so that it is passed a\n"
+"read-only memoryview of the result memory rather than a copy of the value");
+
+static PyTypeObject PyPgRawConverter_Type = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	MODULE_NAME ".raw_converter",		/* tp_name */
+	sizeof(PyPgRawConverter),		/* tp_basicsize */
+	0,					/* tp_itemsize */
+	(destructor)PyPgRawConverter_dealloc,	/* tp_dealloc */
+	0,					/* tp_print */
+	0,					/* tp_getattr */
+	0,					/* tp_setattr */
+	0,					/* tp_compare */
+	(reprfunc)PyPgRawConverter_repr,	/* tp_repr */
+	0,					/* tp_as_number */
+	0,					/* tp_as_sequence */
+	0,					/* tp_as_mapping */
+	0,					/* tp_hash */
+	(ternaryfunc)PyPgRawConverter_call,	/* tp_call */
+	0,					/* tp_str */
+	0,					/* tp_getattro */
+	0,					/* tp_setattro */
+	0,					/* tp_as_buffer */
+	Py_TPFLAGS_DEFAULT,			/* tp_flags */
+	PyPgRawConverter_doc,			/* tp_doc */
+	0,					/* tp_traverse */
+	0,					/* tp_clear */
+	0,					/* tp_richcompare */
+	0,					/* tp_weaklistoffset */
+	0,					/* tp_iter */
+	0,					/* tp_iternext */
+	0,					/* tp_methods */
+	PyPgRawConverter_members,		/* tp_members */
+	0,					/* tp_getset */
+	0,					/* tp_base */
+	0,					/* tp_dict */
+	0,					/* tp_descr_get */
+	0,					/* tp_descr_set */
+	0,					/* tp_dictoffset */
+	0,					/* tp_init */
+	0,					/* tp_alloc */
+	PyPgRawConverter_new,			/* tp_new */
+	0,					/* tp_free */
+};
+
+/*
+ * Map a from_db converter onto one of the zero-copy decoders, returning
+ * PGDECODE_PYTHON if the converter takes a bytes copy of the value.
+ */
+int
+pg_raw_kind(PyObject *cvt)
+{
+	if (cvt == (PyObject *)&PyMemoryView_Type)
+		return PGDECODE_MEMORYVIEW;
+	if (Py_TYPE(cvt) == &PyPgRawConverter_Type)
+		return PGDECODE_RAW;
+	return PGDECODE_PYTHON;
+}
+
+/* Decode a (binary, non-NULL) result value with a zero-copy decoder */
+PyObject *
+pg_raw_decode(int kind, PyObject *cvt, PyObject *result, char *value, int len)
+{
+	PyObject *view, *res;
+
+	if ((view = pg_result_memoryview(result, value, len)) == NULL)
+		return NULL;
+	if (kind == PGDECODE_MEMORYVIEW)
+		return view;
+	res = PyObject_CallFunctionObjArgs(((PyPgRawConverter *)cvt)->func,
+					   view, NULL);
+	Py_DECREF(view);
+	return res;
+}
+
+void
+pg_buffer_init(PyObject *module)
+{
+	if (PyType_Ready(&PyPgResultBuffer_Type) < 0)
+		return;
+	if (PyType_Ready(&PyPgRawConverter_Type) < 0)
+		return;
+	Py_INCREF(&PyPgRawConverter_Type);
+	PyModule_AddObject(module, "raw_converter",
+			   (PyObject *)&PyPgRawConverter_Type);
+}
@@ -8,6 +8,12 @@ static PyPgConstEnum *PyPg_ERRORS;
 // PQtransactionStatus()
 static PyPgConstEnum *PyPg_TRANS;
 
+// PQconnectPoll()
+static PyPgConstEnum *PyPg_POLLING;
+
+// PQstatus()
+static PyPgConstEnum *PyPg_CONNECTION;
+
 #if (PY_VERSION_HEX < 0x02040000)
 /* PyGILState_Release was buggy - fixed in r38830 by mwh on 2005-04-18*/
 static void
@@ -79,11 +85,33 @@ PyPgNoticeProcessor(void *arg, const char *message)
 	PgPyGILState_Release(gstate);
 }
 
+static int
+_check_connection(PGconn *cnx)
+{
+	if (PQprotocolVersion(cnx) < 3) {
+		PyErr_SetString(PqErr_DatabaseError, MODULE_NAME " requires "
+				"protocol 3 or greater server (7.4 and up)");
+		return -1;
+	}
+	/*
+	 * Serious issues exist with 7.4's protocol 3 implementation:
+	 *    - no way t determine if server is using float or int datetimes
+	 *    - cursors with parameters fail when fetching (bind lost)
+	 */
+	if (PQserverVersion(cnx) < 80000) {
+		PyErr_SetString(PqErr_DatabaseError, MODULE_NAME " does not "
+				"support pre v8 servers");
+		return -1;
+	}
+	return 0;
+}
+
 static int
 PyPgConnection_init(PyObject *o, PyObject *args, PyObject *kwds)
 {
 	PyPgConnection *self = (PyPgConnection *)o;
 	char	*conninfo;
+	int	 nonblocking = 0;
 	PGconn	*cnx;
 
 	assert(self->connection == NULL);
@@ -99,12 +127,22 @@ PyPgConnection_init(PyObject *o, PyObject *args, PyObject *kwds)
 			return -1;
 		}
 	}
-	if (!PyArg_ParseTuple(args, "s:PyPgConnection", &conninfo))
+	if (!PyArg_ParseTuple(args, "s|i:PyPgConnection", &conninfo, 
+			      &nonblocking))
 		return -1;
 
-	Py_BEGIN_ALLOW_THREADS
-	cnx = PQconnectdb(conninfo);
-	Py_END_ALLOW_THREADS
+	/*
+	 * If nonblocking is set, the connection is only started, and must be
+	 * completed by calling connectPoll() until it returns
+	 * PGRES_POLLING_OK.
+	 */
+	if (nonblocking) {
+		cnx = PQconnectStart(conninfo);
+	} else {
+		Py_BEGIN_ALLOW_THREADS
+		cnx = PQconnectdb(conninfo);
+		Py_END_ALLOW_THREADS
+	}
 
 	if (cnx == NULL) {
 		PyErr_SetString(PyExc_MemoryError,
@@ -112,26 +150,14 @@ PyPgConnection_init(PyObject *o, PyObject *args, PyObject *kwds)
 		return -1;
 	}
 
-	if (PQstatus(cnx) != CONNECTION_OK) {
+	if (PQstatus(cnx) == CONNECTION_BAD || 
+			(!nonblocking && PQstatus(cnx) != CONNECTION_OK)) {
 		PyErr_SetString(PqErr_DatabaseError, PQerrorMessage(cnx));
 		PQfinish(cnx);
 		return -1;
 	}
 
-	if (PQprotocolVersion(cnx) < 3) {
-		PyErr_SetString(PqErr_DatabaseError, MODULE_NAME " requires "
-				"protocol 3 or greater server (7.4 and up)");
-		PQfinish(cnx);
-		return -1;
-	}
-	/*
-	 * Serious issues exist with 7.4's protocol 3 implementation:
-	 *    - no way t determine if server is using float or int datetimes
-	 *    - cursors with parameters fail when fetching (bind lost)
-	 */
-	if (PQserverVersion(cnx) < 80000) {
-		PyErr_SetString(PqErr_DatabaseError, MODULE_NAME " does not "
-				"support pre v8 servers");
+	if (!nonblocking && _check_connection(cnx) < 0) {
 		PQfinish(cnx);
 		return -1;
 	}
@@ -194,9 +220,13 @@ connection_close(PyPgConnection *self, PyObject *unused)
 	return Py_None;
 }
 
-/* Extract 2-tuple (oid, data) parameters */
+/*
+ * Extract 2-tuple (oid, data) parameters - data can be bytes or any other
+ * contiguous buffer, which is used in place (see pg_encode_buffer).
+ */
 static int
-_param_tuple(PyObject *param, Oid *oid, char **str, int *len)
+_param_tuple(PyObject *param, Oid *oid, char **str, int *len, 
+	     PyObject **owned)
 {
 	PyObject *o;
 	Py_ssize_t l;
@@ -216,9 +246,13 @@ _param_tuple(PyObject *param, Oid *oid, char **str, int *len)
 	*oid = PyInt_AsLong(o);
 	o = PyTuple_GET_ITEM(param, 1);
 	if (!PyBytes_Check(o)) {
-		PyErr_SetString(PyExc_TypeError, 
-			"parameter 2-tuple element 1 must be bytes type");
-		return -1;
+		if (!PyObject_CheckBuffer(o)) {
+			PyErr_SetString(PyExc_TypeError, 
+				"parameter 2-tuple element 1 must be bytes "
+				"or a buffer");
+			return -1;
+		}
+		return pg_encode_buffer(o, str, len, owned);
 	}
 	if (PyBytes_AsStringAndSize(o, str, &l) < 0)
 		return -1;
@@ -226,96 +260,559 @@ _param_tuple(PyObject *param, Oid *oid, char **str, int *len)
 	return 0;
 }
 
-static PyObject *
-connection_execute(PyPgConnection *self, PyObject *args) 
+/* Parameter arrays in the form required by PQexecParams and friends */
+typedef struct {
+	int	 nParams;
+	Oid	*paramTypes;
+	char   **paramValues;
+	int	*paramLengths;
+	int	*paramFormats;
+	char	*scratch;	/* natively encoded fixed width values */
+	PyObject **owned;	/* encoded values and buffer exports */
+} PyPgParams;
+
+static void
+_free_params(PyPgParams *p)
 {
-	char *query;
-	PyObject *params, *param;
-	int nParams;
 	int n;
-	Oid *paramTypes = NULL;
-	char **paramValues = NULL;
-	int *paramLengths = NULL;
-	int *paramFormats = NULL;
-	PGresult *res;
-	PyObject *result = NULL;
 
+	if (p->owned != NULL) {
+		for (n = 0; n < p->nParams; ++n)
+			Py_XDECREF(p->owned[n]);
+		PyMem_Free(p->owned);
+	}
+	if (p->scratch != NULL)
+		PyMem_Free(p->scratch);
+	if (p->paramFormats != NULL)
+		PyMem_Free(p->paramFormats);
+	if (p->paramLengths != NULL)
+		PyMem_Free(p->paramLengths);
+	if (p->paramValues != NULL)
+		PyMem_Free(p->paramValues);
+	if (p->paramTypes != NULL)
+		PyMem_Free(p->paramTypes);
+}
 
-	if (_not_open(self)) return NULL;
+/* 
+ * Fill in the libpq parameter arrays from a sequence of (oid, data) tuples,
+ * None, str (sent as untyped text), or values of the types encoded natively
+ * by pqencode.c. The values point into the parameter objects, so the
+ * sequence must be kept alive until the query has been sent.
+ */
+static int
+_build_params(PyObject *params, PyPgParams *p)
+{
+	PyObject *param;
+	int n;
 
-	if (!PyArg_ParseTuple(args,"sO:execute", &query, &params)) 
-		return NULL;
+	memset(p, 0, sizeof(*p));
 
 	if (!PySequence_Check(params))
 	{
 		PyErr_SetString(PyExc_TypeError, 
 				"execute parameters must be a sequence");
-		return NULL;
+		return -1;
 	}
 
-	nParams = PySequence_Length(params);
+	p->nParams = PySequence_Length(params);
+	if (p->nParams < 0)
+		return -1;
 
-	paramTypes = PyMem_Malloc(nParams * sizeof(Oid));
-	if (paramTypes == NULL)
-		return PyErr_NoMemory();
-	paramValues = PyMem_Malloc(nParams * sizeof(char *));
-	if (paramValues == NULL)
-		return PyErr_NoMemory();
-	paramLengths = PyMem_Malloc(nParams * sizeof(int));
-	if (paramLengths == NULL)
-		return PyErr_NoMemory();
-	paramFormats = PyMem_Malloc(nParams * sizeof(int));
-	if (paramFormats == NULL)
-		return PyErr_NoMemory();
+	p->paramTypes = PyMem_Malloc(p->nParams * sizeof(Oid) + 1);
+	p->paramValues = PyMem_Malloc(p->nParams * sizeof(char *) + 1);
+	p->paramLengths = PyMem_Malloc(p->nParams * sizeof(int) + 1);
+	p->paramFormats = PyMem_Malloc(p->nParams * sizeof(int) + 1);
+	p->scratch = PyMem_Malloc(p->nParams * PGENCODE_SCRATCH + 1);
+	p->owned = PyMem_Malloc(p->nParams * sizeof(PyObject *) + 1);
+	if (p->paramTypes == NULL || p->paramValues == NULL ||
+	    p->paramLengths == NULL || p->paramFormats == NULL ||
+	    p->scratch == NULL || p->owned == NULL) {
+		PyErr_NoMemory();
+		goto error;
+	}
+	memset(p->owned, 0, p->nParams * sizeof(PyObject *));
 
-	for (n = 0; n < nParams; ++n)
+	for (n = 0; n < p->nParams; ++n)
 	{
-		paramTypes[n] = 0;
-		paramValues[n] = NULL;
-		paramLengths[n] = 0;
-		paramFormats[n] = 0;
+		p->paramTypes[n] = 0;
+		p->paramValues[n] = NULL;
+		p->paramLengths[n] = 0;
+		p->paramFormats[n] = 0;
 		param = PySequence_GetItem(params, n);
 		if (param == NULL)
 			goto error;
 		if (param == Py_None) {
 			/* */
 		} else if (PyTuple_Check(param)) {
-			if (_param_tuple(param, &paramTypes[n], &paramValues[n],
-					 &paramLengths[n]) < 0) {
+			if (_param_tuple(param, &p->paramTypes[n], 
+					 &p->paramValues[n],
+					 &p->paramLengths[n],
+					 &p->owned[n]) < 0) {
 				Py_DECREF(param);
 				goto error;
 			}
-			paramFormats[n] = 1;
+			p->paramFormats[n] = 1;
+		} else if (PyBytes_Check(param) && !PyPgBytea_Check(param)) {
+			p->paramValues[n] = PyBytes_AS_STRING(param);
 		} else {
-			char *str;
-			if ((str = PyBytes_AsString(param)) == NULL) {
+			if (pg_encode_param(param, &p->paramTypes[n],
+					    &p->paramValues[n],
+					    &p->paramLengths[n],
+					    p->scratch + n * PGENCODE_SCRATCH,
+					    &p->owned[n]) < 0) {
 				Py_DECREF(param);
 				goto error;
 			}
-			paramValues[n] = str;
+			p->paramFormats[n] = 1;
 		}
 		Py_DECREF(param);
 	}
+	return 0;
+
+error:
+	_free_params(p);
+	return -1;
+}
+
+static PyObject *
+connection_execute(PyPgConnection *self, PyObject *args) 
+{
+	char *query;
+	PyObject *params;
+	PyPgParams p;
+	PGresult *res;
+
+	if (_not_open(self)) return NULL;
+
+	if (!PyArg_ParseTuple(args,"sO:execute", &query, &params)) 
+		return NULL;
+
+	if (_build_params(params, &p) < 0)
+		return NULL;
 
 	Py_BEGIN_ALLOW_THREADS
-	res = PQexecParams(self->connection, query, nParams, paramTypes,
-			   (const char **)paramValues, paramLengths, 
-			   paramFormats, 1);
+	res = PQexecParams(self->connection, query, p.nParams, p.paramTypes,
+			   (const char **)p.paramValues, p.paramLengths, 
+			   p.paramFormats, 1);
 	Py_END_ALLOW_THREADS
 
-	result = PyPgResult_New(self, res);
+	_free_params(&p);
 
-error:
-	if (paramFormats != NULL)
-		PyMem_Free(paramFormats);
-	if (paramLengths != NULL)
-		PyMem_Free(paramLengths);
-	if (paramValues != NULL)
-		PyMem_Free(paramValues);
-	if (paramTypes != NULL)
-		PyMem_Free(paramTypes);
+	return PyPgResult_New(self, res);
+}
 
-	return result;
+/* Extract a sequence of parameter type OIDs (None meaning unspecified) */
+static Oid *
+_build_types(PyObject *types, int *nParams)
+{
+	PyObject *type;
+	Oid *paramTypes;
+	int n;
+
+	types = PySequence_Fast(types, "prepare types must be a sequence");
+	if (types == NULL)
+		return NULL;
+	*nParams = PySequence_Fast_GET_SIZE(types);
+	if ((paramTypes = PyMem_Malloc(*nParams * sizeof(Oid) + 1)) == NULL) {
+		Py_DECREF(types);
+		PyErr_NoMemory();
+		return NULL;
+	}
+	for (n = 0; n < *nParams; ++n) {
+		type = PySequence_Fast_GET_ITEM(types, n);
+		if (type == Py_None)
+			paramTypes[n] = 0;
+		else if ((paramTypes[n] = PyInt_AsLong(type)) == (Oid)-1 &&
+			 PyErr_Occurred()) {
+			PyMem_Free(paramTypes);
+			Py_DECREF(types);
+			return NULL;
+		}
+	}
+	Py_DECREF(types);
+	return paramTypes;
+}
+
+static PyObject *
+connection_prepare(PyPgConnection *self, PyObject *args) 
+{
+	char *name, *query;
+	PyObject *types;
+	Oid *paramTypes;
+	int nParams;
+	PGresult *res;
+
+	if (_not_open(self)) return NULL;
+
+	if (!PyArg_ParseTuple(args,"ssO:prepare", &name, &query, &types)) 
+		return NULL;
+
+	if ((paramTypes = _build_types(types, &nParams)) == NULL)
+		return NULL;
+
+	Py_BEGIN_ALLOW_THREADS
+	res = PQprepare(self->connection, name, query, nParams, paramTypes);
+	Py_END_ALLOW_THREADS
+
+	PyMem_Free(paramTypes);
+
+	return PyPgResult_New(self, res);
+}
+
+static PyObject *
+connection_exec_prepared(PyPgConnection *self, PyObject *args) 
+{
+	char *name;
+	PyObject *params;
+	PyPgParams p;
+	PGresult *res;
+
+	if (_not_open(self)) return NULL;
+
+	if (!PyArg_ParseTuple(args,"sO:execPrepared", &name, &params)) 
+		return NULL;
+
+	if (_build_params(params, &p) < 0)
+		return NULL;
+
+	Py_BEGIN_ALLOW_THREADS
+	res = PQexecPrepared(self->connection, name, p.nParams, 
+			     (const char **)p.paramValues, p.paramLengths, 
+			     p.paramFormats, 1);
+	Py_END_ALLOW_THREADS
+
+	_free_params(&p);
+
+	return PyPgResult_New(self, res);
+}
+
+static PyObject *
+_send_status(PyPgConnection *self, int ok)
+{
+	if (!ok) {
+		PyErr_SetString(PqErr_OperationalError, 
+				PQerrorMessage(self->connection));
+		return NULL;
+	}
+	Py_INCREF(Py_None);
+	return Py_None;
+}
+
+static PyObject *
+connection_send_query(PyPgConnection *self, PyObject *args) 
+{
+	char *query;
+	PyObject *params;
+	PyPgParams p;
+	int ok;
+
+	if (_not_open(self)) return NULL;
+
+	if (!PyArg_ParseTuple(args,"sO:sendQuery", &query, &params)) 
+		return NULL;
+
+	if (_build_params(params, &p) < 0)
+		return NULL;
+
+	Py_BEGIN_ALLOW_THREADS
+	ok = PQsendQueryParams(self->connection, query, p.nParams, 
+			       p.paramTypes, (const char **)p.paramValues, 
+			       p.paramLengths, p.paramFormats, 1);
+	Py_END_ALLOW_THREADS
+
+	_free_params(&p);
+
+	return _send_status(self, ok);
+}
+
+static PyObject *
+connection_send_prepare(PyPgConnection *self, PyObject *args) 
+{
+	char *name, *query;
+	PyObject *types;
+	Oid *paramTypes;
+	int nParams;
+	int ok;
+
+	if (_not_open(self)) return NULL;
+
+	if (!PyArg_ParseTuple(args,"ssO:sendPrepare", &name, &query, &types)) 
+		return NULL;
+
+	if ((paramTypes = _build_types(types, &nParams)) == NULL)
+		return NULL;
+
+	Py_BEGIN_ALLOW_THREADS
+	ok = PQsendPrepare(self->connection, name, query, nParams, paramTypes);
+	Py_END_ALLOW_THREADS
+
+	PyMem_Free(paramTypes);
+
+	return _send_status(self, ok);
+}
+
+static PyObject *
+connection_send_query_prepared(PyPgConnection *self, PyObject *args) 
+{
+	char *name;
+	PyObject *params;
+	PyPgParams p;
+	int ok;
+
+	if (_not_open(self)) return NULL;
+
+	if (!PyArg_ParseTuple(args,"sO:sendQueryPrepared", &name, &params)) 
+		return NULL;
+
+	if (_build_params(params, &p) < 0)
+		return NULL;
+
+	Py_BEGIN_ALLOW_THREADS
+	ok = PQsendQueryPrepared(self->connection, name, p.nParams, 
+				 (const char **)p.paramValues, p.paramLengths, 
+				 p.paramFormats, 1);
+	Py_END_ALLOW_THREADS
+
+	_free_params(&p);
+
+	return _send_status(self, ok);
+}
+
+#ifdef LIBPQ_HAS_PIPELINING
+static PyObject *
+connection_enter_pipeline(PyPgConnection *self, PyObject *unused) 
+{
+	if (_not_open(self)) return NULL;
+	return _send_status(self, PQenterPipelineMode(self->connection));
+}
+
+static PyObject *
+connection_exit_pipeline(PyPgConnection *self, PyObject *unused) 
+{
+	if (_not_open(self)) return NULL;
+	return PyBool_FromLong(PQexitPipelineMode(self->connection));
+}
+
+static PyObject *
+connection_pipeline_sync(PyPgConnection *self, PyObject *unused) 
+{
+	int ok;
+
+	if (_not_open(self)) return NULL;
+	Py_BEGIN_ALLOW_THREADS
+	ok = PQpipelineSync(self->connection);
+	Py_END_ALLOW_THREADS
+	return _send_status(self, ok);
+}
+#endif
+
+static PyObject *
+connection_get_result(PyPgConnection *self, PyObject *unused) 
+{
+	PGresult *res;
+
+	if (_not_open(self)) return NULL;
+
+	Py_BEGIN_ALLOW_THREADS
+	res = PQgetResult(self->connection);
+	Py_END_ALLOW_THREADS
+
+	if (res == NULL) {
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+	return PyPgResult_New(self, res);
+}
+
+#if LIBPQ_VERSION >= 90200
+static PyObject *
+connection_single_row_mode(PyPgConnection *self, PyObject *unused) 
+{
+	if (_not_open(self)) return NULL;
+	return PyBool_FromLong(PQsetSingleRowMode(self->connection));
+}
+#endif
+
+#ifdef LIBPQ_HAS_CHUNK_MODE
+static PyObject *
+connection_chunked_rows_mode(PyPgConnection *self, PyObject *args) 
+{
+	int chunk_size;
+
+	if (!PyArg_ParseTuple(args, "i:setChunkedRowsMode", &chunk_size)) 
+		return NULL;
+	if (_not_open(self)) return NULL;
+	return PyBool_FromLong(PQsetChunkedRowsMode(self->connection, 
+						    chunk_size));
+}
+#endif
+
+static PyObject *
+connection_put_copy_data(PyPgConnection *self, PyObject *args) 
+{
+	char *buffer;
+	Py_ssize_t nbytes;
+	PyObject *data;
+	int res;
+
+	if (!PyArg_ParseTuple(args, "O:putCopyData", &data)) 
+		return NULL;
+	if (PyBytes_AsStringAndSize(data, &buffer, &nbytes) < 0)
+		return NULL;
+	if (_not_open(self)) return NULL;
+
+	Py_BEGIN_ALLOW_THREADS
+	res = PQputCopyData(self->connection, buffer, nbytes);
+	Py_END_ALLOW_THREADS
+
+	if (res < 0) {
+		PyErr_SetString(PqErr_OperationalError, 
+				PQerrorMessage(self->connection));
+		return NULL;
+	}
+	return PyBool_FromLong(res);
+}
+
+static PyObject *
+connection_put_copy_end(PyPgConnection *self, PyObject *args) 
+{
+	char *errormsg = NULL;
+	int res;
+
+	if (!PyArg_ParseTuple(args, "|z:putCopyEnd", &errormsg)) 
+		return NULL;
+	if (_not_open(self)) return NULL;
+
+	Py_BEGIN_ALLOW_THREADS
+	res = PQputCopyEnd(self->connection, errormsg);
+	Py_END_ALLOW_THREADS
+
+	if (res < 0) {
+		PyErr_SetString(PqErr_OperationalError, 
+				PQerrorMessage(self->connection));
+		return NULL;
+	}
+	return PyBool_FromLong(res);
+}
+
+static PyObject *
+connection_get_copy_data(PyPgConnection *self, PyObject *unused) 
+{
+	char *buffer = NULL;
+	PyObject *data;
+	int res;
+
+	if (_not_open(self)) return NULL;
+
+	/* Only give up the GIL if we have to wait for the server */
+	res = PQgetCopyData(self->connection, &buffer, 1);
+	if (res == 0) {
+		Py_BEGIN_ALLOW_THREADS
+		res = PQgetCopyData(self->connection, &buffer, 0);
+		Py_END_ALLOW_THREADS
+	}
+	if (res == -1) {
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+	if (res < 0) {
+		PyErr_SetString(PqErr_OperationalError, 
+				PQerrorMessage(self->connection));
+		return NULL;
+	}
+	data = PyBytes_FromStringAndSize(buffer, res);
+	PQfreemem(buffer);
+	return data;
+}
+
+static PyObject *
+connection_cancel(PyPgConnection *self, PyObject *unused) 
+{
+	PGcancel *cancel;
+	char errbuf[256];
+	int ok;
+
+	if (_not_open(self)) return NULL;
+
+	if ((cancel = PQgetCancel(self->connection)) == NULL) {
+		PyErr_SetString(PqErr_OperationalError, 
+				"Unable to create cancel request");
+		return NULL;
+	}
+	Py_BEGIN_ALLOW_THREADS
+	ok = PQcancel(cancel, errbuf, sizeof(errbuf));
+	Py_END_ALLOW_THREADS
+	PQfreeCancel(cancel);
+
+	if (!ok) {
+		PyErr_SetString(PqErr_OperationalError, errbuf);
+		return NULL;
+	}
+	Py_INCREF(Py_None);
+	return Py_None;
+}
+
+static PyObject *
+connection_connect_poll(PyPgConnection *self, PyObject *unused) 
+{
+	PostgresPollingStatusType res;
+
+	if (_not_open(self)) return NULL;
+	res = PQconnectPoll(self->connection);
+	if (res == PGRES_POLLING_FAILED) {
+		PyErr_SetString(PqErr_DatabaseError, 
+				PQerrorMessage(self->connection));
+		return NULL;
+	}
+	if (res == PGRES_POLLING_OK && _check_connection(self->connection) < 0)
+		return NULL;
+	return pgconst_from_enum(PyPg_POLLING, res);
+}
+
+static PyObject *
+connection_set_nonblocking(PyPgConnection *self, PyObject *args) 
+{
+	int nonblocking;
+
+	if (!PyArg_ParseTuple(args, "i:setnonblocking", &nonblocking)) 
+		return NULL;
+	if (_not_open(self)) return NULL;
+	if (PQsetnonblocking(self->connection, nonblocking) < 0) {
+		PyErr_SetString(PqErr_OperationalError, 
+				PQerrorMessage(self->connection));
+		return NULL;
+	}
+	Py_INCREF(Py_None);
+	return Py_None;
+}
+
+static PyObject *
+connection_consume_input(PyPgConnection *self, PyObject *unused) 
+{
+	if (_not_open(self)) return NULL;
+	return _send_status(self, PQconsumeInput(self->connection));
+}
+
+static PyObject *
+connection_is_busy(PyPgConnection *self, PyObject *unused) 
+{
+	if (_not_open(self)) return NULL;
+	return PyBool_FromLong(PQisBusy(self->connection));
+}
+
+static PyObject *
+connection_flush(PyPgConnection *self, PyObject *unused) 
+{
+	int res;
+
+	if (_not_open(self)) return NULL;
+	res = PQflush(self->connection);
+	if (res < 0) {
+		PyErr_SetString(PqErr_OperationalError, 
+				PQerrorMessage(self->connection));
+		return NULL;
+	}
+	return PyBool_FromLong(res);
 }
 
 static PyObject *
@@ -418,6 +915,13 @@ get_transactionStatus(PyPgConnection *self)
 				 PQtransactionStatus(self->connection));
 }
 
+static PyObject *
+get_status(PyPgConnection *self)
+{
+	if (_not_open(self)) return NULL;
+	return pgconst_from_enum(PyPg_CONNECTION, PQstatus(self->connection));
+}
+
 static PyObject *
 _get_str_parameter(PyPgConnection *self, char *parameter)
 {
@@ -468,6 +972,52 @@ static PyMethodDef PyPgConnection_methods[] = {
 		PyDoc_STR("Close the connection")},
 	{"execute", (PyCFunction)connection_execute, METH_VARARGS,
 		PyDoc_STR("PgConnection.execute(cmd, args) -- Execute an SQL command")},
+	{"prepare", (PyCFunction)connection_prepare, METH_VARARGS,
+		PyDoc_STR("PgConnection.prepare(name, cmd, types) -- Create a named prepared statement")},
+	{"execPrepared", (PyCFunction)connection_exec_prepared, METH_VARARGS,
+		PyDoc_STR("PgConnection.execPrepared(name, args) -- Execute a named prepared statement")},
+	{"sendQuery", (PyCFunction)connection_send_query, METH_VARARGS,
+		PyDoc_STR("PgConnection.sendQuery(cmd, args) -- Send an SQL command without waiting for the result")},
+	{"sendPrepare", (PyCFunction)connection_send_prepare, METH_VARARGS,
+		PyDoc_STR("PgConnection.sendPrepare(name, cmd, types) -- Send a request to create a prepared statement without waiting for the result")},
+	{"sendQueryPrepared", (PyCFunction)connection_send_query_prepared, METH_VARARGS,
+		PyDoc_STR("PgConnection.sendQueryPrepared(name, args) -- Send a request to execute a prepared statement without waiting for the result")},
+#ifdef LIBPQ_HAS_PIPELINING
+	{"enterPipelineMode", (PyCFunction)connection_enter_pipeline, METH_NOARGS,
+		PyDoc_STR("Enter pipeline mode, allowing commands to be sent without waiting for prior results")},
+	{"exitPipelineMode", (PyCFunction)connection_exit_pipeline, METH_NOARGS,
+		PyDoc_STR("Exit pipeline mode, returning False if results are still pending")},
+	{"pipelineSync", (PyCFunction)connection_pipeline_sync, METH_NOARGS,
+		PyDoc_STR("Mark a synchronization point in a pipeline and flush it to the server")},
+#endif
+	{"getResult", (PyCFunction)connection_get_result, METH_NOARGS,
+		PyDoc_STR("Wait for the next result from a prior sendQuery(), returning None when the command is complete")},
+#if LIBPQ_VERSION >= 90200
+	{"setSingleRowMode", (PyCFunction)connection_single_row_mode, METH_NOARGS,
+		PyDoc_STR("Return the results of the current sendQuery() one row at a time")},
+#endif
+#ifdef LIBPQ_HAS_CHUNK_MODE
+	{"setChunkedRowsMode", (PyCFunction)connection_chunked_rows_mode, METH_VARARGS,
+		PyDoc_STR("PgConnection.setChunkedRowsMode(size) -- Return the results of the current sendQuery() in chunks of up to size rows")},
+#endif
+	{"putCopyData", (PyCFunction)connection_put_copy_data, METH_VARARGS,
+		PyDoc_STR("PgConnection.putCopyData(data) -- Send data to the server during COPY FROM STDIN")},
+	{"putCopyEnd", (PyCFunction)connection_put_copy_end, METH_VARARGS,
+		PyDoc_STR("PgConnection.putCopyEnd([errormsg]) -- End a COPY FROM STDIN, forcing it to fail if errormsg is given")},
+	{"getCopyData", (PyCFunction)connection_get_copy_data, METH_NOARGS,
+		PyDoc_STR("PgConnection.getCopyData() -- Receive the next row of COPY TO STDOUT data, or None when done")},
+	{"cancel", (PyCFunction)connection_cancel, METH_NOARGS,
+		PyDoc_STR("Request the server abandon processing of the current command")},
+	{"connectPoll", (PyCFunction)connection_connect_poll, METH_NOARGS,
+		PyDoc_STR("Advance a non-blocking connection attempt, returning the PGRES_POLLING state")},
+	{"setnonblocking", (PyCFunction)connection_set_nonblocking, METH_VARARGS,
+		PyDoc_STR("PgConnection.setnonblocking(flag) -- Set the non-blocking status of the connection")},
+	{"consumeInput", (PyCFunction)connection_consume_input, METH_NOARGS,
+		PyDoc_STR("Read any input available from the server")},
+	{"isBusy", (PyCFunction)connection_is_busy, METH_NOARGS,
+		PyDoc_STR("Returns True if getResult() would block waiting for input")},
+	{"flush", (PyCFunction)connection_flush, METH_NOARGS,
+		PyDoc_STR("Attempt to send queued output to the server, returning True if output remains")},
 	{"fileno", (PyCFunction)connection_fileno, METH_NOARGS,
 		PyDoc_STR("Returns socket file descriptor")},
 	{"setErrorVerbosity", (PyCFunction)connection_error_verb, METH_VARARGS,
@@ -502,6 +1052,11 @@ static PyGetSetDef PyPgConnection_getset[] = {
    "(idle, in a failed transaction block). UNKNOWN is reported if the\n"
    "connection is bad. ACTIVE is reported only when a query has been sent\n"
    "to the server and not yet completed."},
+	{"status",		(getter)get_status, NULL,
+   "Returns the status of the connection.\n\n"
+   "The status is CONNECTION_OK or CONNECTION_BAD, other than while a\n"
+   "non-blocking connection is being established. A connection that has\n"
+   "been lost is only reported as bad once libpq attempts to use it."},
 	{"tty",			(getter)get_tty},
 	{"user",		(getter)get_user},
 	{NULL}
@@ -569,6 +1124,38 @@ static PyPgConstEnumInit TRANS_init[] = {
 	{ NULL },
 };
 
+static PyPgConstEnumInit CONNECTION_init[] = {
+	{ "CONNECTION_OK", CONNECTION_OK },
+	{ "CONNECTION_BAD", CONNECTION_BAD },
+	{ "CONNECTION_STARTED", CONNECTION_STARTED },
+	{ "CONNECTION_MADE", CONNECTION_MADE },
+	{ "CONNECTION_AWAITING_RESPONSE", CONNECTION_AWAITING_RESPONSE },
+	{ "CONNECTION_AUTH_OK", CONNECTION_AUTH_OK },
+	{ "CONNECTION_SETENV", CONNECTION_SETENV },
+	{ "CONNECTION_SSL_STARTUP", CONNECTION_SSL_STARTUP },
+	{ "CONNECTION_NEEDED", CONNECTION_NEEDED },
+#if LIBPQ_VERSION >= 100000
+	{ "CONNECTION_CHECK_WRITABLE", CONNECTION_CHECK_WRITABLE },
+	{ "CONNECTION_CONSUME", CONNECTION_CONSUME },
+#endif
+#if LIBPQ_VERSION >= 120000
+	{ "CONNECTION_GSS_STARTUP", CONNECTION_GSS_STARTUP },
+#endif
+#if LIBPQ_VERSION >= 140000
+	{ "CONNECTION_CHECK_TARGET", CONNECTION_CHECK_TARGET },
+	{ "CONNECTION_CHECK_STANDBY", CONNECTION_CHECK_STANDBY },
+#endif
+	{ NULL },
+};
+
+static PyPgConstEnumInit POLLING_init[] = {
+	{ "PGRES_POLLING_FAILED", PGRES_POLLING_FAILED },
+	{ "PGRES_POLLING_READING", PGRES_POLLING_READING },
+	{ "PGRES_POLLING_WRITING", PGRES_POLLING_WRITING },
+	{ "PGRES_POLLING_OK", PGRES_POLLING_OK },
+	{ NULL },
+};
+
 void
 pg_connection_init(PyObject *module)
 {
@@ -603,6 +1190,17 @@ pg_connection_init(PyObject *module)
 	if (PyPg_TRANS == NULL)
 		return;
 
+	// PQstatus()
+	PyPg_CONNECTION = pgconst_make_enum(module, "CONNECTION", 
+					    CONNECTION_init);
+	if (PyPg_CONNECTION == NULL)
+		return;
+
+	// PQconnectPoll()
+	PyPg_POLLING = pgconst_make_enum(module, "PGRES_POLLING", POLLING_init);
+	if (PyPg_POLLING == NULL)
+		return;
+
 	Py_INCREF(&PyPgConnection_Type);
 	PyModule_AddObject(module, "PgConnection", 
 			   (PyObject *)&PyPgConnection_Type);
@@ -57,6 +57,9 @@ PyNumberMethods PyPgConst_as_number = {
 	0,		/*nb_inplace_add*/
 	0,		/*nb_inplace_subtract*/
 	0,		/*nb_inplace_multiply*/
+#if PY_MAJOR_VERSION < 3
+	0,		/*nb_inplace_divide*/
+#endif
 	0,		/*nb_inplace_remainder*/
 	0,		/*nb_inplace_power*/
 	0,		/*nb_inplace_lshift*/
@@ -68,6 +71,7 @@ PyNumberMethods PyPgConst_as_number = {
 	0,		/*nb_true_divide*/
 	0,		/*nb_inplace_floor_divide*/
 	0,		/*nb_inplace_true_divide*/
+	pgconst_as_int,	/*nb_index*/
 };
 
 PyTypeObject PyPgConst_Type = {
@@ -0,0 +1,608 @@
+/* vi:set sw=8 ts=8 noet showmode ai: */
+
+/*
+ * Native decoders for the core PG binary wire formats.
+ *
+ * These are exported to Python as ordinary functions (so they can be
+ * registered in a from_db map like any other converter), but result
+ * decoding recognises them and decodes values directly from the PGresult,
+ * avoiding the intermediate bytes and PgCell objects.
+ */
+
+#include "oclibpq.h"
+#include <limits.h>
+#include <stdint.h>
+#include <arpa/inet.h>
+
+static uint32_t
+_get_uint32(const char *value)
+{
+	uint32_t v;
+
+	memcpy(&v, value, sizeof(v));
+	return ntohl(v);
+}
+
+static uint16_t
+_get_uint16(const char *value)
+{
+	uint16_t v;
+
+	memcpy(&v, value, sizeof(v));
+	return ntohs(v);
+}
+
+static PY_LONG_LONG
+_get_int64(const char *value)
+{
+	unsigned PY_LONG_LONG v;
+
+	v = (unsigned PY_LONG_LONG)_get_uint32(value) << 32;
+	v |= _get_uint32(value + 4);
+	return (PY_LONG_LONG)v;
+}
+
+static int
+_check_len(const char *name, int len, int expect)
+{
+	if (len != expect) {
+		PyErr_Format(PqErr_InternalError,
+			"%s value has invalid length %d (expected %d)",
+			name, len, expect);
+		return -1;
+	}
+	return 0;
+}
+
+PyObject *
+pg_decode_value(int kind, const char *value, int len)
+{
+	switch (kind) {
+	case PGDECODE_BOOL:
+		if (_check_len("bool", len, 1) < 0)
+			return NULL;
+		return PyBool_FromLong(*value != 0);
+	case PGDECODE_INT2:
+		if (_check_len("int2", len, 2) < 0)
+			return NULL;
+		return PyInt_FromLong((int16_t)_get_uint16(value));
+	case PGDECODE_INT4:
+		if (_check_len("int4", len, 4) < 0)
+			return NULL;
+		return PyInt_FromLong((int32_t)_get_uint32(value));
+	case PGDECODE_INT8: {
+		PY_LONG_LONG v;
+
+		if (_check_len("int8", len, 8) < 0)
+			return NULL;
+		v = _get_int64(value);
+		if (v >= LONG_MIN && v <= LONG_MAX)
+			return PyInt_FromLong((long)v);
+		return PyLong_FromLongLong(v);
+	}
+	case PGDECODE_OID: {
+		unsigned long v;
+
+		if (_check_len("oid", len, 4) < 0)
+			return NULL;
+		v = _get_uint32(value);
+		if (v <= LONG_MAX)
+			return PyInt_FromLong((long)v);
+		return PyLong_FromUnsignedLong(v);
+	}
+	case PGDECODE_FLOAT4: {
+		uint32_t i;
+		float f;
+
+		if (_check_len("float4", len, 4) < 0)
+			return NULL;
+		i = _get_uint32(value);
+		memcpy(&f, &i, sizeof(f));
+		return PyFloat_FromDouble(f);
+	}
+	case PGDECODE_FLOAT8: {
+		PY_LONG_LONG i;
+		double d;
+
+		if (_check_len("float8", len, 8) < 0)
+			return NULL;
+		i = _get_int64(value);
+		memcpy(&d, &i, sizeof(d));
+		return PyFloat_FromDouble(d);
+	}
+	case PGDECODE_UTF8:
+		return PyUnicode_DecodeUTF8(value, len, "strict");
+	case PGDECODE_BYTES:
+		return PyBytes_FromStringAndSize(value, len);
+	case PGDECODE_BYTEA:
+		return PyPgBytea_FromStringAndSize(value, len);
+	}
+	PyErr_Format(PyExc_SystemError, "unknown decoder kind %d", kind);
+	return NULL;
+}
+
+static PyObject *
+_decode_arg(int kind, PyObject *arg)
+{
+	char *value;
+	Py_ssize_t len;
+
+	if (PyBytes_AsStringAndSize(arg, &value, &len) < 0)
+		return NULL;
+	return pg_decode_value(kind, value, len);
+}
+
+static PyObject *
+unpack_bool(PyObject *unused, PyObject *arg)
+{
+	return _decode_arg(PGDECODE_BOOL, arg);
+}
+
+static PyObject *
+unpack_int2(PyObject *unused, PyObject *arg)
+{
+	return _decode_arg(PGDECODE_INT2, arg);
+}
+
+static PyObject *
+unpack_int4(PyObject *unused, PyObject *arg)
+{
+	return _decode_arg(PGDECODE_INT4, arg);
+}
+
+static PyObject *
+unpack_int8(PyObject *unused, PyObject *arg)
+{
+	return _decode_arg(PGDECODE_INT8, arg);
+}
+
+static PyObject *
+unpack_oid(PyObject *unused, PyObject *arg)
+{
+	return _decode_arg(PGDECODE_OID, arg);
+}
+
+static PyObject *
+unpack_float4(PyObject *unused, PyObject *arg)
+{
+	return _decode_arg(PGDECODE_FLOAT4, arg);
+}
+
+static PyObject *
+unpack_float8(PyObject *unused, PyObject *arg)
+{
+	return _decode_arg(PGDECODE_FLOAT8, arg);
+}
+
+static PyObject *
+unpack_utf8(PyObject *unused, PyObject *arg)
+{
+	return _decode_arg(PGDECODE_UTF8, arg);
+}
+
+/*
+ * Called when a from_db converter has failed on a value: replace the
+ * exception with an InternalError identifying the value and its column
+ * (anything with name and type attributes), keeping the traceback.
+ * InterfaceError, raised when there is no converter for the type, and
+ * exceptions that are not Exception subclasses are left alone.
+ */
+void
+pg_convert_error(const char *value, int len, PyObject *column)
+{
+	PyObject *exc_type, *exc, *tb, *args = NULL, *fmt, *msg = NULL;
+#if PY_MAJOR_VERSION >= 3
+	PyObject *orig;
+#endif
+
+	if (!PyErr_ExceptionMatches(PyExc_Exception) ||
+	    PyErr_ExceptionMatches(PqErr_InterfaceError))
+		return;
+	PyErr_Fetch(&exc_type, &exc, &tb);
+	PyErr_NormalizeException(&exc_type, &exc, &tb);
+	if (exc != NULL)
+		args = Py_BuildValue("(NNNO)",
+				     PyBytes_FromStringAndSize(value, len),
+				     PyObject_GetAttrString(column, "name"),
+				     PyObject_GetAttrString(column, "type"),
+				     exc);
+	if (args != NULL) {
+		fmt = PyString_FromString("failed to convert column value %r "
+					  "(column %r, type %r): %s");
+		if (fmt != NULL)
+			msg = PyString_Format(fmt, args);
+		Py_XDECREF(fmt);
+		Py_DECREF(args);
+	}
+	if (msg == NULL) {
+		/* Report the converter's own exception instead */
+		PyErr_Clear();
+		PyErr_Restore(exc_type, exc, tb);
+		return;
+	}
+	Py_DECREF(exc_type);
+	exc_type = PqErr_InternalError;
+	Py_INCREF(exc_type);
+#if PY_MAJOR_VERSION >= 3
+	/* Chain the converter's exception, as raising in an except would */
+	orig = exc;
+	exc = msg;
+	PyErr_NormalizeException(&exc_type, &exc, &tb);
+	if (exc != NULL && PyExceptionInstance_Check(exc))
+		PyException_SetContext(exc, orig);
+	else
+		Py_DECREF(orig);
+#else
+	Py_DECREF(exc);
+	exc = msg;
+#endif
+	PyErr_Restore(exc_type, exc, tb);
+}
+
+/*
+ * Decode the complete tuples in a buffer of binary COPY data, starting at
+ * offset, and passing each field through the corresponding converter (as
+ * for PgResult.rows()). Returns a (rows, offset) tuple, where offset is the
+ * start of the first incomplete tuple, or of the trailer. If given, columns
+ * describes the fields for converter error messages.
+ */
+static PyObject *
+unpack_copy_tuples(PyObject *unused, PyObject *args)
+{
+	PyObject *converters, *data, *columns = Py_None, *rows = NULL;
+	PyObject *row, *value, *cell, *cvt;
+	Py_ssize_t offset = 0, size, pos;
+	char *buf;
+	int *kinds = NULL;
+	int ncolumns, nfields, i;
+	int32_t len;
+
+	if (!PyArg_ParseTuple(args, "OO|nO:unpack_copy_tuples", 
+			      &converters, &data, &offset, &columns)) 
+		return NULL;
+	if (PyBytes_AsStringAndSize(data, &buf, &size) < 0)
+		return NULL;
+	if (offset < 0 || offset > size) {
+		PyErr_SetString(PyExc_ValueError, "offset out of range");
+		return NULL;
+	}
+	converters = PySequence_Fast(converters, 
+				     "converters must be a sequence");
+	if (converters == NULL)
+		return NULL;
+	ncolumns = PySequence_Fast_GET_SIZE(converters);
+	if (columns != Py_None) {
+		columns = PySequence_Fast(columns, 
+					  "columns must be a sequence");
+		if (columns == NULL)
+			goto failed;
+		if (PySequence_Fast_GET_SIZE(columns) != ncolumns) {
+			PyErr_SetString(PyExc_ValueError, 
+				"columns and converters differ in length");
+			goto failed;
+		}
+	} else
+		columns = NULL;
+	if ((kinds = PyMem_Malloc(sizeof(int) * (ncolumns + 1))) == NULL) {
+		PyErr_NoMemory();
+		goto failed;
+	}
+	for (i = 0; i < ncolumns; ++i)
+		kinds[i] = pg_decode_kind(PySequence_Fast_GET_ITEM(converters, i));
+	if ((rows = PyList_New(0)) == NULL)
+		goto failed;
+
+	while (offset + 2 <= size) {
+		nfields = (int16_t)_get_uint16(buf + offset);
+		if (nfields == -1)
+			break;
+		if (nfields != ncolumns) {
+			PyErr_Format(PqErr_InternalError,
+				"COPY tuple has %d fields, expected %d",
+				nfields, ncolumns);
+			goto failed;
+		}
+		/* Make sure the whole tuple is in the buffer */
+		pos = offset + 2;
+		for (i = 0; i < nfields && pos + 4 <= size; ++i) {
+			len = (int32_t)_get_uint32(buf + pos);
+			if (len < -1) {
+				PyErr_Format(PqErr_InternalError,
+					"COPY field has invalid length %d", 
+					(int)len);
+				goto failed;
+			}
+			pos += 4;
+			if (len > 0)
+				pos += len;
+		}
+		if (i < nfields || pos > size)
+			break;
+
+		if ((row = PyTuple_New(nfields)) == NULL)
+			goto failed;
+		pos = offset + 2;
+		for (i = 0; i < nfields; ++i) {
+			len = (int32_t)_get_uint32(buf + pos);
+			pos += 4;
+			if (len < 0) {
+				Py_INCREF(Py_None);
+				value = Py_None;
+			} else if (kinds[i] != PGDECODE_PYTHON) {
+				value = pg_decode_value(kinds[i], buf + pos, len);
+			} else {
+				cvt = PySequence_Fast_GET_ITEM(converters, i);
+				cell = PyBytes_FromStringAndSize(buf + pos, len);
+				if (cell == NULL) {
+					value = NULL;
+				} else {
+					value = PyObject_CallFunctionObjArgs(cvt, 
+							cell, NULL);
+					Py_DECREF(cell);
+					if (value == NULL && columns != NULL)
+						pg_convert_error(buf + pos, len,
+						    PySequence_Fast_GET_ITEM(
+							columns, i));
+				}
+			}
+			if (value == NULL) {
+				Py_DECREF(row);
+				goto failed;
+			}
+			PyTuple_SET_ITEM(row, i, value);
+			if (len > 0)
+				pos += len;
+		}
+		if (PyList_Append(rows, row) < 0) {
+			Py_DECREF(row);
+			goto failed;
+		}
+		Py_DECREF(row);
+		offset = pos;
+	}
+	PyMem_Free(kinds);
+	Py_DECREF(converters);
+	Py_XDECREF(columns);
+	return Py_BuildValue("(Nn)", rows, offset);
+
+failed:
+	if (kinds != NULL)
+		PyMem_Free(kinds);
+	Py_XDECREF(rows);
+	Py_DECREF(converters);
+	Py_XDECREF(columns);
+	return NULL;
+}
+
+static PyMethodDef PyPgDecode_methods[] = {
+	{"unpack_bool", (PyCFunction)unpack_bool, METH_O,
+		PyDoc_STR("Decode a binary PG bool")},
+	{"unpack_int2", (PyCFunction)unpack_int2, METH_O,
+		PyDoc_STR("Decode a binary PG int2")},
+	{"unpack_int4", (PyCFunction)unpack_int4, METH_O,
+		PyDoc_STR("Decode a binary PG int4")},
+	{"unpack_int8", (PyCFunction)unpack_int8, METH_O,
+		PyDoc_STR("Decode a binary PG int8")},
+	{"unpack_oid", (PyCFunction)unpack_oid, METH_O,
+		PyDoc_STR("Decode a binary PG oid")},
+	{"unpack_float4", (PyCFunction)unpack_float4, METH_O,
+		PyDoc_STR("Decode a binary PG float4")},
+	{"unpack_float8", (PyCFunction)unpack_float8, METH_O,
+		PyDoc_STR("Decode a binary PG float8")},
+	{"unpack_utf8", (PyCFunction)unpack_utf8, METH_O,
+		PyDoc_STR("Decode UTF-8 encoded PG text")},
+	{"unpack_copy_tuples", (PyCFunction)unpack_copy_tuples, METH_VARARGS,
+		PyDoc_STR("unpack_copy_tuples(converters, data[, offset[, columns]]) -- Decode the complete tuples in binary COPY data, returning (rows, offset)")},
+	{NULL, NULL}
+};
+
+/*
+ * Map a from_db converter onto a native decoder, returning PGDECODE_PYTHON
+ * if the converter must be called from Python.
+ */
+int
+pg_decode_kind(PyObject *cvt)
+{
+	PyCFunction meth;
+
+	if (cvt == (PyObject *)&PyPgBytea_Type)
+		return PGDECODE_BYTEA;
+	if (cvt == (PyObject *)&PyBytes_Type)
+		return PGDECODE_BYTES;
+	if (!PyCFunction_Check(cvt))
+		return PGDECODE_PYTHON;
+	meth = PyCFunction_GET_FUNCTION(cvt);
+	if (meth == (PyCFunction)unpack_bool)
+		return PGDECODE_BOOL;
+	if (meth == (PyCFunction)unpack_int2)
+		return PGDECODE_INT2;
+	if (meth == (PyCFunction)unpack_int4)
+		return PGDECODE_INT4;
+	if (meth == (PyCFunction)unpack_int8)
+		return PGDECODE_INT8;
+	if (meth == (PyCFunction)unpack_oid)
+		return PGDECODE_OID;
+	if (meth == (PyCFunction)unpack_float4)
+		return PGDECODE_FLOAT4;
+	if (meth == (PyCFunction)unpack_float8)
+		return PGDECODE_FLOAT8;
+	if (meth == (PyCFunction)unpack_utf8)
+		return PGDECODE_UTF8;
+	return PGDECODE_PYTHON;
+}
+
+static PyObject *array_type;
+
+/*
+ * Return the array.array typecode and element size used for a column of
+ * fixed width binary values, or 0 if the type has no columnar form.
+ * Dates and timestamps are left as raw PG epoch offsets (days, or
+ * microseconds or seconds, since 2000-01-01, depending on
+ * integer_datetimes), and times as offsets from midnight.
+ */
+static char
+_column_typecode(Oid type, int integer_datetimes, int *size)
+{
+	switch (type) {
+	case BOOLOID:
+		*size = 1;
+		return 'B';
+	case INT2OID:
+		*size = 2;
+		return 'h';
+	case INT4OID:
+	case DATEOID:
+		*size = 4;
+		return sizeof(int) == 4 ? 'i' : 0;
+	case OIDOID:
+		*size = 4;
+		return sizeof(int) == 4 ? 'I' : 0;
+	case FLOAT4OID:
+		*size = 4;
+		return 'f';
+	case TIMEOID:
+	case TIMESTAMPOID:
+	case TIMESTAMPTZOID:
+		*size = 8;
+		if (!integer_datetimes)
+			return 'd';
+		/* FALLTHROUGH */
+	case INT8OID:
+		*size = 8;
+		if (sizeof(long) == 8)
+			return 'l';
+#if PY_MAJOR_VERSION >= 3
+		return 'q';
+#else
+		return 0;
+#endif
+	case FLOAT8OID:
+		*size = 8;
+		return 'd';
+	}
+	return 0;
+}
+
+/* Create an array.array of the given typecode from a bytes buffer */
+PyObject *
+pg_bytes_to_array(char *typecode, PyObject *buf)
+{
+	return PyObject_CallFunction(array_type, "sO", typecode, buf);
+}
+
+/*
+ * Decode a whole column of fixed width binary values (from row "start"
+ * onwards) into an array.array, returning a (values, nulls) tuple. NULL
+ * values are stored as zero, and flagged with a 1 in the nulls array.
+ * Returns Py_None (with a new reference) if the column type has no
+ * columnar form.
+ */
+PyObject *
+pg_decode_column(PGresult *result, int col, int start, int integer_datetimes)
+{
+	PyObject *values_buf = NULL, *nulls_buf = NULL;
+	PyObject *values = NULL, *nulls = NULL, *res;
+	unsigned char *vp, *np;
+	const char *value;
+	char typecode[2];
+	int size, nrows, row, len;
+
+	typecode[0] = _column_typecode(PQftype(result, col), integer_datetimes,
+				       &size);
+	typecode[1] = '\0';
+	if (typecode[0] == 0 || PQfformat(result, col) != 1) {
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+	nrows = PQntuples(result) - start;
+	if (nrows < 0)
+		nrows = 0;
+	values_buf = PyBytes_FromStringAndSize(NULL, (Py_ssize_t)nrows * size);
+	if (values_buf == NULL)
+		goto failed;
+	nulls_buf = PyBytes_FromStringAndSize(NULL, nrows);
+	if (nulls_buf == NULL)
+		goto failed;
+	vp = (unsigned char *)PyBytes_AsString(values_buf);
+	np = (unsigned char *)PyBytes_AsString(nulls_buf);
+
+	for (row = 0; row < nrows; ++row, vp += size) {
+		if (PQgetisnull(result, start + row, col)) {
+			memset(vp, 0, size);
+			np[row] = 1;
+			continue;
+		}
+		np[row] = 0;
+		value = PQgetvalue(result, start + row, col);
+		len = PQgetlength(result, start + row, col);
+		if (len != size) {
+			PyErr_Format(PqErr_InternalError,
+				"column %d value has invalid length %d "
+				"(expected %d)", col, len, size);
+			goto failed;
+		}
+		switch (size) {
+		case 1:
+			*vp = *value != 0;
+			break;
+		case 2: {
+			uint16_t v = _get_uint16(value);
+			memcpy(vp, &v, size);
+			break;
+		}
+		case 4: {
+			uint32_t v = _get_uint32(value);
+			memcpy(vp, &v, size);
+			break;
+		}
+		case 8: {
+			PY_LONG_LONG v = _get_int64(value);
+			memcpy(vp, &v, size);
+			break;
+		}
+		}
+	}
+
+	values = pg_bytes_to_array(typecode, values_buf);
+	if (values == NULL)
+		goto failed;
+	nulls = pg_bytes_to_array("B", nulls_buf);
+	if (nulls == NULL)
+		goto failed;
+	Py_DECREF(values_buf);
+	Py_DECREF(nulls_buf);
+	res = PyTuple_Pack(2, values, nulls);
+	Py_DECREF(values);
+	Py_DECREF(nulls);
+	return res;
+
+failed:
+	Py_XDECREF(values_buf);
+	Py_XDECREF(nulls_buf);
+	Py_XDECREF(values);
+	Py_XDECREF(nulls);
+	return NULL;
+}
+
+void
+pg_decode_init(PyObject *module)
+{
+	PyObject *array_module;
+	PyMethodDef *def;
+	PyObject *fn;
+
+	if ((array_module = PyImport_ImportModule("array")) == NULL)
+		return;
+	array_type = PyObject_GetAttrString(array_module, "array");
+	Py_DECREF(array_module);
+	if (array_type == NULL)
+		return;
+
+	for (def = PyPgDecode_methods; def->ml_name != NULL; ++def) {
+		fn = PyCFunction_NewEx(def, NULL, NULL);
+		if (fn == NULL)
+			return;
+		if (PyModule_AddObject(module, def->ml_name, fn) < 0)
+			return;
+	}
+}
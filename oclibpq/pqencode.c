@@ -0,0 +1,482 @@
+/* vi:set sw=8 ts=8 noet showmode ai: */
+
+/*
+ * Native encoders for query parameters of the core Python types.
+ *
+ * PgConnection.execute() and friends accept these values directly, and
+ * encode them into the PG binary wire format exactly as the default to_db
+ * functions would (integer datetimes are assumed), avoiding the call into
+ * Python and the intermediate (oid, data) tuple. The connection object
+ * decides which types are passed unconverted - a user-registered to_db
+ * function always takes precedence.
+ */
+
+#include "oclibpq.h"
+#include <limits.h>
+#include <stdint.h>
+#include <arpa/inet.h>
+#include <datetime.h>
+
+/* Python 2's datetime.h lacks this */
+#ifndef _PyDateTime_HAS_TZINFO
+#define _PyDateTime_HAS_TZINFO(o) (((_PyDateTime_BaseTZInfo *)(o))->hastzinfo)
+#endif
+
+#define NUMERIC_POS	0x0000
+#define NUMERIC_NEG	0x4000
+#define NUMERIC_NAN	0xC000
+
+/* date(2000, 1, 1).toordinal() - PG dates and timestamps count from here */
+#define PG_EPOCH_ORDINAL 730120
+
+static PyObject *decimal_type;
+
+static void
+_put_uint16(char *buf, uint16_t v)
+{
+	v = htons(v);
+	memcpy(buf, &v, sizeof(v));
+}
+
+static void
+_put_uint32(char *buf, uint32_t v)
+{
+	v = htonl(v);
+	memcpy(buf, &v, sizeof(v));
+}
+
+static void
+_put_int64(char *buf, PY_LONG_LONG v)
+{
+	_put_uint32(buf, (uint32_t)((unsigned PY_LONG_LONG)v >> 32));
+	_put_uint32(buf + 4, (uint32_t)v);
+}
+
+static int
+_value_error(PyObject *value, const char *msg)
+{
+	PyObject *repr;
+
+	if ((repr = PyObject_Repr(value)) == NULL)
+		return -1;
+#if PY_MAJOR_VERSION >= 3
+	PyErr_Format(PqErr_DataError, "column value %U: %s", repr, msg);
+#else
+	PyErr_Format(PqErr_DataError, "column value %s: %s",
+		     PyString_AS_STRING(repr), msg);
+#endif
+	Py_DECREF(repr);
+	return -1;
+}
+
+/* Days since 0001-01-01 (day 1), as per date.toordinal() */
+static long
+_ordinal(int year, int month, int day)
+{
+	static const int days_before_month[] = {
+		0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334,
+	};
+	long y = year - 1;
+	long days;
+
+	days = y * 365 + y / 4 - y / 100 + y / 400 +
+		days_before_month[month - 1] + day;
+	if (month > 2 &&
+	    ((year % 4 == 0 && year % 100 != 0) || year % 400 == 0))
+		++days;
+	return days;
+}
+
+/*
+ * Return true if the object is a decimal.Decimal. The decimal module is
+ * only consulted once something else has imported it.
+ */
+static int
+_is_decimal(PyObject *param)
+{
+	PyObject *module;
+
+	if (decimal_type == NULL) {
+		module = PyDict_GetItemString(PyImport_GetModuleDict(),
+					      "decimal");
+		if (module == NULL)
+			return 0;
+		decimal_type = PyObject_GetAttrString(module, "Decimal");
+		if (decimal_type == NULL) {
+			PyErr_Clear();
+			return 0;
+		}
+	}
+	return PyObject_TypeCheck(param, (PyTypeObject *)decimal_type);
+}
+
+static int
+_exponent_is(PyObject *exp, const char *code)
+{
+#if PY_MAJOR_VERSION >= 3
+	return PyUnicode_CompareWithASCIIString(exp, code) == 0;
+#else
+	return strcmp(PyString_AS_STRING(exp), code) == 0;
+#endif
+}
+
+/*
+ * Encode a Decimal as a PG numeric (see cvtdecimal.pack_numeric) - the
+ * digits are grouped into base 10000 words, aligned on the decimal point.
+ */
+static PyObject *
+_encode_numeric(PyObject *param)
+{
+	PyObject *t, *digits, *exp_obj, *data = NULL;
+	long sign, exp, weight, ndigits, pad, nwords, offset, i;
+	uint16_t word;
+	char *buf;
+
+	if ((t = PyObject_CallMethod(param, "as_tuple", NULL)) == NULL)
+		return NULL;
+	if (!PyTuple_Check(t) || PyTuple_GET_SIZE(t) != 3) {
+		PyErr_SetString(PyExc_TypeError,
+				"Decimal.as_tuple() must return a 3-tuple");
+		goto done;
+	}
+	sign = PyInt_AsLong(PyTuple_GET_ITEM(t, 0));
+	digits = PyTuple_GET_ITEM(t, 1);
+	exp_obj = PyTuple_GET_ITEM(t, 2);
+	if (sign == -1 && PyErr_Occurred())
+		goto done;
+	if (PyString_Check(exp_obj)) {
+		if (_exponent_is(exp_obj, "n") || _exponent_is(exp_obj, "N")) {
+			data = PyBytes_FromStringAndSize(NULL, 8);
+			if (data != NULL) {
+				buf = PyBytes_AS_STRING(data);
+				_put_uint16(buf, 0);
+				_put_uint16(buf + 2, 0);
+				_put_uint16(buf + 4, NUMERIC_NAN);
+				_put_uint16(buf + 6, 0);
+			}
+		} else if (_exponent_is(exp_obj, "F"))
+			_value_error(param, "No conversion available for "
+					    "Decimal(Infinity)");
+		else
+			_value_error(param, "Unsupported Decimal");
+		goto done;
+	}
+	exp = PyInt_AsLong(exp_obj);
+	if (exp == -1 && PyErr_Occurred())
+		goto done;
+	if (!PyTuple_Check(digits)) {
+		PyErr_SetString(PyExc_TypeError,
+				"Decimal.as_tuple() digits must be a tuple");
+		goto done;
+	}
+	/*
+	 * Pad the digits with zeros so the exponent is a multiple of 4, then
+	 * split into words from the right.
+	 */
+	ndigits = PyTuple_GET_SIZE(digits);
+	pad = ((exp % 4) + 4) % 4;
+	nwords = (ndigits + pad + 3) / 4;
+	offset = nwords * 4 - (ndigits + pad);
+	weight = nwords - 1 + (exp - pad) / 4;
+	if (nwords > 0xffff || weight < -0x8000 || weight > 0x7fff ||
+	    -exp > 0xffff) {
+		_value_error(param, "numeric out of range");
+		goto done;
+	}
+	data = PyBytes_FromStringAndSize(NULL, 8 + nwords * 2);
+	if (data == NULL)
+		goto done;
+	buf = PyBytes_AS_STRING(data);
+	_put_uint16(buf, (uint16_t)nwords);
+	_put_uint16(buf + 2, (uint16_t)weight);
+	_put_uint16(buf + 4, sign ? NUMERIC_NEG : NUMERIC_POS);
+	_put_uint16(buf + 6, exp < 0 ? (uint16_t)-exp : 0);
+	word = 0;
+	for (i = 0; i < nwords * 4; ++i) {
+		long d = 0, n = i - offset;
+
+		if (n >= 0 && n < ndigits) {
+			d = PyInt_AsLong(PyTuple_GET_ITEM(digits, n));
+			if (d == -1 && PyErr_Occurred()) {
+				Py_CLEAR(data);
+				goto done;
+			}
+		}
+		word = word * 10 + d;
+		if (i % 4 == 3) {
+			_put_uint16(buf + 8 + (i / 4) * 2, word);
+			word = 0;
+		}
+	}
+done:
+	Py_DECREF(t);
+	return data;
+}
+
+/*
+ * Point at the contents of a buffer protocol object (bytearray, memoryview,
+ * mmap...) without copying them. A memoryview holding the buffer export
+ * is returned in *owned, and must be kept until the query has been sent
+ * (this also stops a bytearray being resized in the meantime).
+ */
+int
+pg_encode_buffer(PyObject *param, char **value, int *len, PyObject **owned)
+{
+	PyObject *view;
+	Py_buffer *buffer;
+
+	if ((view = PyMemoryView_FromObject(param)) == NULL)
+		return -1;
+	buffer = PyMemoryView_GET_BUFFER(view);
+	if (!PyBuffer_IsContiguous(buffer, 'C')) {
+		Py_DECREF(view);
+		PyErr_SetString(PyExc_TypeError,
+				"buffer parameters must be contiguous");
+		return -1;
+	}
+	if (buffer->len > INT_MAX) {
+		PyErr_Format(PqErr_DataError, 
+			     "%s parameter too large (%zd bytes)",
+			     Py_TYPE(param)->tp_name, buffer->len);
+		Py_DECREF(view);
+		return -1;
+	}
+	*owned = view;
+	*len = (int)buffer->len;
+	*value = buffer->buf;
+	return 0;
+}
+
+/*
+ * Encode a single parameter of one of the natively supported types in
+ * binary format. Fixed width values are written to scratch (which must
+ * have room for PGENCODE_SCRATCH bytes), otherwise a new reference to the
+ * object holding the encoded value is returned in *owned, and must be
+ * kept until the query has been sent. If value is NULL, only the type
+ * OID is determined.
+ */
+int
+pg_encode_param(PyObject *param, Oid *oid, char **value, int *len,
+		char *scratch, PyObject **owned)
+{
+	PyObject *data;
+
+	if (PyBool_Check(param)) {
+		*oid = BOOLOID;
+		if (value == NULL)
+			return 0;
+		scratch[0] = (param == Py_True);
+		*len = 1;
+		*value = scratch;
+		return 0;
+	}
+#if PY_MAJOR_VERSION < 3
+	if (PyInt_Check(param)) {
+		long v = PyInt_AS_LONG(param);
+
+		if (v > 0x7fffffffL || v < -0x7fffffffL - 1) {
+			*oid = INT8OID;
+			if (value == NULL)
+				return 0;
+			_put_int64(scratch, v);
+			*len = 8;
+		} else {
+			*oid = INT4OID;
+			if (value == NULL)
+				return 0;
+			_put_uint32(scratch, (uint32_t)v);
+			*len = 4;
+		}
+		*value = scratch;
+		return 0;
+	}
+#endif
+	if (PyLong_Check(param)) {
+		PY_LONG_LONG v;
+
+		*oid = INT8OID;
+		if (value == NULL)
+			return 0;
+		v = PyLong_AsLongLong(param);
+		if (v == -1 && PyErr_Occurred()) {
+			if (!PyErr_ExceptionMatches(PyExc_OverflowError))
+				return -1;
+			PyErr_Clear();
+			return _value_error(param, "out of range for int8");
+		}
+		_put_int64(scratch, v);
+		*len = 8;
+		*value = scratch;
+		return 0;
+	}
+	if (PyFloat_Check(param)) {
+		double d = PyFloat_AS_DOUBLE(param);
+		PY_LONG_LONG v;
+
+		*oid = FLOAT8OID;
+		if (value == NULL)
+			return 0;
+		memcpy(&v, &d, sizeof(v));
+		_put_int64(scratch, v);
+		*len = 8;
+		*value = scratch;
+		return 0;
+	}
+	if (PyUnicode_Check(param)) {
+		*oid = TEXTOID;
+		if (value == NULL)
+			return 0;
+		if ((data = PyUnicode_AsUTF8String(param)) == NULL)
+			return -1;
+		*owned = data;
+		*len = PyBytes_GET_SIZE(data);
+		*value = PyBytes_AS_STRING(data);
+		return 0;
+	}
+	if (PyPgBytea_Check(param)) {
+		*oid = BYTEAOID;
+		if (value == NULL)
+			return 0;
+		*len = PyBytes_GET_SIZE(param);
+		*value = PyBytes_AS_STRING(param);
+		return 0;
+	}
+	if (PyDateTime_Check(param)) {
+		PY_LONG_LONG usecs;
+
+		*oid = TIMESTAMPOID;
+		if (value == NULL)
+			return 0;
+		if (_PyDateTime_HAS_TZINFO(param) &&
+		    ((PyDateTime_DateTime *)param)->tzinfo != Py_None)
+			return _value_error(param, "can't subtract offset-naive "
+					    "and offset-aware datetimes");
+		usecs = _ordinal(PyDateTime_GET_YEAR(param),
+				 PyDateTime_GET_MONTH(param),
+				 PyDateTime_GET_DAY(param)) - PG_EPOCH_ORDINAL;
+		usecs = usecs * 86400 +
+			PyDateTime_DATE_GET_HOUR(param) * 3600 +
+			PyDateTime_DATE_GET_MINUTE(param) * 60 +
+			PyDateTime_DATE_GET_SECOND(param);
+		usecs = usecs * 1000000 +
+			PyDateTime_DATE_GET_MICROSECOND(param);
+		_put_int64(scratch, usecs);
+		*len = 8;
+		*value = scratch;
+		return 0;
+	}
+	if (PyDate_Check(param)) {
+		*oid = DATEOID;
+		if (value == NULL)
+			return 0;
+		_put_uint32(scratch, (uint32_t)
+			    (_ordinal(PyDateTime_GET_YEAR(param),
+				      PyDateTime_GET_MONTH(param),
+				      PyDateTime_GET_DAY(param)) -
+			     PG_EPOCH_ORDINAL));
+		*len = 4;
+		*value = scratch;
+		return 0;
+	}
+	if (PyTime_Check(param)) {
+		PY_LONG_LONG usecs;
+
+		*oid = TIMEOID;
+		if (value == NULL)
+			return 0;
+		usecs = PyDateTime_TIME_GET_HOUR(param) * 3600 +
+			PyDateTime_TIME_GET_MINUTE(param) * 60 +
+			PyDateTime_TIME_GET_SECOND(param);
+		usecs = usecs * 1000000 +
+			PyDateTime_TIME_GET_MICROSECOND(param);
+		_put_int64(scratch, usecs);
+		*len = 8;
+		*value = scratch;
+		return 0;
+	}
+	if (_is_decimal(param)) {
+		*oid = NUMERICOID;
+		if (value == NULL)
+			return 0;
+		if ((data = _encode_numeric(param)) == NULL)
+			return -1;
+		*owned = data;
+		*len = PyBytes_GET_SIZE(data);
+		*value = PyBytes_AS_STRING(data);
+		return 0;
+	}
+	if (PyObject_CheckBuffer(param)) {
+		*oid = BYTEAOID;
+		if (value == NULL)
+			return 0;
+		return pg_encode_buffer(param, value, len, owned);
+	}
+	PyErr_Format(PyExc_TypeError, "unsupported parameter type %s",
+		     Py_TYPE(param)->tp_name);
+	return -1;
+}
+
+static PyObject *
+param_types(PyObject *unused, PyObject *params)
+{
+	PyObject *types, *param, *type;
+	Py_ssize_t i, n;
+	Oid oid;
+
+	if ((params = PySequence_Fast(params,
+			"parameters must be a sequence")) == NULL)
+		return NULL;
+	n = PySequence_Fast_GET_SIZE(params);
+	if ((types = PyList_New(n)) == NULL)
+		goto error;
+	for (i = 0; i < n; ++i) {
+		param = PySequence_Fast_GET_ITEM(params, i);
+		if (param == Py_None ||
+		    (PyBytes_Check(param) && !PyPgBytea_Check(param))) {
+			type = Py_None;
+			Py_INCREF(type);
+		} else if (PyTuple_Check(param) && PyTuple_GET_SIZE(param) > 0) {
+			type = PyTuple_GET_ITEM(param, 0);
+			Py_INCREF(type);
+		} else {
+			if (pg_encode_param(param, &oid, NULL, NULL,
+					    NULL, NULL) < 0)
+				goto error;
+			if ((type = PyInt_FromLong(oid)) == NULL)
+				goto error;
+		}
+		PyList_SET_ITEM(types, i, type);
+	}
+	Py_DECREF(params);
+	return types;
+
+error:
+	Py_XDECREF(types);
+	Py_DECREF(params);
+	return NULL;
+}
+
+static PyMethodDef PyPgEncode_methods[] = {
+	{"param_types", (PyCFunction)param_types, METH_O,
+		PyDoc_STR("param_types(params) -- Return the type OID of each query parameter (None if unspecified)")},
+	{NULL, NULL}
+};
+
+void
+pg_encode_init(PyObject *module)
+{
+	PyMethodDef *def;
+	PyObject *fn;
+
+	PyDateTime_IMPORT;
+	if (PyDateTimeAPI == NULL)
+		return;
+
+	for (def = PyPgEncode_methods; def->ml_name != NULL; ++def) {
+		fn = PyCFunction_NewEx(def, NULL, NULL);
+		if (fn == NULL)
+			return;
+		if (PyModule_AddObject(module, def->ml_name, fn) < 0)
+			return;
+	}
+}
@@ -79,6 +79,27 @@ get_oid(PyPgResult *self)
 	return Py_None;
 }
 
+static PyObject *
+get_memorySize(PyPgResult *self)
+{
+#if LIBPQ_VERSION >= 120000
+	return PyInt_FromLong((long)PQresultMemorySize(self->result));
+#else
+	/* Estimate from the size of the cell values */
+	PGresult *result = self->result;
+	int ntuples = PQntuples(result);
+	int nfields = PQnfields(result);
+	long size = sizeof(char *) * ntuples;
+	int row, col;
+
+	for (row = 0; row < ntuples; ++row)
+		for (col = 0; col < nfields; ++col)
+			size += PQgetlength(result, row, col) + 1 + 
+				sizeof(int) + sizeof(char *);
+	return PyInt_FromLong(size);
+#endif
+}
+
 static PyObject *
 get_errorMessage(PyPgResult *self)
 {
@@ -110,15 +131,39 @@ get_columns(PyPgResult *self)
 	return self->columns;
 }
 
+/* Extract a cell value as a bytes object (or None if the cell is NULL) */
+static PyObject *
+_cell_value(PGresult *result, int row_number, int col, int format)
+{
+	PyObject *cell_value;
+	char *value;
+	size_t len;
+
+	if (PQgetisnull(result, row_number, col)) {
+		Py_INCREF(Py_None);
+		return Py_None;
+	} else if (format == 0) {
+		value = PQgetvalue(result, row_number, col);
+		value = (char *)PQunescapeBytea((unsigned char *)value, &len);
+		cell_value = PyBytes_FromStringAndSize(value, len);
+		PQfreemem(value);
+		return cell_value;
+	} else if (format == 1) {
+		value = PQgetvalue(result, row_number, col);
+		len = PQgetlength(result, row_number, col);
+		return PyBytes_FromStringAndSize(value, len);
+	}
+	PyErr_Format(PqErr_InternalError, 
+		"Result cell format %d not supported", format);
+	return NULL;
+}
+
 static PyObject *
 PyPgResult_iternext(PyPgResult *self)
 {
 	PyObject *row, *cell_value, *cell, *columns;
 	PyPgCell *master_cell;
-	char *value;
-	size_t len;
 	int i;
-	int format;
 	int ncolumns;
 	PGresult *result = self->result;
 	int row_number = self->row_number;
@@ -135,28 +180,10 @@ PyPgResult_iternext(PyPgResult *self)
 
 	for (i = 0; i < ncolumns; ++i) {
 		master_cell = (PyPgCell *)PyTuple_GET_ITEM(columns, i);
-		format = PyInt_AsLong(master_cell->format);
-		if (PQgetisnull(result, row_number, i)) {
-			Py_INCREF(Py_None);
-			cell_value = Py_None;
-		} else if (format == 0) {
-			value = PQgetvalue(result, row_number, i);
-			value = (char *)PQunescapeBytea((unsigned char *)value, &len);
-			cell_value = PyBytes_FromStringAndSize(value, len);
-			PQfreemem(value);
-			if (cell_value == NULL)
-				goto failed;
-		} else if (format == 1) {
-			value = PQgetvalue(result, row_number, i);
-			len = PQgetlength(result, row_number, i);
-			cell_value = PyBytes_FromStringAndSize(value, len);
-			if (cell_value == NULL)
-				goto failed;
-		} else {
-			PyErr_Format(PqErr_InternalError, 
-				"Result cell format %d not supported", format);
+		cell_value = _cell_value(result, row_number, i,
+					 PyInt_AsLong(master_cell->format));
+		if (cell_value == NULL)
 			goto failed;
-		}
 		cell = PyPgCell_FromCell(master_cell, cell_value);
 		if (cell == NULL) {
 			Py_DECREF(cell_value);
@@ -173,6 +200,248 @@ failed:
 	return NULL;
 }
 
+/* Resolve the decoder for a column's converter, once per result */
+int
+pg_result_decode_kind(PyPgResult *self, int col, PyObject *cvt)
+{
+	int kind;
+
+	if (PQfformat(self->result, col) != 1)
+		return PGDECODE_PYTHON;
+	kind = pg_decode_kind(cvt);
+	if (kind == PGDECODE_PYTHON)
+		kind = pg_raw_kind(cvt);
+	return kind;
+}
+
+/*
+ * Decode a single cell to its final Python value. Core types are decoded
+ * natively, zero-copy converters are passed a memoryview, and anything else
+ * is passed to the column's converter as bytes. Converter errors are
+ * reported as InternalError, naming the column and value.
+ */
+PyObject *
+pg_result_decode_cell(PyPgResult *self, PyObject *cvt, int kind,
+		      int row_number, int col)
+{
+	PGresult *result = self->result;
+	PyObject *cell_value, *value;
+
+	if (PQgetisnull(result, row_number, col)) {
+		Py_INCREF(Py_None);
+		return Py_None;
+	}
+	if (kind == PGDECODE_MEMORYVIEW || kind == PGDECODE_RAW) {
+		value = pg_raw_decode(kind, cvt, (PyObject *)self,
+				      PQgetvalue(result, row_number, col),
+				      PQgetlength(result, row_number, col));
+	} else if (kind != PGDECODE_PYTHON) {
+		return pg_decode_value(kind, 
+				       PQgetvalue(result, row_number, col),
+				       PQgetlength(result, row_number, col));
+	} else {
+		cell_value = _cell_value(result, row_number, col,
+					 PQfformat(result, col));
+		if (cell_value == NULL)
+			return NULL;
+		value = PyObject_CallFunctionObjArgs(cvt, cell_value, NULL);
+		Py_DECREF(cell_value);
+	}
+	/* The columns are always fetched before any values are decoded */
+	if (value == NULL && kind != PGDECODE_MEMORYVIEW && 
+	    self->columns != NULL)
+		pg_convert_error(PQgetvalue(result, row_number, col),
+				 PQgetlength(result, row_number, col),
+				 PyTuple_GET_ITEM(self->columns, col));
+	return value;
+}
+
+static PyObject *
+result_rows(PyPgResult *self, PyObject *args)
+{
+	PyObject *converters, *columns, *rows = NULL, *row, *value;
+	PyObject *cvt;
+	int *kinds = NULL;
+	int count = -1, lazy = 0;
+	int ncolumns, end, i;
+
+	if (!PyArg_ParseTuple(args, "O|ii:rows", &converters, &count, &lazy)) 
+		return NULL;
+
+	if ((columns = get_columns(self)) == NULL)
+		return NULL;
+	ncolumns = PyTuple_GET_SIZE(columns);
+
+	if (lazy)
+		converters = PySequence_Tuple(converters);
+	else
+		converters = PySequence_Fast(converters, 
+				     "rows converters must be a sequence");
+	if (converters == NULL) {
+		Py_DECREF(columns);
+		return NULL;
+	}
+	if (PySequence_Fast_GET_SIZE(converters) != ncolumns) {
+		PyErr_Format(PyExc_ValueError, 
+			"rows requires %d converters, got %d", ncolumns,
+			(int)PySequence_Fast_GET_SIZE(converters));
+		goto failed;
+	}
+
+	/* Resolve the native decoders once, rather than once per cell */
+	if ((kinds = PyMem_Malloc((ncolumns + 1) * sizeof(int))) == NULL) {
+		PyErr_NoMemory();
+		goto failed;
+	}
+	for (i = 0; i < ncolumns; ++i) {
+		cvt = PySequence_Fast_GET_ITEM(converters, i);
+		kinds[i] = pg_result_decode_kind(self, i, cvt);
+	}
+
+	end = self->row_count;
+	if (count >= 0 && count < end - self->row_number)
+		end = self->row_number + count;
+
+	if ((rows = PyList_New(0)) == NULL)
+		goto failed;
+	while (self->row_number < end) {
+		if (lazy) {
+			row = PyPgRow_New(self, converters, self->row_number);
+			if (row == NULL)
+				goto failed;
+		} else {
+			if ((row = PyTuple_New(ncolumns)) == NULL)
+				goto failed;
+			for (i = 0; i < ncolumns; ++i) {
+				cvt = PySequence_Fast_GET_ITEM(converters, i);
+				value = pg_result_decode_cell(self, cvt, 
+							      kinds[i],
+							      self->row_number,
+							      i);
+				if (value == NULL) {
+					Py_DECREF(row);
+					goto failed;
+				}
+				PyTuple_SET_ITEM(row, i, value);
+			}
+		}
+		if (PyList_Append(rows, row) < 0) {
+			Py_DECREF(row);
+			goto failed;
+		}
+		Py_DECREF(row);
+		++self->row_number;
+	}
+	PyMem_Free(kinds);
+	Py_DECREF(converters);
+	Py_DECREF(columns);
+	return rows;
+
+failed:
+	if (kinds != NULL)
+		PyMem_Free(kinds);
+	Py_XDECREF(rows);
+	Py_DECREF(converters);
+	Py_DECREF(columns);
+	return NULL;
+}
+
+static PyObject *
+result_column(PyPgResult *self, PyObject *args)
+{
+	PyObject *converter = NULL, *columns, *res;
+	PyObject *values = NULL, *nulls_buf = NULL, *nulls = NULL, *value;
+	const char *idt;
+	unsigned char *np;
+	int integer_datetimes = 1;
+	int col, kind, row, nrows;
+
+	if (!PyArg_ParseTuple(args, "i|O:column", &col, &converter)) 
+		return NULL;
+	if (col < 0 || col >= PQnfields(self->result)) {
+		PyErr_SetString(PyExc_IndexError, "column index out of range");
+		return NULL;
+	}
+
+	if (self->connection->connection != NULL) {
+		idt = PQparameterStatus(self->connection->connection,
+					"integer_datetimes");
+		integer_datetimes = (idt == NULL || strcmp(idt, "on") == 0);
+	}
+	res = pg_decode_column(self->result, col, self->row_number, 
+			       integer_datetimes);
+	if (res != Py_None)
+		return res;
+	Py_DECREF(res);
+
+	if (converter == NULL || converter == Py_None) {
+		PyErr_Format(PqErr_NotSupportedError,
+			"column %d type %d has no columnar form", 
+			col, PQftype(self->result, col));
+		return NULL;
+	}
+
+	/* Not a fixed width type - fall back to a list of converted values */
+	if ((columns = get_columns(self)) == NULL)
+		return NULL;
+	kind = pg_result_decode_kind(self, col, converter);
+	nrows = self->row_count - self->row_number;
+	if ((values = PyList_New(nrows)) == NULL)
+		goto failed;
+	if ((nulls_buf = PyBytes_FromStringAndSize(NULL, nrows)) == NULL)
+		goto failed;
+	np = (unsigned char *)PyBytes_AsString(nulls_buf);
+	for (row = 0; row < nrows; ++row) {
+		np[row] = PQgetisnull(self->result, self->row_number + row, col);
+		value = pg_result_decode_cell(self, converter, kind,
+					      self->row_number + row, col);
+		if (value == NULL)
+			goto failed;
+		PyList_SET_ITEM(values, row, value);
+	}
+	nulls = pg_bytes_to_array("B", nulls_buf);
+	if (nulls == NULL)
+		goto failed;
+	res = PyTuple_Pack(2, values, nulls);
+	Py_DECREF(values);
+	Py_DECREF(nulls_buf);
+	Py_DECREF(nulls);
+	Py_DECREF(columns);
+	return res;
+
+failed:
+	Py_XDECREF(values);
+	Py_XDECREF(nulls_buf);
+	Py_DECREF(columns);
+	return NULL;
+}
+
+static PyObject *
+get_rownumber(PyPgResult *self)
+{
+	return PyInt_FromLong(self->row_number);
+}
+
+static int
+set_rownumber(PyPgResult *self, PyObject *value)
+{
+	long row_number;
+
+	if (value == NULL) {
+		PyErr_SetString(PyExc_TypeError, "cannot delete rownumber");
+		return -1;
+	}
+	row_number = PyInt_AsLong(value);
+	if (row_number == -1 && PyErr_Occurred())
+		return -1;
+	if (row_number < 0 || row_number > self->row_count) {
+		PyErr_SetString(PyExc_IndexError, "rownumber out of range");
+		return -1;
+	}
+	self->row_number = row_number;
+	return 0;
+}
+
 static PyObject *
 get_errorField(PyPgResult *self, PyObject *args)
 {
@@ -192,6 +461,17 @@ get_errorField(PyPgResult *self, PyObject *args)
 static PyMethodDef PyPgResult_methods[] = {
 	{"errorField", (PyCFunction)get_errorField, METH_VARARGS,
 		PyDoc_STR("Returns an individual field of an error report.")},
+	{"rows", (PyCFunction)result_rows, METH_VARARGS,
+		PyDoc_STR("rows(converters[, count[, lazy]]) -- Returns a list of "
+			  "decoded row tuples, applying one converter per column. "
+			  "Core type converters are decoded natively. If lazy is "
+			  "true, returns PgRow objects that decode each column "
+			  "when it is first accessed")},
+	{"column", (PyCFunction)result_column, METH_VARARGS,
+		PyDoc_STR("column(index[, converter]) -- Returns a (values, nulls) "
+			  "tuple for the remaining rows of a column. Fixed width "
+			  "types are returned as an array.array, other types "
+			  "are decoded with converter into a list")},
 	{NULL, NULL}
 };
 
@@ -208,9 +488,13 @@ static PyGetSetDef PyPgResult_getset[] = {
 	{"cmdTuples",		(getter)get_cmdTuples},
 	{"columns",		(getter)get_columns},
 	{"errorMessage",	(getter)get_errorMessage},
+	{"memorySize",		(getter)get_memorySize, NULL,
+   "Bytes of memory used by the result (estimated before libpq 12)"},
 	{"nfields",		(getter)get_nfields},
 	{"ntuples",		(getter)get_ntuples},
 	{"oid",			(getter)get_oid},
+	{"rownumber",		(getter)get_rownumber, (setter)set_rownumber,
+   "Index of the next row to be returned by iteration or rows()"},
 	{NULL}
 };
 
@@ -298,6 +582,16 @@ static PyPgConstEnumInit PGRES_init[] = {
 	{ "PGRES_BAD_RESPONSE", PGRES_BAD_RESPONSE },
 	{ "PGRES_NONFATAL_ERROR", PGRES_NONFATAL_ERROR },
 	{ "PGRES_FATAL_ERROR", PGRES_FATAL_ERROR },
+#if LIBPQ_VERSION >= 90200
+	{ "PGRES_SINGLE_TUPLE", PGRES_SINGLE_TUPLE },
+#endif
+#ifdef LIBPQ_HAS_PIPELINING
+	{ "PGRES_PIPELINE_SYNC", PGRES_PIPELINE_SYNC },
+	{ "PGRES_PIPELINE_ABORTED", PGRES_PIPELINE_ABORTED },
+#endif
+#ifdef LIBPQ_HAS_CHUNK_MODE
+	{ "PGRES_TUPLES_CHUNK", PGRES_TUPLES_CHUNK },
+#endif
 	{ NULL }
 };
 
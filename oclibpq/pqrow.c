@@ -0,0 +1,303 @@
+/* vi:set sw=8 ts=8 noet showmode ai: */
+
+/*
+ * Lazily decoded result rows.
+ *
+ * A PgRow refers to a row of a PgResult, and only decodes a column (with
+ * the converter given to PgResult.rows()) when it is first accessed,
+ * caching the value. Rows behave like tuples for indexing, slicing,
+ * iteration, unpacking, comparison and hashing. Once every column has
+ * been decoded, the row releases the PgResult.
+ */
+
+#include "oclibpq.h"
+
+typedef struct {
+	PyObject_VAR_HEAD
+	PyPgResult	*result;	/* NULL once all values are decoded */
+	PyObject	*converters;	/* tuple, one per column */
+	int		 row_number;
+	Py_ssize_t	 pending;	/* number of values not yet decoded */
+	PyObject	*values[1];
+} PyPgRow;
+
+#if PY_MAJOR_VERSION >= 3
+#define SLICE_CAST(o) (o)
+#else
+#define SLICE_CAST(o) ((PySliceObject *)(o))
+#endif
+
+static PyTypeObject PyPgRow_Type;
+
+PyObject *
+PyPgRow_New(PyPgResult *result, PyObject *converters, int row_number)
+{
+	PyPgRow *self;
+	Py_ssize_t ncolumns = PyTuple_GET_SIZE(converters);
+	Py_ssize_t i;
+
+	self = PyObject_NewVar(PyPgRow, &PyPgRow_Type, ncolumns);
+	if (self == NULL)
+		return NULL;
+	for (i = 0; i < ncolumns; ++i)
+		self->values[i] = NULL;
+	self->pending = ncolumns;
+	self->row_number = row_number;
+	self->result = NULL;
+	self->converters = NULL;
+	if (ncolumns > 0) {
+		Py_INCREF(result);
+		self->result = result;
+		Py_INCREF(converters);
+		self->converters = converters;
+	}
+	return (PyObject *)self;
+}
+
+static void
+PyPgRow_dealloc(PyPgRow *self)
+{
+	Py_ssize_t i;
+
+	for (i = 0; i < Py_SIZE(self); ++i)
+		Py_XDECREF(self->values[i]);
+	Py_XDECREF(self->result);
+	Py_XDECREF(self->converters);
+	Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+/* Return a borrowed reference to column i, decoding it if necessary */
+static PyObject *
+_get_value(PyPgRow *self, Py_ssize_t i)
+{
+	PyObject *cvt, *value;
+	int kind;
+
+	if (self->values[i] != NULL)
+		return self->values[i];
+	cvt = PyTuple_GET_ITEM(self->converters, i);
+	kind = pg_result_decode_kind(self->result, (int)i, cvt);
+	value = pg_result_decode_cell(self->result, cvt, kind,
+				      self->row_number, (int)i);
+	if (value == NULL)
+		return NULL;
+	self->values[i] = value;
+	if (--self->pending == 0) {
+		Py_CLEAR(self->result);
+		Py_CLEAR(self->converters);
+	}
+	return value;
+}
+
+static PyObject *
+_as_tuple(PyPgRow *self)
+{
+	PyObject *tuple, *value;
+	Py_ssize_t i;
+
+	if ((tuple = PyTuple_New(Py_SIZE(self))) == NULL)
+		return NULL;
+	for (i = 0; i < Py_SIZE(self); ++i) {
+		if ((value = _get_value(self, i)) == NULL) {
+			Py_DECREF(tuple);
+			return NULL;
+		}
+		Py_INCREF(value);
+		PyTuple_SET_ITEM(tuple, i, value);
+	}
+	return tuple;
+}
+
+static Py_ssize_t
+PyPgRow_length(PyPgRow *self)
+{
+	return Py_SIZE(self);
+}
+
+static PyObject *
+PyPgRow_item(PyPgRow *self, Py_ssize_t i)
+{
+	PyObject *value;
+
+	if (i < 0 || i >= Py_SIZE(self)) {
+		PyErr_SetString(PyExc_IndexError, "row index out of range");
+		return NULL;
+	}
+	value = _get_value(self, i);
+	Py_XINCREF(value);
+	return value;
+}
+
+static PyObject *
+PyPgRow_subscript(PyPgRow *self, PyObject *key)
+{
+	Py_ssize_t i, start, stop, step, length, n;
+	PyObject *tuple, *value;
+
+	if (PyIndex_Check(key)) {
+		i = PyNumber_AsSsize_t(key, PyExc_IndexError);
+		if (i == -1 && PyErr_Occurred())
+			return NULL;
+		if (i < 0)
+			i += Py_SIZE(self);
+		return PyPgRow_item(self, i);
+	}
+	if (!PySlice_Check(key)) {
+		PyErr_Format(PyExc_TypeError,
+			     "row indices must be integers, not %.200s",
+			     Py_TYPE(key)->tp_name);
+		return NULL;
+	}
+	if (PySlice_GetIndicesEx(SLICE_CAST(key), Py_SIZE(self),
+				 &start, &stop, &step, &length) < 0)
+		return NULL;
+	if ((tuple = PyTuple_New(length)) == NULL)
+		return NULL;
+	for (n = 0, i = start; n < length; ++n, i += step) {
+		if ((value = _get_value(self, i)) == NULL) {
+			Py_DECREF(tuple);
+			return NULL;
+		}
+		Py_INCREF(value);
+		PyTuple_SET_ITEM(tuple, n, value);
+	}
+	return tuple;
+}
+
+static PyObject *
+PyPgRow_richcompare(PyObject *a, PyObject *b, int op)
+{
+	PyObject *ta, *tb, *res;
+
+	if (!(PyTuple_Check(a) || Py_TYPE(a) == &PyPgRow_Type) ||
+	    !(PyTuple_Check(b) || Py_TYPE(b) == &PyPgRow_Type)) {
+		Py_INCREF(Py_NotImplemented);
+		return Py_NotImplemented;
+	}
+	if (Py_TYPE(a) == &PyPgRow_Type)
+		ta = _as_tuple((PyPgRow *)a);
+	else {
+		ta = a;
+		Py_INCREF(ta);
+	}
+	if (ta == NULL)
+		return NULL;
+	if (Py_TYPE(b) == &PyPgRow_Type)
+		tb = _as_tuple((PyPgRow *)b);
+	else {
+		tb = b;
+		Py_INCREF(tb);
+	}
+	if (tb == NULL) {
+		Py_DECREF(ta);
+		return NULL;
+	}
+	res = PyObject_RichCompare(ta, tb, op);
+	Py_DECREF(ta);
+	Py_DECREF(tb);
+	return res;
+}
+
+#if PY_MAJOR_VERSION >= 3
+typedef Py_hash_t pg_hash_t;
+#else
+typedef long pg_hash_t;
+#endif
+
+static pg_hash_t
+PyPgRow_hash(PyPgRow *self)
+{
+	PyObject *tuple;
+	pg_hash_t hash;
+
+	if ((tuple = _as_tuple(self)) == NULL)
+		return -1;
+	hash = PyObject_Hash(tuple);
+	Py_DECREF(tuple);
+	return hash;
+}
+
+static PyObject *
+PyPgRow_repr(PyPgRow *self)
+{
+	PyObject *tuple, *repr;
+
+	if ((tuple = _as_tuple(self)) == NULL)
+		return NULL;
+	repr = PyObject_Repr(tuple);
+	Py_DECREF(tuple);
+	return repr;
+}
+
+static PyObject *
+PyPgRow_reduce(PyPgRow *self, PyObject *unused)
+{
+	PyObject *tuple, *res;
+
+	/* Rows are pickled as plain tuples */
+	if ((tuple = _as_tuple(self)) == NULL)
+		return NULL;
+	res = Py_BuildValue("(O(N))", &PyTuple_Type, tuple);
+	return res;
+}
+
+static PyMethodDef PyPgRow_methods[] = {
+	{"__reduce__", (PyCFunction)PyPgRow_reduce, METH_NOARGS, NULL},
+	{NULL, NULL}
+};
+
+static PySequenceMethods PyPgRow_as_sequence = {
+	(lenfunc)PyPgRow_length,		/* sq_length */
+	0,					/* sq_concat */
+	0,					/* sq_repeat */
+	(ssizeargfunc)PyPgRow_item,		/* sq_item */
+};
+
+static PyMappingMethods PyPgRow_as_mapping = {
+	(lenfunc)PyPgRow_length,		/* mp_length */
+	(binaryfunc)PyPgRow_subscript,		/* mp_subscript */
+	0,					/* mp_ass_subscript */
+};
+
+PyDoc_STRVAR(PyPgRow_doc,
+"A result row that decodes each column when it is first accessed");
+
+static PyTypeObject PyPgRow_Type = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	MODULE_NAME ".PgRow",			/* tp_name */
+	sizeof(PyPgRow) - sizeof(PyObject *),	/* tp_basicsize */
+	sizeof(PyObject *),			/* tp_itemsize */
+	(destructor)PyPgRow_dealloc,		/* tp_dealloc */
+	0,					/* tp_print */
+	0,					/* tp_getattr */
+	0,					/* tp_setattr */
+	0,					/* tp_compare */
+	(reprfunc)PyPgRow_repr,			/* tp_repr */
+	0,					/* tp_as_number */
+	&PyPgRow_as_sequence,			/* tp_as_sequence */
+	&PyPgRow_as_mapping,			/* tp_as_mapping */
+	(hashfunc)PyPgRow_hash,			/* tp_hash */
+	0,					/* tp_call */
+	0,					/* tp_str */
+	0,					/* tp_getattro */
+	0,					/* tp_setattro */
+	0,					/* tp_as_buffer */
+	Py_TPFLAGS_DEFAULT,			/* tp_flags */
+	PyPgRow_doc,				/* tp_doc */
+	0,					/* tp_traverse */
+	0,					/* tp_clear */
+	PyPgRow_richcompare,			/* tp_richcompare */
+	0,					/* tp_weaklistoffset */
+	0,					/* tp_iter */
+	0,					/* tp_iternext */
+	PyPgRow_methods,			/* tp_methods */
+};
+
+void
+pg_row_init(PyObject *module)
+{
+	if (PyType_Ready(&PyPgRow_Type) < 0)
+		return;
+	Py_INCREF(&PyPgRow_Type);
+	PyModule_AddObject(module, "PgRow", (PyObject *)&PyPgRow_Type);
+}
@@ -0,0 +1,382 @@
+"""
+asyncio interface
+
+This module requires Python 3.5 or later, and is not imported by the
+ocpgdb package itself:
+
+    from ocpgdb import aio
+
+    async def main():
+        db = await aio.connect(dbname='test')
+        rows = await db.execute('SELECT * FROM x WHERE a = %s', (1,))
+        curs = db.cursor()
+        await curs.execute('SELECT * FROM x')
+        rows = await curs.fetchall()
+
+Connections use libpq's non-blocking API, waiting on the connection socket
+via the event loop, so a single thread can have a query in flight on any
+number of connections. Values are converted exactly as for the blocking
+interface, via the connection's from_db and to_db maps.
+"""
+import asyncio
+from oclibpq import *
+from . import connection
+
+__all__ = ['Connection', 'Cursor', 'connect']
+
+
+class Cursor:
+    """
+    An asyncio cursor.
+
+    Results are buffered client-side in full, unless the cursor is named,
+    in which case queries are executed via a server-side cursor, and rows
+    are fetched in batches of itersize rows. The next batch is fetched
+    while the current one is being consumed, so at most two batches are
+    held in memory. Cursors support "async for".
+    """
+    itersize = 1000
+
+    def __init__(self, connection, name=None):
+        self.connection = connection
+        self.name = name
+        self.arraysize = 1
+        self._declared = False
+        self._hold = False
+        self._transaction = None
+        self._prefetch = None
+        self._reset()
+
+    def _reset(self):
+        self._result = None
+        self._converters = None
+        self.description = None
+        self.rowcount = -1
+        self.oidValue = None
+
+    def _assert_open(self):
+        if self.connection is None:
+            raise ProgrammingError("Cursor not open")
+
+    async def close(self):
+        if self.connection is not None:
+            await self._close_portal()
+        self._reset()
+        self.connection = None
+
+    def setinputsizes(self, sizes):
+        pass
+
+    def setoutputsize(self, size, column=None):
+        pass
+
+    def _make_description(self, result):
+        return [(col.name, col.type, None, None, None, None, None)
+                for col in result.columns]
+
+    def _use_portal(self, cmd):
+        sync_cursor = connection.Cursor
+        return (self.name is not None and
+                sync_cursor._re_DQL.match(cmd) is not None and
+                sync_cursor._re_4UP.search(cmd) is None and
+                sync_cursor._re_IN2.search(cmd) is None)
+
+    async def _close_portal(self):
+        # Let any FETCH in flight finish (cancelling it would abort the
+        # transaction), then close the server-side cursor.
+        prefetch, self._prefetch = self._prefetch, None
+        if prefetch is not None:
+            try:
+                await prefetch
+            except DatabaseError:
+                pass
+        if self._declared:
+            self._declared = False
+            # A WITHOUT HOLD cursor is closed by the end of its transaction
+            connection = self.connection
+            status = connection.transactionStatus
+            if status != TRANS_INERROR and (self._hold or 
+                    (connection._transaction == self._transaction and 
+                     status != TRANS_IDLE)):
+                await connection._execute_async('CLOSE "%s"' % self.name)
+
+    async def execute(self, cmd, args=None):
+        self._assert_open()
+        await self._close_portal()
+        self._reset()
+        connection = self.connection
+        cmd, args = connection._normalise_args(cmd, args)
+        use_portal = self._use_portal(cmd)
+        if not connection.autocommit:
+            await connection.begin()
+        if use_portal:
+            if connection.autocommit:
+                hold = 'WITH HOLD'
+            else:
+                hold = 'WITHOUT HOLD'
+            cmd = 'DECLARE "%s" CURSOR %s FOR %s' % (self.name, hold, cmd)
+        result = await connection._execute_async(cmd, args)
+        if use_portal and result.status == PGRES_COMMAND_OK:
+            self._declared = True
+            self._hold = connection.autocommit
+            self._transaction = connection._transaction
+            # The first batch also provides the column descriptions
+            result = await self._fetch_batch()
+            self.result_type = 'DQL'
+            self._set_batch(result)
+            self.description = self._make_description(result)
+        elif result.status == PGRES_TUPLES_OK:
+            self.result_type = 'DQL'
+            self._result = result
+            self._converters = connection._converters(result)
+            self.rowcount = result.ntuples
+            self.description = self._make_description(result)
+        elif result.status == PGRES_EMPTY_QUERY:
+            self.result_type = 'EMPTY'
+        elif result.status == PGRES_COMMAND_OK:
+            self.rowcount = result.cmdTuples
+            self.oidValue = result.oid
+            if self.rowcount:
+                self.result_type = 'DML'
+            else:
+                self.result_type = 'DDL'
+        else:
+            raise InternalError('Unexpected result status %s' % result.status)
+        return self
+
+    async def executemany(self, cmd, arglist):
+        for args in arglist:
+            await self.execute(cmd, args)
+
+    async def _fetch_batch(self):
+        return await self.connection._execute_async(
+                'FETCH %d FROM "%s"' % (self.itersize, self.name))
+
+    def _set_batch(self, result):
+        # Make result the current batch, and start fetching the next
+        # unless this one was short (the server-side cursor is exhausted).
+        self._result = result
+        if self._converters is None:
+            self._converters = self.connection._converters(result)
+        if result.ntuples >= self.itersize:
+            self._prefetch = asyncio.ensure_future(self._fetch_batch())
+
+    async def _next_batch(self):
+        prefetch, self._prefetch = self._prefetch, None
+        if prefetch is None:
+            return False
+        self._set_batch(await prefetch)
+        return True
+
+    def _fetch(self, count=None):
+        self._assert_open()
+        if self._result is None:
+            raise ProgrammingError('No results pending')
+        return self.connection._result_rows(self._result, self._converters,
+                                            count)
+
+    async def fetchall(self):
+        rows = self._fetch()
+        while await self._next_batch():
+            rows.extend(self._fetch())
+        return rows
+
+    async def fetchone(self):
+        while True:
+            rows = self._fetch(1)
+            if rows:
+                return rows[0]
+            if not await self._next_batch():
+                return None
+
+    async def fetchmany(self, count=None):
+        if count is None:
+            count = self.arraysize
+        rows = self._fetch(count)
+        while len(rows) < count and await self._next_batch():
+            rows.extend(self._fetch(count - len(rows)))
+        return rows
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        row = await self.fetchone()
+        if row is None:
+            raise StopAsyncIteration
+        return row
+
+
+def _blocking(name):
+    # Stand-in for a blocking ocpgdb.Connection method - libpq's
+    # synchronous calls ignore non-blocking mode, and would stall the loop
+    def method(self, *args, **kwargs):
+        raise NotSupportedError('%s() is not supported by ocpgdb.aio' % 
+                                name.lstrip('_'))
+    method.__name__ = name
+    return method
+
+
+class Connection(connection.Connection):
+    """
+    An asyncio PostgreSQL connection - use aio.connect() to create one.
+
+    Only one command can be in progress on a connection at a time -
+    concurrent tasks sharing a connection are serialised. Prepared
+    statements, stream() and COPY are not supported.
+    """
+    prepare = _blocking('prepare')
+    stream = _blocking('stream')
+    _execute = _blocking('_execute')
+    _executemany = _blocking('_executemany')
+    _copy_from = _blocking('_copy_from')
+    _copy_to = _blocking('_copy_to')
+    _copy_rows = _blocking('_copy_rows')
+
+    def __init__(self, **kwargs):
+        conninfo, self._options = self._configure(kwargs)
+        PgConnection.__init__(self, conninfo, True)
+        self._loop = asyncio.get_event_loop()
+        self._lock = asyncio.Lock()
+        self._abandoned = False
+
+    async def _connect(self):
+        state = PGRES_POLLING_WRITING
+        while state != PGRES_POLLING_OK:
+            await self._wait(state == PGRES_POLLING_READING,
+                             state == PGRES_POLLING_WRITING)
+            state = self.connectPoll()
+        self.setnonblocking(True)
+        await self._execute_async('SET datestyle TO ISO')
+        self._init_conversions(**self._options)
+
+    async def _wait(self, readable=True, writable=False):
+        # Wait for the connection socket to become readable or writable
+        loop = self._loop
+        fd = self.fileno()
+        waiter = loop.create_future()
+        def wakeup():
+            if not waiter.done():
+                waiter.set_result(None)
+        if readable:
+            loop.add_reader(fd, wakeup)
+        if writable:
+            loop.add_writer(fd, wakeup)
+        try:
+            await waiter
+        finally:
+            if readable:
+                loop.remove_reader(fd)
+            if writable:
+                loop.remove_writer(fd)
+
+    async def _flush(self):
+        # Send any queued output, reading input while we wait so the
+        # server can't block on us.
+        while self.flush():
+            await self._wait(True, True)
+            self.consumeInput()
+
+    async def _get_result(self):
+        while self.isBusy():
+            await self._wait()
+            self.consumeInput()
+        return self.getResult()
+
+    async def _drain(self):
+        # Consume the results of an abandoned command
+        while True:
+            result = await self._get_result()
+            if result is None:
+                break
+            if result.status == PGRES_COPY_IN:
+                self.putCopyEnd('COPY is not supported by ocpgdb.aio')
+                await self._flush()
+            elif result.status == PGRES_COPY_OUT:
+                # Rare enough to not be worth doing asynchronously
+                self._abort_copy_out()
+                break
+
+    async def _execute_async(self, cmd, args=()):
+        """
+        Send a command and wait for its result, without blocking the
+        event loop
+        """
+        args = self._args_to_db(args)
+        async with self._lock:
+            if self._abandoned:
+                await self._drain()
+                self._abandoned = False
+            self.sendQuery(cmd, args)
+            try:
+                await self._flush()
+                result = await self._get_result()
+                if result is not None and result.status in \
+                        (PGRES_COPY_IN, PGRES_COPY_OUT):
+                    await self._drain()
+                    raise NotSupportedError('COPY is not supported by '
+                                            'ocpgdb.aio')
+                while (await self._get_result()) is not None:
+                    pass
+            except BaseException:
+                # Cancelled or failed mid-command - ask the server to give
+                # up, and collect the results before the next command.
+                if not self.closed and \
+                        self.transactionStatus == TRANS_ACTIVE:
+                    self._abandoned = True
+                    try:
+                        self.cancel()
+                    except OperationalError:
+                        pass
+                raise
+        return self._check_result(result)
+
+    async def reset(self):
+        """
+        Return the connection to an idle state, collecting the results of
+        any cancelled command and rolling back any open transaction
+        """
+        async with self._lock:
+            if self._abandoned:
+                await self._drain()
+                self._abandoned = False
+        await self.rollback()
+
+    async def execute(self, cmd, args=None):
+        cmd, args = self._normalise_args(cmd, args)
+        return self._result_rows(await self._execute_async(cmd, args))
+
+    async def begin(self):
+        if self.transactionStatus == TRANS_IDLE:
+            self._transaction += 1
+            await self._execute_async('BEGIN WORK')
+
+    async def commit(self):
+        if self.transactionStatus != TRANS_IDLE:
+            await self._execute_async('COMMIT WORK')
+
+    async def rollback(self):
+        if self.transactionStatus != TRANS_IDLE:
+            await self._execute_async('ROLLBACK WORK')
+
+    def cursor(self, name=None):
+        """
+        Return a new cursor - named cursors fetch query results in batches
+        via a server-side cursor
+        """
+        return Cursor(self, name)
+
+
+async def connect(**kwargs):
+    """
+    Connect to a PostgreSQL database without blocking the event loop
+
+    Accepts the same arguments as ocpgdb.connect().
+    """
+    conn = Connection(**kwargs)
+    try:
+        await conn._connect()
+    except BaseException:
+        conn.close()
+        raise
+    return conn
@@ -0,0 +1,323 @@
+"""
+asyncio connection pool
+
+This module requires Python 3.5 or later, and is not imported by the
+ocpgdb package itself:
+
+    from ocpgdb import aiopool
+
+    async def main():
+        pool = await aiopool.create_pool(minconn=2, maxconn=20, dbname='test')
+        async with pool.connection() as conn:
+            rows = await conn.execute('SELECT ...')
+
+Tasks waiting for a connection are served in FIFO order. A connection
+returned by a task that was cancelled mid-query is reset (the query is
+cancelled on the server and any transaction rolled back) before it is
+reused, or discarded if that fails.
+"""
+import asyncio
+import collections
+from oclibpq import *
+from . import aio
+from .pool import _is_alive
+
+__all__ = ['ConnectionPool', 'create_pool']
+
+
+class _Checkout:
+    def __init__(self, pool, timeout):
+        self.pool = pool
+        self.timeout = timeout
+        self.conn = None
+
+    async def __aenter__(self):
+        self.conn = await self.pool.getconn(self.timeout)
+        return self.conn
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        await self.pool.putconn(self.conn)
+
+
+class ConnectionPool:
+    """
+    A pool of between minconn and maxconn ocpgdb.aio connections, created
+    with connect(**kwargs) (ocpgdb.aio.connect by default). Use
+    create_pool() to create a pool and open the initial connections.
+
+    Connections older than max_lifetime seconds are closed rather than
+    reused, and idle connections beyond minconn are closed once they have
+    been idle for max_idle seconds. Returned connections that can not be
+    reset within reset_timeout seconds are discarded.
+    """
+
+    def __init__(self, minconn=1, maxconn=10, max_lifetime=None,
+                 max_idle=None, reset_timeout=5.0, connect=None, **kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError('invalid pool size (minconn %r, maxconn %r)' %
+                             (minconn, maxconn))
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.reset_timeout = reset_timeout
+        if connect is None:
+            connect = aio.connect
+        self._connect = connect
+        self._kwargs = kwargs
+        self._loop = asyncio.get_event_loop()
+        self._idle = []         # (conn, idle since), most recently used last
+        self._waiters = collections.deque()
+        self._created = {}      # conn -> time created
+        self._in_use = set()    # checked out connections
+        self._opening = 0       # connections being created
+        self._closed = False
+        # Metrics
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.discards = 0
+        self.resets = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def __len__(self):
+        return len(self._created)
+
+    def __repr__(self):
+        return '<%s %d/%d connections, %d idle>' %\
+            (self.__class__.__name__, len(self._created), self.maxconn,
+             len(self._idle))
+
+    @property
+    def waiting(self):
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    async def prewarm(self):
+        """
+        Open connections (concurrently) until the pool holds at least
+        minconn
+        """
+        count = self.minconn - len(self._created) - self._opening
+        if count <= 0 or self._closed:
+            return
+        self._opening += count
+        results = await asyncio.gather(*[self._open() for i in range(count)],
+                                       return_exceptions=True)
+        error = None
+        for result in results:
+            if isinstance(result, BaseException):
+                error = result
+            else:
+                self._release(result)
+        if error is not None:
+            raise error
+
+    async def _open(self):
+        # Called with _opening incremented on our behalf
+        try:
+            conn = await self._connect(**self._kwargs)
+        except BaseException:
+            self._opening -= 1
+            self._wakeup()
+            raise
+        self._opening -= 1
+        self._created[conn] = self._loop.time()
+        self.connects += 1
+        return conn
+
+    def _discard(self, conn):
+        self._created.pop(conn, None)
+        self.discards += 1
+        try:
+            conn.close()
+        except DatabaseError:
+            pass
+
+    def _expired(self, conn, now):
+        return (self.max_lifetime is not None and
+                now - self._created[conn] > self.max_lifetime)
+
+    def _reap(self, now):
+        # Close connections that have been idle too long (least recently
+        # used first), keeping at least minconn.
+        if self.max_idle is None:
+            return
+        while (self._idle and len(self._created) > self.minconn and
+                now - self._idle[0][1] > self.max_idle):
+            conn, since = self._idle.pop(0)
+            self._discard(conn)
+
+    def _next_waiter(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                return waiter
+
+    def _release(self, conn):
+        # Hand a clean connection to the longest waiting task, or add it to
+        # the idle list.
+        if self._closed:
+            self._discard(conn)
+            return
+        waiter = self._next_waiter()
+        if waiter is not None:
+            waiter.set_result(conn)
+        else:
+            self._idle.append((conn, self._loop.time()))
+
+    def _wakeup(self):
+        # Capacity has been freed - let the longest waiting task open a
+        # connection (reserving the slot on its behalf).
+        if len(self._created) + self._opening < self.maxconn:
+            waiter = self._next_waiter()
+            if waiter is not None:
+                self._opening += 1
+                waiter.set_result(None)
+
+    def _get_idle(self):
+        now = self._loop.time()
+        self._reap(now)
+        while self._idle:
+            conn, since = self._idle.pop()
+            if not self._expired(conn, now) and _is_alive(conn):
+                return conn
+            self._discard(conn)
+
+    async def getconn(self, timeout=None):
+        """
+        Check a connection out of the pool, waiting up to timeout seconds
+        (or indefinitely if timeout is None) if the pool is at maxconn.
+        Waiting tasks are served in order.
+        """
+        if self._closed:
+            raise ProgrammingError('Connection pool is closed')
+        start = self._loop.time()
+        conn = None
+        if not self.waiting:
+            conn = self._get_idle()
+            if conn is None and \
+                    len(self._created) + self._opening < self.maxconn:
+                self._opening += 1
+                conn = await self._open()
+        if conn is None:
+            waiter = self._loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                conn = await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            except BaseException as e:
+                if waiter.done() and not waiter.cancelled() and \
+                        waiter.exception() is None:
+                    # We were handed a connection (or a slot to open one)
+                    # but can't use it - pass it on.
+                    conn = waiter.result()
+                    if conn is None:
+                        self._opening -= 1
+                        self._wakeup()
+                    else:
+                        self._release(conn)
+                else:
+                    waiter.cancel()
+                if isinstance(e, asyncio.TimeoutError):
+                    self.timeouts += 1
+                    raise OperationalError('Timed out waiting for a '
+                                           'pooled connection')
+                raise
+            if conn is None:
+                conn = await self._open()
+        wait = self._loop.time() - start
+        self._in_use.add(conn)
+        self.checkouts += 1
+        self.wait_time += wait
+        if wait > self.max_wait:
+            self.max_wait = wait
+        return conn
+
+    async def putconn(self, conn, close=False):
+        """
+        Return a connection to the pool. Any command cancelled by the
+        caller is collected and any open transaction rolled back, and the
+        connection is closed instead if that fails, or if close is True.
+        """
+        if conn not in self._in_use:
+            if conn in self._created:
+                raise ProgrammingError('Connection is not checked out')
+            raise ProgrammingError('Connection does not belong to this pool')
+        self._in_use.remove(conn)
+        if not close and not conn.closed and \
+                (conn._abandoned or conn.transactionStatus != TRANS_IDLE):
+            self.resets += 1
+            try:
+                await asyncio.wait_for(conn.reset(), self.reset_timeout)
+            except asyncio.CancelledError:
+                self._discard(conn)
+                self._wakeup()
+                raise
+            except Exception:
+                close = True
+            else:
+                close = conn.transactionStatus != TRANS_IDLE
+        if close or conn.closed or self._closed or \
+                self._expired(conn, self._loop.time()):
+            self._discard(conn)
+            self._wakeup()
+        else:
+            self._release(conn)
+            self._reap(self._loop.time())
+
+    def connection(self, timeout=None):
+        """
+        Check out a connection for use in an "async with" statement,
+        returning it to the pool at the end of the block (uncommitted work
+        is rolled back)
+        """
+        return _Checkout(self, timeout)
+
+    def close(self):
+        """
+        Close idle connections, and any checked out connections as they
+        are returned. Waiting tasks receive ProgrammingError.
+        """
+        self._closed = True
+        while self._idle:
+            conn, since = self._idle.pop()
+            self._discard(conn)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(
+                        ProgrammingError('Connection pool is closed'))
+
+    def stats(self):
+        """
+        Return a dictionary of pool metrics
+        """
+        size = len(self._created)
+        idle = len(self._idle)
+        if self.checkouts:
+            avg_wait = self.wait_time / self.checkouts
+        else:
+            avg_wait = 0.0
+        return dict(size=size, idle=idle, in_use=size - idle,
+                    opening=self._opening, waiting=self.waiting,
+                    minconn=self.minconn, maxconn=self.maxconn,
+                    utilisation=float(size - idle) / self.maxconn,
+                    checkouts=self.checkouts, timeouts=self.timeouts,
+                    connects=self.connects, discards=self.discards,
+                    resets=self.resets, wait_time=self.wait_time,
+                    avg_wait=avg_wait, max_wait=self.max_wait)
+
+
+async def create_pool(**kwargs):
+    """
+    Create a ConnectionPool and open its initial connections
+
+    Accepts the same arguments as ConnectionPool().
+    """
+    pool = ConnectionPool(**kwargs)
+    try:
+        await pool.prewarm()
+    except BaseException:
+        pool.close()
+        raise
+    return pool
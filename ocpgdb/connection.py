@@ -1,33 +1,73 @@
 # Standard library
 import sys
-import itertools
 import re
+import select
+import threading
 # Module
 from oclibpq import *
 from . import fromdb
 from . import todb
+from . import pgtype
+from . import pyformat
+from .stmtcache import StatementCache
 
 class Cursor:
     _re_DQL = re.compile(r'^\s*SELECT\s', re.IGNORECASE)
+    # Commands whose results can be exported with COPY (...) TO STDOUT
+    _re_query = re.compile(r'^\s*(SELECT|VALUES|WITH|TABLE)\s', re.IGNORECASE)
     _re_4UP = re.compile(r'\sFOR\s+UPDATE', re.IGNORECASE)
     _re_IN2 = re.compile(r'\sINTO\s', re.IGNORECASE)
+    # Data-modifying WITH queries can't be DECLAREd
+    _re_DML = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE)\b', re.IGNORECASE)
+
+    # Rows are FETCHed from the server-side cursor in batches, starting at
+    # fetch_min rows and doubling up to itersize rows or about fetch_budget
+    # bytes (going by the size of the previous batch). When iterating, the
+    # next batch can be fetched in a helper thread (see __iter__).
+    fetch_min = 100
+    fetch_budget = 256 << 10
+    itersize = 100000
+    prefetch = False
+
+    _copy_formats = {
+        'binary': ' WITH BINARY',
+        'text': '',
+        'csv': ' WITH CSV',
+    }
 
     def __init__(self, connection, name=None):
         self.connection = connection
+        # Named cursors always use a server-side cursor for queries
+        self.__named = name is not None
         if name is None:
             name = 'OcPy_%08X' % (id(self) & 0xffffffff)
         self.__name = name
         self.__cursor = False
+        self.__converters = None
+        self.__batch = None
+        self.__prefetch = None
         self.reset()
         self.arraysize = 1     # Dim-witted DBAPI default rowcount for fetchmany
 
     def reset(self):
         self.__result = None
+        self.__converters = None
+        self.__batch = None
+        self.__exhausted = False
         if self.connection is None or self.connection.closed:
             raise ProgrammingError('Cursor is closed')
         if self.__cursor:
-            self._execute('CLOSE "%s"' % self.__name)
             self.__cursor = False
+            if self.__prefetch is not None:
+                # Any background FETCH must finish before the CLOSE
+                self.__prefetch = None
+                self.connection._join_prefetch()
+            # The cursor is closed by the end of its transaction, otherwise
+            # the CLOSE is sent along with the next command.
+            connection = self.connection
+            if (connection._transaction == self.__transaction and 
+                    connection.transactionStatus != TRANS_IDLE):
+                connection._defer('CLOSE "%s"' % self.__name)
         self.description = None
         self.rowcount = -1
         self.oidValue = None
@@ -60,47 +100,205 @@ class Cursor:
         return [(col.name, col.type, None, None, None, None, None)
                 for col in result.columns]
 
+    def _query_info(self, cmd):
+        # Cached [can be DECLAREd, result was small] for the SQL text. The
+        # cache is simply emptied when it reaches _query_cache_size.
+        connection = self.connection
+        queries = connection._queries
+        info = queries.get(cmd)
+        if info is None:
+            declarable = (self._re_query.match(cmd) is not None and
+                          self._re_4UP.search(cmd) is None and 
+                          self._re_IN2.search(cmd) is None and
+                          (self._re_DML.search(cmd) is None or
+                           self._re_DQL.match(cmd) is not None))
+            if len(queries) >= connection._query_cache_size:
+                queries.clear()
+            info = queries[cmd] = [declarable, False]
+        return info
+
+    def _is_small(self, result):
+        return (result.ntuples < self.fetch_min and 
+                result.memorySize <= self.fetch_budget)
+
     def execute(self, cmd, args=None):
+        """
+        Execute a command
+
+        Queries are run via a server-side cursor, so the rows are fetched
+        in batches, unless the same SQL has previously returned fewer than
+        fetch_min rows (and under fetch_budget bytes), in which case it is
+        run as a plain query and the result buffered. Should that result
+        turn out to be large, the cursor is used next time. In autocommit
+        mode, and for commands that can't be DECLAREd, results are always
+        buffered.
+        """
         self._assert_open()
         self.reset()
-        cmd, args = self.connection._normalise_args(cmd, args)
-        use_cursor = (self._re_DQL.match(cmd) is not None and
-                      self._re_4UP.search(cmd) is None and 
-                      self._re_IN2.search(cmd) is None)
-        if not self.connection.autocommit:
-            self.connection.begin()
+        connection = self.connection
+        cmd, args = connection._normalise_args(cmd, args)
+        info = None
+        use_cursor = False
+        if not connection.autocommit:
+            connection._defer_begin()
+            info = self._query_info(cmd)
+            use_cursor = info[0] and (self.__named or not info[1])
         if use_cursor:
-            cmd = 'DECLARE "%s" CURSOR WITHOUT HOLD FOR %s' % (self.__name, cmd)
+            batch = self._declare('DECLARE "%s" CURSOR WITHOUT HOLD FOR %s' % 
+                                  (self.__name, cmd), args)
+            info[1] = self.__exhausted and self._is_small(batch)
+            # The column types are fixed, so resolve the converters once
+            # for all subsequent FETCHes.
+            self.__converters = connection._converters(batch)
+            self.result_type = 'DQL'
+            self.description = self._make_description(batch)
+            return self
+        if info is not None and info[0]:
+            # Use a cursor next time if this fails (exceeding
+            # max_result_bytes, say)
+            info[1] = False
         result = self._execute(cmd, args)
         if result.status == PGRES_TUPLES_OK:
+            if info is not None and info[0]:
+                info[1] = self._is_small(result)
             self.result_type = 'DQL'
             self.__result = result
+            self.__converters = self.connection._converters(result)
             self.rowcount = result.ntuples
             self.description = self._make_description(result)
         elif result.status == PGRES_EMPTY_QUERY:
             self.result_type = 'EMPTY'
         elif result.status == PGRES_COMMAND_OK:
-            if use_cursor:
-                self.__cursor = True
-                # We need to FETCH anyway to get the column descriptions.
-                result = self._execute('FETCH 0 FROM "%s"' % self.__name)
-                self.result_type = 'DQL'
-                self.description = self._make_description(result)
+            self.rowcount = result.cmdTuples
+            self.oidValue = result.oid
+            if self.rowcount:
+                self.result_type = 'DML'
             else:
-                self.rowcount = result.cmdTuples
-                self.oidValue = result.oid
-                if self.rowcount:
-                    self.result_type = 'DML'
-                else:
-                    self.result_type = 'DDL'
+                self.result_type = 'DDL'
         else:
             raise InternalError('Unexpected result status %s' % result.status)
         return self
 
+    def _declare(self, cmd, args):
+        # DECLARE the server-side cursor and FETCH the first batch, which
+        # also describes the columns. Where libpq supports pipelining, both
+        # commands are sent together, costing a single round trip.
+        connection = self.connection
+        count = self._batch_size(None)
+        fetch_cmd = 'FETCH %d FROM "%s"' % (count, self.__name)
+        if connection._can_pipeline:
+            declared, batch = connection._pipeline([
+                (connection.sendQuery, (cmd, connection._args_to_db(args))),
+                (connection.sendQuery, (fetch_cmd, ())),
+            ])
+            connection._check_result(declared)
+            connection._check_result(batch)
+        else:
+            self._execute(cmd, args)
+            batch = self._execute(fetch_cmd)
+        self.__cursor = True
+        self.__transaction = connection._transaction
+        return self._set_batch(batch, count)
+
     def executemany(self, cmd, arglist):
-        # We could be much smarter about this...
-        for args in arglist:
-            self.execute(cmd, args)
+        self._assert_open()
+        if (not self.connection._can_pipeline 
+                or self._re_DQL.match(cmd) is not None):
+            for args in arglist:
+                self.execute(cmd, args)
+            return
+        self.reset()
+        if not self.connection.autocommit:
+            self.connection._defer_begin()
+        self.rowcount = self.connection._executemany(cmd, arglist)
+        self.result_type = 'DML'
+
+    def copy_from(self, table, columns, rows):
+        """
+        Bulk load rows into table using binary COPY FROM STDIN
+
+        columns is a sequence of column names (or None for all columns of
+        the table), and rows is an iterable of sequences of values, which
+        are converted in the same way as query parameters.
+        """
+        self._assert_open()
+        self.reset()
+        if not self.connection.autocommit:
+            self.connection._defer_begin()
+        self.rowcount = self.connection._copy_from(table, columns, rows)
+        self.result_type = 'DML'
+
+    def copy_to(self, sql_or_table, sink, format='binary'):
+        """
+        Export a table or query result using COPY TO STDOUT
+
+        The data is passed, as bytes, to sink, which is either a callable
+        or a file-like object with a write method. format is one of
+        'binary', 'text' or 'csv'.
+        """
+        self._assert_open()
+        self.reset()
+        try:
+            options = self._copy_formats[format]
+        except KeyError:
+            raise ProgrammingError('Unknown COPY format %r' % format)
+        write = getattr(sink, 'write', sink)
+        if not self.connection.autocommit:
+            self.connection._defer_begin()
+        self.rowcount = self.connection._copy_to(
+                'COPY %s TO STDOUT%s' % (self._copy_source(sql_or_table), 
+                                         options), write)
+        self.result_type = 'DML'
+
+    def copy_rows(self, sql_or_table):
+        """
+        Export a table or query result using binary COPY TO STDOUT,
+        returning an iterator over the decoded rows
+
+        Values are converted as for fetchall(), but without the FETCH
+        round trips, and memory use is bounded regardless of the result
+        size. The connection can not be used for anything else until the
+        iterator is exhausted or closed - closing it early cancels the COPY.
+        """
+        self._assert_open()
+        self.reset()
+        source = self._copy_source(sql_or_table)
+        if not self.connection.autocommit:
+            self.connection._defer_begin()
+        # COPY does not describe its columns, so ask for them separately
+        result = self._execute('SELECT * FROM %s AS q LIMIT 0' % source)
+        self.description = self._make_description(result)
+        self.result_type = 'DQL'
+        return self.connection._copy_rows(
+                'COPY %s TO STDOUT WITH BINARY' % source,
+                self.connection._converters(result), result.columns)
+
+    def _copy_source(self, sql_or_table):
+        if self._re_query.match(sql_or_table) is not None:
+            return '(%s)' % sql_or_table
+        return sql_or_table
+
+    def _batch_size(self, batch):
+        # Rows to FETCH after batch - twice as many, within the byte budget
+        if batch is None or not batch.ntuples:
+            size = self.fetch_min
+        else:
+            row_size = max(batch.memorySize // batch.ntuples, 1)
+            size = min(batch.ntuples * 2, self.fetch_budget // row_size)
+        return max(min(size, self.itersize), 1)
+
+    def _fetch_batch(self, count=None):
+        # FETCH the next count rows (or all remaining rows) into the buffer
+        if count is None:
+            cmd = 'FETCH ALL FROM "%s"' % self.__name
+        else:
+            cmd = 'FETCH %d FROM "%s"' % (count, self.__name)
+        return self._set_batch(self._execute(cmd), count)
+
+    def _set_batch(self, batch, count):
+        self.__batch = batch
+        self.__exhausted = count is None or batch.ntuples < count
+        return batch
 
     def _fetch(self, count=None):
         self._assert_open()
@@ -110,22 +308,72 @@ class Cursor:
             except (TypeError, ValueError):
                 raise ProgrammingError('Fetch count must be an integer')
         if self.__result:
-            rows = self.__result
-            rr = self.connection._result_row
-            if count is not None:
-                rows = itertools.islice(self.__result, count)
-            return [rr(row) for row in rows]
+            return self.connection._result_rows(self.__result, 
+                                                self.__converters, count)
         elif self.__cursor:
-            if count is None:
-                count = 'ALL'
-            result = self._execute('FETCH %s FROM "%s"' % (count, self.__name))
-            return self.connection._result_rows(result)
+            # Serve what we can from the current batch (and any batch
+            # being prefetched), and only go to the server when it runs out.
+            connection = self.connection
+            rows = []
+            batch = self.__batch
+            while True:
+                if count is None:
+                    rows.extend(connection._result_rows(batch, 
+                                                        self.__converters))
+                else:
+                    rows.extend(connection._result_rows(batch, 
+                                                        self.__converters, 
+                                                        count - len(rows)))
+                    if len(rows) >= count:
+                        return rows
+                if self.__exhausted:
+                    return rows
+                if self.__prefetch is not None:
+                    batch = self._wait_prefetch()
+                elif count is None:
+                    batch = self._fetch_batch()
+                else:
+                    batch = self._fetch_batch(max(count - len(rows), 
+                                                  self._batch_size(batch)))
         else:
             raise ProgrammingError('No results pending')
 
     def fetchall(self):
         return self._fetch()
 
+    def fetch_columns(self):
+        """
+        Fetch all remaining rows as columns
+
+        Returns a list containing a (values, nulls) tuple for each column.
+        Fixed width binary types (bool, int2/4/8, oid, float4/8, date, time
+        and timestamp) are decoded directly into an array.array, with dates
+        and timestamps left as offsets from the PG epoch (2000-01-01), and
+        times as offsets from midnight. Other types are returned as a list
+        of converted values. The nulls array contains 1 for each NULL
+        value.
+        """
+        self._assert_open()
+        connection = self.connection
+        if self.__result:
+            return connection._result_columns(self.__result, 
+                                              self.__converters)
+        elif self.__cursor:
+            batch = self.__batch
+            columns = connection._result_columns(batch, self.__converters)
+            while not self.__exhausted:
+                if self.__prefetch is not None:
+                    batch = self._wait_prefetch()
+                else:
+                    batch = self._fetch_batch()
+                columns = [(values + more_values, nulls + more_nulls)
+                           for (values, nulls), (more_values, more_nulls)
+                           in zip(columns, connection._result_columns(
+                                    batch, self.__converters))]
+            return columns
+        else:
+            raise ProgrammingError('No results pending')
+
     def fetchone(self):
         rows = self._fetch(1)
         if not rows:
@@ -138,8 +386,304 @@ class Cursor:
             count = self.arraysize
         return self._fetch(count)
 
+    def __iter__(self):
+        """
+        Iterate over the remaining rows, fetching them in batches (see
+        fetch_min, itersize and fetch_budget)
+
+        If the prefetch attribute is True, each batch is FETCHed by a helper
+        thread while the previous batch is being consumed, overlapping the
+        server round trip with row conversion and processing. Iteration
+        can be mixed with the fetch methods, which carry on from the same
+        row (and collect any batch being prefetched).
+        """
+        self._assert_open()
+        return self._iter_rows()
+
+    def _iter_rows(self):
+        # Rows are taken from the buffered result or batch one at a time,
+        # so the fetch methods carry on from wherever iteration stops.
+        lazy = self.connection.lazy_rows
+        while True:
+            buffer = self._next_buffer()
+            if buffer is None:
+                break
+            rows = buffer.rows
+            converters = self.__converters
+            while buffer is self.__result or buffer is self.__batch:
+                row = rows(converters, 1, lazy)
+                if not row:
+                    break
+                yield row[0]
+
+    def _next_buffer(self):
+        # Return the result or batch holding the next row, FETCHing another
+        # batch if needed, or None once all rows have been returned.
+        self._assert_open()
+        if self.__result:
+            result = self.__result
+            if result.rownumber < result.ntuples:
+                return result
+        elif self.__cursor:
+            batch = self.__batch
+            if batch.rownumber >= batch.ntuples:
+                if self.__exhausted:
+                    return None
+                if self.__prefetch is not None:
+                    batch = self._wait_prefetch()
+                else:
+                    batch = self._fetch_batch(self._batch_size(batch))
+            if (self.prefetch and self.__prefetch is None 
+                    and not self.__exhausted):
+                self._start_prefetch(self._batch_size(batch))
+            return batch
+        else:
+            raise ProgrammingError('No results pending')
+        return None
+
+    def _start_prefetch(self, count):
+        # FETCH the next count rows in a helper thread. The pending batch is
+        # kept on the cursor until it's needed by iteration or a fetch method.
+        cmd = 'FETCH %d FROM "%s"' % (count, self.__name)
+        self.__prefetch = self.connection._start_prefetch(cmd), count
+
+    def _wait_prefetch(self):
+        prefetch, count = self.__prefetch
+        self.__prefetch = None
+        batch = self.connection._check_result(prefetch.wait())
+        return self._set_batch(batch, count)
+
+
+class _Prefetch(threading.Thread):
+    """
+    Execute a command in a helper thread (the GIL is released while
+    waiting on the server). The result is left for the waiting thread to
+    check, so the connection's notice() and result_size() hooks run there.
+    """
+    def __init__(self, connection, cmd):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.connection = connection
+        self.cmd = cmd
+        self.result = None
+        self.exc_info = None
+
+    def run(self):
+        try:
+            self.result = PgConnection.execute(self.connection, self.cmd, ())
+        except:
+            self.exc_info = sys.exc_info()
+
+    def wait(self):
+        self.join()
+        if self.connection._prefetch is self:
+            self.connection._prefetch = None
+        if self.exc_info is not None:
+            exc_info, self.exc_info = self.exc_info, None
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return self.result
+
+
+class Statement:
+    """
+    A prepared statement - use Connection.prepare() to create one.
+
+    Calling the statement with a sequence or mapping of arguments (to suit
+    its placeholders) executes it, returning any rows as for
+    Connection.execute(). The SQL is translated once, and the to_db
+    function for each parameter and the from_db function for each result
+    column are looked up once, rather than on every call.
+
+    The statement is prepared on the server when first executed, with the
+    types of those arguments. Later arguments are cast to the same types
+    where possible (int to int8, say), and otherwise the statement is
+    prepared again.
+    """
+
+    def __init__(self, connection, cmd):
+        self.connection = connection
+        self.cmd = cmd
+        try:
+            self.sql, self._params = pyformat._compile(cmd, False)
+        except ProgrammingError:
+            self.sql, self._params = pyformat._compile(cmd, True)
+        if isinstance(self._params, tuple):
+            count = len(self._params)
+        else:
+            count = self._params
+        self._encoders = [(None, None)] * count
+        self.name = None
+        self._types = None
+        self._converters = None
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self.cmd)
+
+    def close(self):
+        """
+        Deallocate the server-side prepared statement
+        """
+        if self.name is not None:
+            name, self.name = self.name, None
+            self.connection._join_prefetch()
+            self.connection._deallocate(name)
+
+    def _encode(self, args):
+        # Convert args to (oid, data) in $n order, caching the to_db
+        # function for each parameter by the type of its value.
+        params = self._params
+        if isinstance(params, tuple):
+            try:
+                args = [args[name] for name in params]
+            except KeyError, e:
+                raise ProgrammingError('argument %%(%s)s not found in '
+                                       'dictionary' % e.args[0])
+        else:
+            if args is None:
+                args = ()
+            if len(args) != params:
+                raise ProgrammingError('wrong number of arguments for '
+                                       'statement (expected %d, got %s)' % 
+                                       (params, len(args)))
+        to_db = self.connection.to_db
+        encoders = self._encoders
+        values = []
+        for i, value in enumerate(args):
+            if value is None:
+                values.append(None)
+                continue
+            vtype, cvt = encoders[i]
+            if type(value) is not vtype:
+                vtype = type(value)
+                cvt = to_db.get(vtype)
+                if cvt is None or vtype is list or vtype is tuple:
+                    values.append(todb.value_to_db(to_db, value))
+                    continue
+                encoders[i] = vtype, cvt
+            try:
+                values.append(cvt(value))
+            except Exception, e:
+                raise DataError, 'column value %r: %s' % (value, e),\
+                      sys.exc_info()[2]
+        return values
+
+    def _cast(self, values):
+        # Cast values to the types the statement was prepared with, or
+        # return None if it needs to be prepared (again).
+        if self.name is None:
+            return None
+        cast = []
+        for value, oid in zip(values, self._types):
+            if value is not None and value[0] != oid:
+                if oid is None:
+                    return None
+                try:
+                    value = oid, pgtype.recast(value[0], oid, value[1])
+                except (TypeError, OverflowError):
+                    return None
+            cast.append(value)
+        return cast
+
+    def _prepare(self, values):
+        self.close()
+        connection = self.connection
+        types = [value and value[0] for value in values]
+        connection._statement_serial += 1
+        name = 'OcPy_P%d' % connection._statement_serial
+        connection._join_prefetch()
+        connection._check_result(
+                PgConnection.prepare(connection, name, self.sql, types))
+        self.name = name
+        self._types = types
+        self._converters = None
+
+    def _execute(self, args):
+        connection = self.connection
+        values = self._encode(args)
+        cast = self._cast(values)
+        if cast is None:
+            self._prepare(values)
+        else:
+            values = cast
+        result = connection._execute_statement(self.name, values)
+        if connection._is_stale_statement(result):
+            # As for the statement cache - prepare it again if this didn't
+            # cost us the transaction.
+            self.close()
+            if connection.transactionStatus == TRANS_IDLE:
+                self._prepare(values)
+                result = connection._execute_statement(self.name, values)
+        return connection._check_result(result)
+
+    def __call__(self, args=None):
+        result = self._execute(args)
+        if result.status == PGRES_TUPLES_OK and self._converters is None:
+            self._converters = self.connection._converters(result)
+        return self.connection._result_rows(result, self._converters)
+
+    def executemany(self, arglist):
+        """
+        Execute the statement once for each set of arguments, pipelined
+        where libpq supports it, returning the total number of rows
+        affected. An exception raised by the server has a parameter_set
+        attribute giving the index of the failing set of arguments.
+        """
+        connection = self.connection
+        rowcount = 0
+        if not connection._can_pipeline:
+            for args in arglist:
+                rowcount += self._execute(args).cmdTuples or 0
+            return rowcount
+        index = 0
+        batch = []
+        for args in arglist:
+            values = self._encode(args)
+            cast = self._cast(values)
+            if cast is None:
+                # The pending commands use the current statement
+                rowcount += self._execute_batch(batch, index)
+                index += len(batch)
+                batch = []
+                self._prepare(values)
+            else:
+                values = cast
+            batch.append(values)
+            if len(batch) >= connection._pipeline_batch:
+                rowcount += self._execute_batch(batch, index)
+                index += len(batch)
+                batch = []
+        return rowcount + self._execute_batch(batch, index)
+
+    def _execute_batch(self, batch, index):
+        if not batch:
+            return 0
+        connection = self.connection
+        send = connection.sendQueryPrepared
+        results = connection._pipeline([(send, (self.name, values)) 
+                                        for values in batch])
+        rowcount = 0
+        for i, result in enumerate(results):
+            connection._check_batch_result(result, index + i)
+            rowcount += result.cmdTuples or 0
+        return rowcount
+
 
 class Connection(PgConnection):
+    # Statements that can be executed via the prepared statement cache
+    _re_preparable = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|VALUES|WITH)\s', 
+                                re.IGNORECASE)
+    # Number of commands pipelined between synchronisation points
+    _pipeline_batch = 1000
+    _can_pipeline = hasattr(PgConnection, 'enterPipelineMode')
+    # Bytes of COPY data sent to the server at a time
+    _copy_buffer_size = 65536
+    # Background FETCH in progress (see Cursor.__iter__)
+    _prefetch = None
+    # COPY can't be sent in a pipeline
+    _re_copy = re.compile(r'^\s*COPY\s', re.IGNORECASE)
+    # Number of SQL texts Cursor.execute remembers the result size of
+    _query_cache_size = 1000
+
     def __init__(self, **kwargs):
         """
         Connect to PostgreSQL database
@@ -161,19 +705,53 @@ class Connection(PgConnection):
             use_mx_datetime     accept and return mx.DateTime types
             use_ipaddr          accept and return ipaddr instead of ipaddress
             autocommit          transaction autocommit mode
+            statement_cache_size
+                                number of server-side prepared statements
+                                to cache for reuse (default 0, disabled)
+            max_result_bytes    raise OperationalError rather than convert a
+                                result using more than this many bytes of
+                                memory (default None, no limit)
+            lazy_rows           return PgRow objects, which only decode a
+                                column when it is accessed, rather than
+                                tuples (default False)
+        """
+        conninfo, options = self._configure(kwargs)
+        PgConnection.__init__(self, conninfo)
+        # This makes sure we can parse what comes out of the db..
+        self._execute('SET datestyle TO ISO')
+        self._init_conversions(**options)
+
+    def _configure(self, kwargs):
+        """
+        Consume the ocpgdb-specific connection arguments, returning the
+        libpq conninfo string and the options for _init_conversions()
         """
         # Positional connection arguments are a horrible idea - only support
         # keyword args until convinced otherwise.
         if 'database' in kwargs:
             kwargs['dbname'] = kwargs.pop('database')
         self.show_notices = kwargs.pop('show_notices', False)
+        # Housekeeping commands (BEGIN, CLOSE) to be sent ahead of the next
+        # command, and the number of transactions begun.
+        self._deferred = []
+        self._transaction = 0
+        self._queries = {}
+        self._statement_serial = 0
         self.autocommit = kwargs.pop('autocommit', False)
+        statement_cache_size = kwargs.pop('statement_cache_size', 0)
+        if statement_cache_size > 0:
+            self.statement_cache = StatementCache(statement_cache_size)
+        else:
+            self.statement_cache = None
+        self.max_result_bytes = kwargs.pop('max_result_bytes', None)
+        self.lazy_rows = kwargs.pop('lazy_rows', False)
         use_mx_datetime = kwargs.pop('use_mx_datetime', False)
         use_ipaddr = kwargs.pop('use_ipaddr', False)
         conninfo = ' '.join(['%s=%s' % i for i in kwargs.items()])
-        PgConnection.__init__(self, conninfo)
-        # This makes sure we can parse what comes out of the db..
-        self._execute('SET datestyle TO ISO')
+        return conninfo, dict(use_mx_datetime=use_mx_datetime,
+                              use_ipaddr=use_ipaddr)
+
+    def _init_conversions(self, use_mx_datetime=False, use_ipaddr=False):
         self.from_db = dict(fromdb.from_db)
         self.to_db = dict(todb.to_db)
         if use_mx_datetime:
@@ -215,22 +793,454 @@ class Connection(PgConnection):
         fromdb._set_ipaddr(self.set_from_db)
         todb._set_ipaddr(self.set_to_db)
 
-    def _result_row(self, row):
-        return tuple([fromdb.value_from_db(self.from_db, cell) for cell in row])
+    def _converters(self, result):
+        return fromdb.converters(self.from_db, result.columns)
 
-    def _result_rows(self, result):
+    def _result_rows(self, result, converters=None, count=None):
         if result.status == PGRES_TUPLES_OK:
-            return [self._result_row(row) for row in result]
+            if converters is None:
+                converters = self._converters(result)
+            if count is None:
+                count = -1
+            return result.rows(converters, count, self.lazy_rows)
+
+    def _result_columns(self, result, converters=None):
+        if result.status == PGRES_TUPLES_OK:
+            if converters is None:
+                converters = self._converters(result)
+            columns = [result.column(i, cvt) 
+                       for i, cvt in enumerate(converters)]
+            result.rownumber = result.ntuples
+            return columns
 
     def _args_to_db(self, args):
-        return [todb.value_to_db(self.to_db, a) for a in args]
+        # Values are passed to PgConnection unconverted if their to_db
+        # function is still the default one it reproduces natively. The
+        # to_db map is checked every time, as it can be changed directly.
+        if not args:
+            return []
+        to_db = self.to_db
+        get_native, get_current = todb._native_to_db.get, to_db.get
+        values = []
+        for a in args:
+            if a is not None:
+                vtype = type(a)
+                fn = get_native(vtype)
+                if fn is None or get_current(vtype) is not fn:
+                    a = todb.value_to_db(to_db, a)
+            values.append(a)
+        return values
 
     def notice(self, msg):
         sys.stderr.write(msg)
 
+    def result_size(self, nbytes, ntuples):
+        """
+        Called with the memory used by each result containing rows (or 
+        each chunk of a streamed result) - override to collect metrics
+        """
+        pass
+
+    def _start_prefetch(self, cmd):
+        self._join_prefetch()
+        self._prefetch = prefetch = _Prefetch(self, cmd)
+        prefetch.start()
+        return prefetch
+
+    def _join_prefetch(self):
+        # libpq connections can't be used concurrently - wait for any
+        # background FETCH to finish (the cursor collects its result).
+        if self._prefetch is not None:
+            self._prefetch.join()
+            self._prefetch = None
+
+    def close(self):
+        self._join_prefetch()
+        PgConnection.close(self)
+
     def _execute(self, cmd, args=()):
+        self._join_prefetch()
         args = self._args_to_db(args)
-        result = PgConnection.execute(self, cmd, args)
+        if (self.statement_cache is not None 
+                and self._re_preparable.match(cmd) is not None):
+            return self._execute_prepared(cmd, args)
+        if self._deferred:
+            if self._can_pipeline and self._re_copy.match(cmd) is None:
+                # Send any deferred commands in the same round trip
+                return self._check_result(
+                        self._pipeline([(self.sendQuery, (cmd, args))])[0])
+            self._send_deferred()
+        return self._check_result(PgConnection.execute(self, cmd, args))
+
+    def _defer(self, cmd):
+        """
+        Queue a command with no results of interest, to be sent along with
+        the next command (in the same round trip where libpq supports
+        pipelining). Discarded if the transaction ends first.
+        """
+        self._deferred.append(cmd)
+
+    def _defer_begin(self):
+        # Begin a transaction, if one isn't already open, with the next
+        # command
+        if (self.transactionStatus == TRANS_IDLE 
+                and 'BEGIN WORK' not in self._deferred):
+            self._transaction += 1
+            self._defer('BEGIN WORK')
+
+    def _send_deferred(self):
+        deferred, self._deferred = self._deferred, []
+        for cmd in deferred:
+            self._check_result(PgConnection.execute(self, cmd, ()))
+
+    def _executemany(self, cmd, arglist):
+        """
+        Execute cmd once for each set of args, pipelining the commands and
+        synchronising with the server every _pipeline_batch commands.
+        Returns the total number of rows affected. Errors are raised with
+        a parameter_set attribute giving the index of the failing args.
+
+        Note that outside a transaction, each batch is executed as a single
+        implicit transaction.
+        """
+        rowcount = 0
+        index = 0
+        batch = []
+        for args in arglist:
+            batch.append(self._normalise_args(cmd, args))
+            if len(batch) >= self._pipeline_batch:
+                rowcount += self._execute_batch(batch, index)
+                index += len(batch)
+                batch = []
+        if batch:
+            rowcount += self._execute_batch(batch, index)
+        return rowcount
+
+    def _execute_batch(self, batch, index):
+        # The statement is prepared (unnamed) once, and then re-prepared 
+        # only if the parameter types change.
+        commands = []
+        prepared = None
+        for i, (cmd, args) in enumerate(batch):
+            args = self._args_to_db(args)
+            types = param_types(args)
+            if (cmd, types) != prepared:
+                commands.append((index + i, False, 
+                                 self.sendPrepare, ('', cmd, types)))
+                prepared = cmd, types
+            commands.append((index + i, True, 
+                             self.sendQueryPrepared, ('', args)))
+        results = self._pipeline([command[2:] for command in commands])
+        rowcount = 0
+        for (param_index, is_query, send, send_args), result in \
+                zip(commands, results):
+            self._check_batch_result(result, param_index)
+            if is_query:
+                rowcount += result.cmdTuples or 0
+        return rowcount
+
+    def _check_batch_result(self, result, index):
+        try:
+            return self._check_result(result)
+        except Error, e:
+            # Identify the failing set of arguments to executemany
+            e.parameter_set = index
+            raise
+
+    def _pipeline(self, commands):
+        """
+        Send a list of (send_fn, args) commands to the server as a single
+        pipeline, returning the list of results. After an error, the
+        results of the remaining commands will be PGRES_PIPELINE_ABORTED.
+
+        Any deferred commands are sent first, and raise an exception if
+        they fail.
+        """
+        self._join_prefetch()
+        deferred, self._deferred = self._deferred, []
+        commands = [(self.sendQuery, (cmd, ())) for cmd in deferred] + \
+                   list(commands)
+        error = None
+        self.enterPipelineMode()
+        try:
+            # Sends don't block in nonblocking mode, so the results can be
+            # read while the commands are flushed (see _pipeline_sync).
+            self.setnonblocking(True)
+            sent = 0
+            try:
+                for send, args in commands:
+                    send(*args)
+                    sent += 1
+            except:
+                # Bring the commands already sent to the sync point before
+                # raising, so the connection can still be used.
+                error = sys.exc_info()
+            results = self._pipeline_sync(sent)
+            self.setnonblocking(False)
+            if not self.exitPipelineMode():
+                raise InternalError('Unable to exit pipeline mode')
+        except:
+            # The connection is out of step with the server, and can't be
+            # used again.
+            if error is None:
+                error = sys.exc_info()
+            self.close()
+            raise error[0], error[1], error[2]
+        if error is not None:
+            raise error[0], error[1], error[2]
+        for result in results[:len(deferred)]:
+            self._check_result(result)
+        return results[len(deferred):]
+
+    def _pipeline_sync(self, count):
+        """
+        Mark a synchronisation point, flush the pipeline to the server, and
+        return the first result of each of the count commands sent since
+        the last one.
+        """
+        self.pipelineSync()
+        while self.flush():
+            # Consume any results meanwhile - the server may be blocked
+            # sending them, and not reading any more commands until it can.
+            readable, writable, exceptional = select.select([self], [self], [])
+            if readable:
+                self.consumeInput()
+        results = []
+        for i in range(count):
+            results.append(self.getResult())
+            while self.getResult() is not None:
+                pass
+        result = self.getResult()
+        if result is None or result.status != PGRES_PIPELINE_SYNC:
+            raise InternalError('Unexpected pipeline result status %s' % 
+                                (result and result.status))
+        return results
+
+    def _copy_from(self, table, columns, rows):
+        """
+        Send rows to the server in the binary COPY format, in chunks of
+        about _copy_buffer_size bytes. Returns the number of rows copied.
+        """
+        if columns:
+            column_list = ', '.join(columns)
+            copy_cmd = 'COPY %s (%s) FROM STDIN WITH BINARY' %\
+                (table, column_list)
+        else:
+            column_list = '*'
+            copy_cmd = 'COPY %s FROM STDIN WITH BINARY' % table
+        # COPY does no implicit casting, so we need the column types
+        result = self._execute('SELECT %s FROM %s LIMIT 0' % 
+                               (column_list, table))
+        columns = result.columns
+        result = self._execute(copy_cmd)
+        if result.status != PGRES_COPY_IN:
+            raise InternalError('Unexpected COPY result status: %s' % 
+                                result.status)
+        to_db = self.to_db
+        buffer_size = self._copy_buffer_size
+        try:
+            chunk = [pgtype.copy_binary_header]
+            size = 0
+            for row_number, row in enumerate(rows):
+                if len(row) != len(columns):
+                    raise DataError('row %d has %d values, expected %d' %
+                                    (row_number, len(row), len(columns)))
+                fields = []
+                for column, value in zip(columns, row):
+                    if value is not None:
+                        oid, value = todb.value_to_db(to_db, value)
+                        try:
+                            value = pgtype.recast(oid, column.type, value)
+                        except (TypeError, OverflowError), e:
+                            raise DataError('row %d, column %r: %s' %
+                                            (row_number, column.name, e))
+                    fields.append(value)
+                data = pgtype.pack_copy_tuple(fields)
+                chunk.append(data)
+                size += len(data)
+                if size >= buffer_size:
+                    self.putCopyData(b''.join(chunk))
+                    chunk = []
+                    size = 0
+            chunk.append(pgtype.copy_binary_trailer)
+            self.putCopyData(b''.join(chunk))
+        except:
+            exc = sys.exc_info()
+            try:
+                self.putCopyEnd('COPY aborted by client: %s' % exc[1])
+                self._discard_results(cancel=False)
+            except OperationalError:
+                pass
+            raise exc[0], exc[1], exc[2]
+        self.putCopyEnd()
+        result = self.getResult()
+        self._discard_results(cancel=False)
+        return self._check_result(result).cmdTuples
+
+    def _copy_to(self, cmd, write):
+        """
+        Pass the output of a COPY TO STDOUT command to write, in chunks of
+        about _copy_buffer_size bytes. Returns the number of rows copied.
+        """
+        result = self._execute(cmd)
+        if result.status != PGRES_COPY_OUT:
+            raise InternalError('Unexpected COPY result status: %s' % 
+                                result.status)
+        buffer_size = self._copy_buffer_size
+        try:
+            chunk = []
+            size = 0
+            while True:
+                data = self.getCopyData()
+                if data is None:
+                    break
+                chunk.append(data)
+                size += len(data)
+                if size >= buffer_size:
+                    write(b''.join(chunk))
+                    chunk = []
+                    size = 0
+            if chunk:
+                write(b''.join(chunk))
+        except:
+            exc = sys.exc_info()
+            self._abort_copy_out()
+            raise exc[0], exc[1], exc[2]
+        result = self.getResult()
+        self._discard_results(cancel=False)
+        return self._check_result(result).cmdTuples
+
+    def _copy_rows(self, cmd, converters, columns):
+        result = self._execute(cmd)
+        if result.status != PGRES_COPY_OUT:
+            raise InternalError('Unexpected COPY result status: %s' % 
+                                result.status)
+        return self._copy_row_iter(converters, columns)
+
+    def _copy_row_iter(self, converters, columns):
+        # Binary COPY data arrives a row at a time - gather about
+        # _copy_buffer_size bytes before decoding the complete tuples, and
+        # carry any partial tuple over to the next chunk.
+        buffer_size = self._copy_buffer_size
+        pending = b''
+        header = True
+        copying = True
+        try:
+            while copying:
+                chunk = [pending]
+                size = 0
+                while size < buffer_size:
+                    data = self.getCopyData()
+                    if data is None:
+                        copying = False
+                        result = self.getResult()
+                        self._discard_results(cancel=False)
+                        self._check_result(result)
+                        break
+                    chunk.append(data)
+                    size += len(data)
+                pending = b''.join(chunk)
+                offset = 0
+                if header:
+                    try:
+                        offset = pgtype.copy_header_size(pending)
+                    except ValueError, e:
+                        raise InternalError(str(e))
+                    if offset is None:
+                        continue
+                    header = False
+                rows, offset = unpack_copy_tuples(converters, pending, offset,
+                                                  columns)
+                pending = pending[offset:]
+                for row in rows:
+                    yield row
+        finally:
+            if copying:
+                self._abort_copy_out()
+        if header or pending != pgtype.copy_binary_trailer:
+            raise InternalError('Truncated binary COPY data')
+
+    def _abort_copy_out(self):
+        # Cancel an abandoned COPY TO STDOUT, and consume the remaining
+        # data and results so the connection can be reused.
+        try:
+            self.cancel()
+            while self.getCopyData() is not None:
+                pass
+        except OperationalError:
+            pass
+        self._discard_results(cancel=False)
+
+    def _execute_statement(self, name, args):
+        # Execute a prepared statement (args already converted), returning
+        # the unchecked result
+        self._join_prefetch()
+        if self._deferred:
+            if self._can_pipeline:
+                return self._pipeline([(self.sendQueryPrepared, 
+                                        (name, args))])[0]
+            self._send_deferred()
+        return self.execPrepared(name, args)
+
+    def _execute_prepared(self, cmd, args):
+        cache = self.statement_cache
+        types = param_types(args)
+        key = cmd, tuple(types)
+        name = cache.get(key)
+        if name is None:
+            result = self._prepare(key, cmd, types, args)
+        else:
+            result = self._execute_statement(name, args)
+        if self._is_stale_statement(result):
+            # The server rejected the cached statement (typically due to a
+            # schema change) - forget it, and if this didn't cost us the
+            # transaction, prepare and execute it again.
+            self._deallocate(cache.invalidate(key))
+            if self.transactionStatus == TRANS_IDLE:
+                result = self._prepare(key, cmd, types, args)
+        return self._check_result(result)
+
+    def _prepare(self, key, cmd, types, args):
+        # Add cmd to the statement cache, then prepare and execute it, 
+        # returning the unchecked result. Where libpq supports pipelining,
+        # any deferred commands, the prepare and the execute are sent 
+        # together, costing a single round trip.
+        name, evicted = self.statement_cache.add(key)
+        for old_name in evicted:
+            self._deallocate(old_name)
+        try:
+            if self._can_pipeline:
+                prepared, result = self._pipeline([
+                    (self.sendPrepare, (name, cmd, types)),
+                    (self.sendQueryPrepared, (name, args)),
+                ])
+                self._check_result(prepared)
+            else:
+                self._send_deferred()
+                self._check_result(
+                        PgConnection.prepare(self, name, cmd, types))
+                result = self.execPrepared(name, args)
+        except:
+            self.statement_cache.remove(key)
+            raise
+        return result
+
+    def _deallocate(self, name):
+        # Errors are ignored - the statement will simply remain allocated on
+        # the server until the connection is closed.
+        if name is not None:
+            PgConnection.execute(self, 'DEALLOCATE "%s"' % name, ())
+
+    def _is_stale_statement(self, result):
+        if result.status != PGRES_FATAL_ERROR:
+            return False
+        sqlstate = result.errorField(DIAG_SQLSTATE)
+        # 0A000 cached plan must not change result type
+        # 26000 prepared statement does not exist
+        return ((sqlstate == '0A000' and 'cached plan' in result.errorMessage) 
+                or sqlstate == '26000')
+
+    def _check_result(self, result):
         if self.show_notices:
             for msg in self.notices:
                 self.notice(msg)
@@ -243,61 +1253,115 @@ class Connection(PgConnection):
                 raise IntegrityError(msg)
             else:
                 raise OperationalError(msg)
+        elif result.ntuples:
+            self._check_result_size(result)
         return result
 
-    def _normalise_dict_args(self, cmd, dictargs):
-        class DictArgs:
-            def __init__(self, dictargs):
-                self.index = 0
-                self.args = []
-                self.dictargs = dictargs
-                self.fmtdict = {}
-            def __getitem__(self, k):
-                fmt = self.fmtdict.get(k, None)
-                if fmt is None:
-                    try:
-                        self.args.append(self.dictargs[k])
-                    except KeyError:
-                        raise ProgrammingError('argument %%(%s)s not found in dictionary' % k)
-                    self.index += 1
-                    self.fmtdict[k] = fmt = '$%d' % self.index
-                return fmt
-            def __str__(self):
-                raise ProgrammingError('command contains %s with dict args')
-        dictargs = DictArgs(dictargs)
-        cmd = cmd % dictargs
-        return cmd, tuple(dictargs.args)
-
-    def _normalise_seq_args(self, cmd, seqargs):
-        seqargs = tuple(seqargs)
-        cmd = cmd.split('%s')
-        expected = len(cmd) - 1
-        if expected != len(seqargs):
-            raise ProgrammingError('wrong number of arguments for command string (expected %d, got %s)' % (expected, len(seqargs)))
-        for i in xrange(expected, 0, -1):
-            cmd.insert(i, '$%d' % i)
-        return ''.join(cmd), seqargs
+    def _check_result_size(self, result):
+        # Checked before any rows are converted, which typically needs
+        # several times the memory of the result itself.
+        nbytes = result.memorySize
+        self.result_size(nbytes, result.ntuples)
+        if self.max_result_bytes is not None and \
+                nbytes > self.max_result_bytes:
+            raise OperationalError('Result of %d rows uses %d bytes, more '
+                                   'than max_result_bytes (%d)' % 
+                                   (result.ntuples, nbytes, 
+                                    self.max_result_bytes))
 
     def _normalise_args(self, cmd, args):
         if not args:
             return cmd, ()
-        if hasattr(args, 'keys'):
-            return self._normalise_dict_args(cmd, args)
-        return self._normalise_seq_args(cmd, args)
+        return pyformat.translate(cmd, args)
 
     def execute(self, cmd, args=None):
         cmd, args = self._normalise_args(cmd, args)
         return self._result_rows(self._execute(cmd, args))
 
+    def prepare(self, cmd):
+        """
+        Return a Statement for cmd, for repeated execution with
+        different arguments
+        """
+        return Statement(self, cmd)
+
+    def stream(self, cmd, args=None, chunk_size=1000):
+        """
+        Execute a query, yielding rows as they arrive from the server
+
+        Rows are not buffered client-side, so memory use is bounded
+        regardless of the result size, and no cursor or transaction is
+        required. Where libpq supports it, rows are retrieved in chunks of
+        up to chunk_size rows, otherwise one at a time. The connection can
+        not be used for anything else until the iterator is exhausted or
+        closed - closing it early cancels the query.
+        """
+        if hasattr(self, 'setChunkedRowsMode'):
+            set_mode, mode_args = self.setChunkedRowsMode, (chunk_size,)
+        elif hasattr(self, 'setSingleRowMode'):
+            set_mode, mode_args = self.setSingleRowMode, ()
+        else:
+            raise NotSupportedError('stream() requires libpq 9.2 or later')
+        cmd, args = self._normalise_args(cmd, args)
+        self._join_prefetch()
+        self._send_deferred()
+        self.sendQuery(cmd, self._args_to_db(args))
+        try:
+            if not set_mode(*mode_args):
+                raise OperationalError('Unable to select single row mode '
+                                       'for stream()')
+        except:
+            exc = sys.exc_info()
+            self._discard_results()
+            raise exc[0], exc[1], exc[2]
+        return self._stream_results()
+
+    def _stream_results(self):
+        converters = None
+        result = self.getResult()
+        try:
+            while result is not None:
+                if result.status in (PGRES_NONFATAL_ERROR, PGRES_FATAL_ERROR):
+                    error, result = result, None
+                    self._discard_results(cancel=False)
+                    self._check_result(error)
+                if result.ntuples:
+                    self._check_result_size(result)
+                    if converters is None:
+                        converters = self._converters(result)
+                    for row in result.rows(converters, -1, 
+                                           self.lazy_rows):
+                        yield row
+                result = self.getResult()
+        finally:
+            if result is not None:
+                self._discard_results()
+
+    def _discard_results(self, cancel=True):
+        # Optionally cancel the remainder of an abandoned command, and
+        # consume its results so the connection can be reused.
+        if cancel:
+            try:
+                self.cancel()
+            except OperationalError:
+                pass
+        while self.getResult() is not None:
+            pass
+
     def begin(self):
-        if self.transactionStatus == TRANS_IDLE:
-            self._execute('BEGIN WORK')
+        self._defer_begin()
+        self._join_prefetch()
+        self._send_deferred()
 
     def commit(self):
+        # Deferred commands (cursor CLOSEs, or a BEGIN with nothing to
+        # follow) are moot once the transaction ends.
+        self._deferred = []
         if self.transactionStatus != TRANS_IDLE:
             self._execute('COMMIT WORK')
 
     def rollback(self):
+        self._deferred = []
         if self.transactionStatus != TRANS_IDLE:
             self._execute('ROLLBACK WORK')
 
@@ -45,20 +45,36 @@ def register_from(setfn, integer_datetimes):
     #setfn(pgoid.interval, from_interval)
 
 
+# The integer datetime packers are module level functions, so the
+# connection can recognise them (see todb._native_to_db)
+timestamp_epoch = datetime.datetime(2000,1,1)
+date_epoch = datetime.date(2000,1,1)
+
+def to_int_time(value):
+    microseconds = (value.microsecond + 1000000L * (value.second
+                    + 60 * (value.minute + 60 * (value.hour))))
+    return pgtype.pack_int_time(microseconds)
+
+def to_int_timestamp(value):
+    delta = value - timestamp_epoch
+    microseconds = (delta.microseconds + 1000000L * (delta.seconds
+                    + 86400 * delta.days))
+    return pgtype.pack_int_timestamp(microseconds)
+
+def to_int_date(value):
+    delta = value - date_epoch
+    return pgtype.pack_int_date(delta.days)
+
 def register_to(setfn, integer_datetimes):
-    import datetime
     if integer_datetimes:
-        pack_time = pgtype.pack_int_time
-        pack_timestamp = pgtype.pack_int_timestamp
-        pack_date = pgtype.pack_int_date
-        usec_mul = 1000000L
-    else:
-        pack_time = pgtype.pack_flt_time
-        pack_timestamp = pgtype.pack_flt_timestamp
-        pack_date = pgtype.pack_flt_date
-        usec_mul = 1000000.0
-    timestamp_epoch = datetime.datetime(2000,1,1)
-    date_epoch = datetime.date(2000,1,1)
+        setfn(datetime.time, to_int_time)
+        setfn(datetime.datetime, to_int_timestamp)
+        setfn(datetime.date, to_int_date)
+        return
+    pack_time = pgtype.pack_flt_time
+    pack_timestamp = pgtype.pack_flt_timestamp
+    pack_date = pgtype.pack_flt_date
+    usec_mul = 1000000.0
 
     def to_time(value):
         microseconds = (value.microsecond + usec_mul * (value.second
@@ -77,4 +93,3 @@ def register_to(setfn, integer_datetimes):
         delta = value - date_epoch
         return pack_date(delta.days)
     setfn(datetime.date, to_date)
-
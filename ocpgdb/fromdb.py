@@ -36,6 +36,36 @@ def value_from_db(from_db, cell):
     except Exception, e:
         raise InternalError, 'failed to convert column value %r (column %r, type %r): %s' % (cell.value, cell.name, cell.type, e), sys.exc_info()[2]
 
+def _no_converter(column):
+    def no_converter(value):
+        raise InterfaceError('No from_db function for type %r (column %r, value %r)'% (column.type, column.name, value))
+    return no_converter
+
+def _array_converter(from_db):
+    def array_converter(value):
+        return array_from_db(from_db, value)
+    return array_converter
+
+def converters(from_db, columns):
+    """
+    Resolve the from_db converter for each result column
+
+    The returned list is suitable for passing to PgResult.rows(), which
+    reports conversion errors as InternalError. Lookup failures are
+    deferred until a (non-NULL) value is actually converted.
+    """
+    plan = []
+    for column in columns:
+        try:
+            cvt = from_db[column.type]
+        except KeyError:
+            cvt = _no_converter(column)
+        else:
+            if cvt is array_from_db:
+                cvt = _array_converter(from_db)
+        plan.append(cvt)
+    return plan
+
 for array_oid in pgoid.array_to_data:
     set_from_db(array_oid, array_from_db)
 
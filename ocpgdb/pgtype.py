@@ -2,7 +2,9 @@ from __future__ import division
 # Standard Python Libs
 import sys
 import struct
+import codecs
 # Module libs
+import oclibpq
 from oclibpq import bytea
 from . import pgoid
 
@@ -56,16 +58,24 @@ else:
             return __unpack(buf)[0]
         return _unpack, _pack
 
-_unpack_bool, pack_bool = _mk_fns(pgoid.bool, '!B')
-def unpack_bool(buf):
-    return bool(_unpack_bool(buf))
+# The core types are unpacked by native functions from the C module - result
+# decoding recognises these and decodes directly from the PGresult without
+# calling back into Python.
+unpack_bool = oclibpq.unpack_bool
+unpack_int2 = oclibpq.unpack_int2
+unpack_int4 = oclibpq.unpack_int4
+unpack_oid = oclibpq.unpack_oid
+unpack_int8 = oclibpq.unpack_int8
+unpack_float4 = oclibpq.unpack_float4
+unpack_float8 = oclibpq.unpack_float8
 
-unpack_int2, pack_int2 = _mk_fns(pgoid.int2, '!h')
-unpack_int4, pack_int4 = _mk_fns(pgoid.int4, '!l')
-unpack_oid, pack_oid = _mk_fns(pgoid.oid, '!L')
-unpack_int8, pack_int8 = _mk_fns(pgoid.int8, '!q')
-unpack_float4, pack_float4 = _mk_fns(pgoid.float4, '!f')
-unpack_float8, pack_float8 = _mk_fns(pgoid.float8, '!d')
+pack_bool = _mk_fns(pgoid.bool, '!B')[1]
+pack_int2 = _mk_fns(pgoid.int2, '!h')[1]
+pack_int4 = _mk_fns(pgoid.int4, '!l')[1]
+pack_oid = _mk_fns(pgoid.oid, '!L')[1]
+pack_int8 = _mk_fns(pgoid.int8, '!q')[1]
+pack_float4 = _mk_fns(pgoid.float4, '!f')[1]
+pack_float8 = _mk_fns(pgoid.float8, '!d')[1]
 if sys.maxint > 0x7fffffff:
     def pack_int(value):
         if value > 0x7fffffff or value < -0x80000000:
@@ -83,12 +93,25 @@ unpack_bytea = bytea
 def pack_bytea(value):
     return pgoid.bytea, value
 
+def pack_utf8(value):
+    return pgoid.text, value.encode('utf-8')
+
 def mk_pack_unicode(encoding):
+    try:
+        if codecs.lookup(encoding).name == 'utf-8':
+            return pack_utf8
+    except LookupError:
+        pass
     def pack_unicode(value):
         return pgoid.text, value.encode(encoding)
     return pack_unicode
 
 def mk_unpack_unicode(encoding):
+    try:
+        if codecs.lookup(encoding).name == 'utf-8':
+            return oclibpq.unpack_utf8
+    except LookupError:
+        pass
     def unpack_unicode(value):
         return value.decode(encoding)
     return unpack_unicode
@@ -166,3 +189,84 @@ def unpack_array(data):
         elements.append(data[data_offset:end_offset])
         offset = end_offset
     return data_oid, dims, elements
+
+# Binary COPY - the stream starts with a signature, a flags word and a header
+# extension length, and is terminated by a -1 field count:
+#
+#	for each tuple:
+#		field count (int2)
+#		for each field:
+#			field length (int4, -1 for NULL)
+#			field value, in the appropriate format
+copy_binary_header = b'PGCOPY\n\377\r\n\0' + struct.pack('!ll', 0, 0)
+copy_binary_trailer = struct.pack('!h', -1)
+
+def copy_header_size(data):
+    """
+    Return the length of the binary COPY header (including any header
+    extension) at the start of data, or None if data is too short
+    """
+    signature = copy_binary_header[:11]
+    if len(data) < len(copy_binary_header):
+        return None
+    if not data.startswith(signature):
+        raise ValueError('invalid binary COPY signature')
+    size = len(copy_binary_header) + struct.unpack('!l', data[15:19])[0]
+    if len(data) < size:
+        return None
+    return size
+
+def pack_copy_tuple(fields):
+    data = [struct.pack('!h', len(fields))]
+    for field in fields:
+        if field is None:
+            data.append(struct.pack('!l', -1))
+        else:
+            if not isinstance(field, bytes):
+                # bytearray, memoryview etc
+                field = memoryview(field).tobytes()
+            data.append(struct.pack('!l', len(field)))
+            data.append(field)
+    return b''.join(data)
+
+# Unlike query parameters, COPY data is not cast by the server, so values
+# must be sent in the binary format of the destination column. recast()
+# converts between the formats of compatible types.
+def _mk_recast(unpack, pack):
+    def _recast(data):
+        try:
+            return pack(unpack(data))[1]
+        except struct.error, e:
+            raise OverflowError(str(e))
+    return _recast
+
+def _same(data):
+    return data
+
+_recasts = {}
+for _types in (
+        ((pgoid.int2, unpack_int2, pack_int2),
+         (pgoid.int4, unpack_int4, pack_int4),
+         (pgoid.int8, unpack_int8, pack_int8)),
+        ((pgoid.float4, unpack_float4, pack_float4),
+         (pgoid.float8, unpack_float8, pack_float8))):
+    for _from_oid, _unpack, _ in _types:
+        for _to_oid, _, _pack in _types:
+            _recasts[(_from_oid, _to_oid)] = _mk_recast(_unpack, _pack)
+for _types in (
+        (pgoid.text, pgoid.varchar, pgoid.bpchar, pgoid.name),
+        (pgoid.timestamp, pgoid.timestamptz)):
+    for _from_oid in _types:
+        for _to_oid in _types:
+            _recasts[(_from_oid, _to_oid)] = _same
+del _types, _from_oid, _to_oid, _unpack, _pack
+
+def recast(from_oid, to_oid, data):
+    if from_oid == to_oid:
+        return data
+    try:
+        cvt = _recasts[(from_oid, to_oid)]
+    except KeyError:
+        raise TypeError('cannot convert oid %s data to oid %s' % 
+                        (from_oid, to_oid))
+    return cvt(data)
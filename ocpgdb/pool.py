@@ -0,0 +1,329 @@
+"""
+Thread-safe connection pool
+
+    from ocpgdb import pool
+
+    db_pool = pool.ConnectionPool(minconn=2, maxconn=20, dbname='test')
+    conn = db_pool.getconn()
+    try:
+        ...
+    finally:
+        db_pool.putconn(conn)
+
+Connections are health checked on checkout without a round trip to the
+server, and rolled back on return if a transaction was left open.
+"""
+import time
+import threading
+from oclibpq import *
+from . import connection
+
+__all__ = ['ConnectionPool']
+
+
+def _is_alive(conn):
+    # Check the connection without a round trip - reading any pending
+    # input will reveal a connection closed by the server. The server
+    # usually sends a FATAL message before closing the connection, in
+    # which case the end of file is only seen by a second read.
+    if conn.closed or conn.status != CONNECTION_OK:
+        return False
+    try:
+        conn.consumeInput()
+        conn.consumeInput()
+    except OperationalError:
+        return False
+    return conn.status == CONNECTION_OK
+
+
+def _close(conns):
+    # Close discarded connections - called with the pool lock released, so
+    # a slow close does not hold up other threads.
+    for conn in conns:
+        try:
+            conn.close()
+        except DatabaseError:
+            pass
+
+
+class _Checkout:
+    def __init__(self, pool, conn):
+        self.pool = pool
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.pool.putconn(self.conn)
+
+
+class ConnectionPool:
+    """
+    A pool of between minconn and maxconn connections, created with
+    connect(**kwargs) (ocpgdb.connect by default).
+
+    Connections older than max_lifetime seconds are closed rather than
+    reused, and idle connections beyond minconn are closed once they have
+    been idle for max_idle seconds. Idle connections are reaped as the
+    pool is used, rather than by a background thread.
+    """
+
+    def __init__(self, minconn=1, maxconn=10, max_lifetime=None,
+                 max_idle=None, connect=None, **kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError('invalid pool size (minconn %r, maxconn %r)' %
+                             (minconn, maxconn))
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        if connect is None:
+            connect = connection.connect
+        self._connect = connect
+        self._kwargs = kwargs
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = []         # (conn, idle since), most recently used last
+        self._created = {}      # conn -> time created
+        self._in_use = set()    # checked out connections
+        self._opening = 0       # connections being created
+        self._closed = False
+        # Metrics
+        self.waiting = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.discards = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.prewarm()
+
+    def __len__(self):
+        return len(self._created)
+
+    def __repr__(self):
+        return '<%s %d/%d connections, %d idle>' %\
+            (self.__class__.__name__, len(self._created), self.maxconn,
+             len(self._idle))
+
+    def prewarm(self):
+        """
+        Open connections until the pool holds at least minconn
+        """
+        while True:
+            self._cond.acquire()
+            try:
+                if self._closed or \
+                        len(self._created) + self._opening >= self.minconn:
+                    return
+                self._opening += 1
+            finally:
+                self._cond.release()
+            conn = self._open()
+            discarded = []
+            self._cond.acquire()
+            try:
+                if self._closed:
+                    self._discard(conn, discarded)
+                else:
+                    self._idle.append((conn, time.time()))
+                    self._cond.notify()
+            finally:
+                self._cond.release()
+            _close(discarded)
+
+    def _open(self):
+        # Called with _opening incremented and the lock released
+        try:
+            conn = self._connect(**self._kwargs)
+        except:
+            self._cond.acquire()
+            try:
+                self._opening -= 1
+                self._cond.notify()
+            finally:
+                self._cond.release()
+            raise
+        self._cond.acquire()
+        try:
+            self._opening -= 1
+            self._created[conn] = time.time()
+            self.connects += 1
+        finally:
+            self._cond.release()
+        return conn
+
+    def _discard(self, conn, discarded):
+        # Called with the lock held - the connection is added to discarded,
+        # for the caller to _close() once the lock is released.
+        self._created.pop(conn, None)
+        self.discards += 1
+        discarded.append(conn)
+
+    def _expired(self, conn, now):
+        return (self.max_lifetime is not None and
+                now - self._created[conn] > self.max_lifetime)
+
+    def _reap(self, now, discarded):
+        # Discard connections that have been idle too long (least recently
+        # used first), keeping at least minconn. Called with the lock held.
+        if self.max_idle is None:
+            return
+        while (self._idle and len(self._created) > self.minconn and
+                now - self._idle[0][1] > self.max_idle):
+            conn, since = self._idle.pop(0)
+            self._discard(conn, discarded)
+
+    def getconn(self, timeout=None, block=True):
+        """
+        Check a connection out of the pool, waiting up to timeout seconds
+        (or indefinitely if timeout is None) for one to become available
+        if the pool is at maxconn. If block is False, raises
+        OperationalError immediately if no connection is available.
+        """
+        start = time.time()
+        conn = None
+        discarded = []
+        self._cond.acquire()
+        try:
+            self.waiting += 1
+            try:
+                while True:
+                    if self._closed:
+                        raise ProgrammingError('Connection pool is closed')
+                    now = time.time()
+                    self._reap(now, discarded)
+                    while self._idle:
+                        conn, since = self._idle.pop()
+                        if not self._expired(conn, now) and \
+                                _is_alive(conn):
+                            break
+                        self._discard(conn, discarded)
+                        conn = None
+                    if conn is not None:
+                        break
+                    if len(self._created) + self._opening < self.maxconn:
+                        self._opening += 1
+                        break
+                    if not block:
+                        remaining = 0
+                    elif timeout is None:
+                        remaining = None
+                    else:
+                        remaining = start + timeout - now
+                    if remaining is not None and remaining <= 0:
+                        self.timeouts += 1
+                        raise OperationalError('Timed out waiting for a '
+                                               'pooled connection')
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+        finally:
+            self._cond.release()
+            _close(discarded)
+        if conn is None:
+            conn = self._open()
+        wait = time.time() - start
+        self._cond.acquire()
+        try:
+            self._in_use.add(conn)
+            self.checkouts += 1
+            self.wait_time += wait
+            if wait > self.max_wait:
+                self.max_wait = wait
+        finally:
+            self._cond.release()
+        return conn
+
+    def putconn(self, conn, close=False):
+        """
+        Return a connection to the pool. Any open transaction is rolled
+        back, and the connection is closed instead if that fails, or if
+        close is True.
+        """
+        self._cond.acquire()
+        try:
+            if conn not in self._in_use:
+                if conn in self._created:
+                    raise ProgrammingError('Connection is not checked out')
+                raise ProgrammingError('Connection does not belong to this '
+                                       'pool')
+            self._in_use.remove(conn)
+        finally:
+            self._cond.release()
+        if not close and not conn.closed:
+            try:
+                status = conn.transactionStatus
+                if status in (TRANS_IDLE, TRANS_INTRANS, TRANS_INERROR):
+                    # Also discards any deferred BEGIN
+                    conn.rollback()
+                else:
+                    # A command is still in progress (or the connection
+                    # is broken) - not safe to reuse.
+                    close = True
+            except DatabaseError:
+                close = True
+            if not close:
+                close = conn.transactionStatus != TRANS_IDLE
+        now = time.time()
+        discarded = []
+        self._cond.acquire()
+        try:
+            if close or conn.closed or self._closed or \
+                    self._expired(conn, now):
+                self._discard(conn, discarded)
+            else:
+                self._idle.append((conn, now))
+            self._reap(now, discarded)
+            self._cond.notify()
+        finally:
+            self._cond.release()
+        _close(discarded)
+
+    def connection(self, timeout=None):
+        """
+        Check out a connection for use in a "with" statement, returning it
+        to the pool at the end of the block (uncommitted work is rolled
+        back)
+        """
+        return _Checkout(self, self.getconn(timeout))
+
+    def close(self):
+        """
+        Close idle connections, and any checked out connections as they
+        are returned
+        """
+        discarded = []
+        self._cond.acquire()
+        try:
+            self._closed = True
+            while self._idle:
+                conn, since = self._idle.pop()
+                self._discard(conn, discarded)
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+        _close(discarded)
+
+    def stats(self):
+        """
+        Return a dictionary of pool metrics
+        """
+        self._cond.acquire()
+        try:
+            size = len(self._created)
+            idle = len(self._idle)
+            if self.checkouts:
+                avg_wait = self.wait_time / self.checkouts
+            else:
+                avg_wait = 0.0
+            return dict(size=size, idle=idle, in_use=size - idle,
+                        opening=self._opening, waiting=self.waiting,
+                        minconn=self.minconn, maxconn=self.maxconn,
+                        utilisation=float(size - idle) / self.maxconn,
+                        checkouts=self.checkouts, timeouts=self.timeouts,
+                        connects=self.connects, discards=self.discards,
+                        wait_time=self.wait_time, avg_wait=avg_wait,
+                        max_wait=self.max_wait)
+        finally:
+            self._cond.release()
@@ -0,0 +1,87 @@
+"""
+Translation of pyformat query parameters to PostgreSQL's $n form
+
+Commands are parsed once per argument style, and the translations kept
+in a cache of up to cache_size commands (emptied when full). Placeholders
+are only recognised outside quoted literals, quoted identifiers and
+comments, while "%%" is taken to be a literal "%" throughout.
+"""
+import re
+from oclibpq import ProgrammingError
+
+cache_size = 1000
+_cache = {}
+
+_re_token = re.compile(r'''
+      (?<![\w$])[Ee]'(?:[^'\\]|\\.|'')*'?       # escape string constant
+    | '(?:[^']|'')*'?                           # string constant
+    | "(?:[^"]|"")*"?                           # quoted identifier
+    | (?<![\w$])(?P<tag>\$(?:[A-Za-z_]\w*)?\$)  # dollar quoted string
+        (?:.*?(?P=tag)|.*)
+    | --[^\n]*                                  # comment
+    | /\*(?:.*?\*/|.*)                          # block comment
+    | %(?P<param>s|%|\((?P<name>[^)]*)\)s)?     # placeholder
+''', re.VERBOSE | re.DOTALL)
+
+
+def _compile(cmd, named):
+    # Returns the $n form of cmd, and the number of %s placeholders or a
+    # tuple of the %(name)s placeholder names, in $n order.
+    sql = []
+    names = []
+    numbers = {}
+    pos = 0
+    for match in _re_token.finditer(cmd):
+        param = match.group('param')
+        if param is None:
+            continue
+        sql.append(cmd[pos:match.start()].replace('%%', '%'))
+        pos = match.end()
+        if param == '%':
+            sql.append('%')
+        elif param == 's':
+            if named:
+                raise ProgrammingError('command contains %s with dict args')
+            names.append(None)
+            sql.append('$%d' % len(names))
+        else:
+            name = match.group('name')
+            if not named:
+                raise ProgrammingError('command contains %%(%s)s with '
+                                       'sequence args' % name)
+            number = numbers.get(name)
+            if number is None:
+                names.append(name)
+                number = numbers[name] = len(names)
+            sql.append('$%d' % number)
+    sql.append(cmd[pos:].replace('%%', '%'))
+    if named:
+        return ''.join(sql), tuple(names)
+    return ''.join(sql), len(names)
+
+
+def translate(cmd, args):
+    """
+    Return the $n form of cmd, and a tuple of the arguments in $n order.
+    args is either a sequence (for %s placeholders) or a mapping (for
+    %(name)s placeholders).
+    """
+    named = hasattr(args, 'keys')
+    key = cmd, named
+    template = _cache.get(key)
+    if template is None:
+        template = _compile(cmd, named)
+        if len(_cache) >= cache_size:
+            _cache.clear()
+        _cache[key] = template
+    sql, params = template
+    if named:
+        try:
+            return sql, tuple([args[name] for name in params])
+        except KeyError, e:
+            raise ProgrammingError('argument %%(%s)s not found in dictionary'
+                                   % e.args[0])
+    args = tuple(args)
+    if len(args) != params:
+        raise ProgrammingError('wrong number of arguments for command string (expected %d, got %s)' % (params, len(args)))
+    return sql, args
@@ -0,0 +1,80 @@
+"""
+Per-connection cache of server-side prepared statements
+"""
+from collections import OrderedDict
+
+class StatementCache(object):
+    """
+    Map statements (keyed on the $n form of the SQL and the parameter
+    OIDs) to the names of server-side prepared statements, evicting the
+    least recently used statement once "size" statements are cached.
+
+    The hits, misses, evictions and invalidations counters are intended
+    to help with choosing a cache size.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        # Statement names, least recently used first
+        self.statements = OrderedDict()
+        self.serial = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.statements)
+
+    def __repr__(self):
+        return '<%s %d/%d statements, %d hits, %d misses>' %\
+            (self.__class__.__name__, len(self.statements), self.size,
+             self.hits, self.misses)
+
+    def get(self, key):
+        """
+        Return the prepared statement name for key, or None
+        """
+        name = self.statements.pop(key, None)
+        if name is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.statements[key] = name
+        return name
+
+    def add(self, key):
+        """
+        Allocate a name for a new prepared statement, returning the name
+        and a list of evicted statement names (which should be deallocated)
+        """
+        evicted = []
+        while self.statements and len(self.statements) >= self.size:
+            lru_key, lru_name = self.statements.popitem(last=False)
+            evicted.append(lru_name)
+            self.evictions += 1
+        self.serial += 1
+        name = 'OcPy_S%d' % self.serial
+        self.statements[key] = name
+        return name, evicted
+
+    def remove(self, key):
+        """
+        Forget a statement, returning its name (or None if not cached)
+        """
+        return self.statements.pop(key, None)
+
+    def invalidate(self, key):
+        """
+        Forget a statement the server has rejected
+        """
+        name = self.remove(key)
+        if name is not None:
+            self.invalidations += 1
+        return name
+
+    def stats(self):
+        return dict(size=self.size, statements=len(self.statements),
+                    hits=self.hits, misses=self.misses,
+                    evictions=self.evictions,
+                    invalidations=self.invalidations)
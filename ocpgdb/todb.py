@@ -1,7 +1,8 @@
 import sys
 import types
+import datetime
 # Module specific
-from . import pgoid, pgtype
+from . import pgoid, pgtype, cvtpytime
 from oclibpq import bytea, DataError
 
 # Note that this is the common to_db map - each connection object also has it's
@@ -64,12 +65,36 @@ def value_to_db(to_db, value):
         raise DataError, 'column value %r: %s' % (value, e),\
               sys.exc_info()[2]
 
-
 set_to_db(bool, pgtype.pack_bool)
 set_to_db(float, pgtype.pack_float8)
 set_to_db(int, pgtype.pack_int)
 set_to_db(long, pgtype.pack_int8)
 set_to_db(bytea, pgtype.pack_bytea)
+# Other buffer objects are also sent as bytea, without being copied
+set_to_db(bytearray, pgtype.pack_bytea)
+set_to_db(memoryview, pgtype.pack_bytea)
+if sys.version_info >= (3,0):
+    import mmap
+    set_to_db(mmap.mmap, pgtype.pack_bytea)
+
+# The default to_db functions reproduced natively by PgConnection - values
+# of these types are passed to it unconverted (see Connection._args_to_db)
+_native_to_db = {
+    bool: pgtype.pack_bool,
+    float: pgtype.pack_float8,
+    int: pgtype.pack_int,
+    long: pgtype.pack_int8,
+    unicode: pgtype.pack_utf8,
+    bytea: pgtype.pack_bytea,
+    bytearray: pgtype.pack_bytea,
+    memoryview: pgtype.pack_bytea,
+    datetime.datetime: cvtpytime.to_int_timestamp,
+    datetime.date: cvtpytime.to_int_date,
+    datetime.time: cvtpytime.to_int_time,
+}
+if sys.version_info >= (3,0):
+    _native_to_db[mmap.mmap] = pgtype.pack_bytea
+
 try:
     import decimal
     from . import cvtdecimal
@@ -77,6 +102,7 @@ except ImportError:
     pass
 else:
     set_to_db(decimal.Decimal, cvtdecimal.pack_numeric)
+    _native_to_db[decimal.Decimal] = cvtdecimal.pack_numeric
 
 def _set_encoding(setfn, encoding):
     if sys.version_info < (3,0):
@@ -8,10 +8,21 @@ import re
 from distutils.core import setup, Extension
 from distutils import sysconfig
 
+# Modules that use Python 3 only syntax (asyncio support)
+PY3_MODULES = ['aio', 'aiopool']
+
 COMMANDS = {}
 if sys.version_info[0] == 3:
     from distutils.command.build_py import build_py_2to3
     COMMANDS['build_py'] = build_py_2to3
+else:
+    from distutils.command.build_py import build_py
+
+    class build_py_2(build_py):
+        def find_package_modules(self, package, package_dir):
+            modules = build_py.find_package_modules(self, package, package_dir)
+            return [m for m in modules if m[1] not in PY3_MODULES]
+    COMMANDS['build_py'] = build_py_2
 
 
 def collect(cmd, help):
@@ -38,6 +49,13 @@ AUTHOR = 'Andrew McNamara', 'andrewm@object-craft.com.au'
 HOMEPAGE = 'https://github.com/anmcn/ocpgdb'
 DOWNLOAD = 'https://github.com/anmcn/ocpgdb/releases'
 PG_INCL_DIR = pg_config['INCLUDEDIR']
+# libpq version as a PG_VERSION_NUM style integer, eg 90624 or 150014
+pg_version = [int(n) for n in re.findall(r'\d+', pg_config['VERSION'])]
+pg_version = (pg_version + [0, 0, 0])[:3]
+if pg_version[0] >= 10:
+    PG_VERSION_NUM = pg_version[0] * 10000 + pg_version[1]
+else:
+    PG_VERSION_NUM = pg_version[0] * 10000 + pg_version[1] * 100 + pg_version[2]
 PG_LIB_DIR = pg_config['LIBDIR']
 # Extract __version__ from module
 buf = open('ocpgdb/__init__.py').read()
@@ -49,8 +67,12 @@ sources = [
     'oclibpq/pqconnection.c',
     'oclibpq/pqexception.c',
     'oclibpq/pqresult.c',
+    'oclibpq/pqrow.c',
     'oclibpq/pqcell.c',
     'oclibpq/bytea.c',
+    'oclibpq/pqdecode.c',
+    'oclibpq/pqencode.c',
+    'oclibpq/pqbuffer.c',
     ]
 
 includes = [
@@ -59,6 +81,7 @@ includes = [
     ]
 
 defines = [
+    ('LIBPQ_VERSION', str(PG_VERSION_NUM)),
     ]
 
 library_dirs = [
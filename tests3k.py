@@ -147,12 +147,930 @@ class BasicTests(TestCase):
         self.assertEqual(cell.type, ocpgdb.pgoid.unknown)
         self.assertEqual(cell.value, None)
 
+    def test_result_rows(self):
+        c = ocpgdb.connect(**scratch_db)
+        result = ocpgdb.PgConnection.execute(c, 
+            "select 1::int2, 2::int4, 3::int8, 4::oid, 1.5::float4, "
+            "2.5::float8, true, 'abc'::text, null::int4, '12:00'::time "
+            "from generate_series(1, 3)", ())
+        converters = ocpgdb.fromdb.converters(c.from_db, result.columns)
+        converters[9] = lambda value: ('python', value)
+        rows = result.rows(converters, 2)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0][:9], 
+                         (1, 2, 3, 4, 1.5, 2.5, True, 'abc', None))
+        self.assertEqual(rows[0][9][0], 'python')
+        self.assertEqual(len(result.rows(converters)), 1)
+        self.assertEqual(result.rows(converters), [])
+        self.assertRaises(ValueError, result.rows, converters[:2])
+        # Unknown types only fail when a value needs converting
+        result = ocpgdb.PgConnection.execute(c, 
+            "select null::tid, '(0,1)'::tid", ())
+        converters = ocpgdb.fromdb.converters(c.from_db, result.columns)
+        self.assertRaises(ocpgdb.InterfaceError, result.rows, converters)
+
+    def test_result_column(self):
+        c = ocpgdb.connect(**scratch_db)
+        result = ocpgdb.PgConnection.execute(c, 
+            "select i::int4, i::float8, i::text, '2000-01-02'::date, "
+            "'00:00:01.5'::time "
+            "from generate_series(1, 3) as i "
+            "union all select null, null, null, null, null", ())
+        values, nulls = result.column(0)
+        self.assertEqual(values.tolist(), [1, 2, 3, 0])
+        self.assertEqual(nulls.tolist(), [0, 0, 0, 1])
+        self.assertEqual(result.column(1)[0].tolist(), [1.0, 2.0, 3.0, 0.0])
+        self.assertEqual(result.column(3)[0].tolist(), [1, 1, 1, 0])
+        # Times are microseconds since midnight
+        self.assertEqual(result.column(4)[0].tolist(), 
+                         [1500000, 1500000, 1500000, 0])
+        self.assertRaises(ocpgdb.NotSupportedError, result.column, 2)
+        converters = ocpgdb.fromdb.converters(c.from_db, result.columns)
+        values, nulls = result.column(2, converters[2])
+        self.assertEqual(values, ['1', '2', '3', None])
+        self.assertEqual(nulls.tolist(), [0, 0, 0, 1])
+        self.assertRaises(IndexError, result.column, 5)
+        result.rownumber = 2
+        self.assertEqual(result.column(0)[0].tolist(), [3, 0])
+
+    def test_stream(self):
+        c = ocpgdb.connect(**scratch_db)
+        rows = c.stream('select i, i::text from generate_series(1, %s) as i',
+                        (2500,))
+        self.assertEqual(list(rows), [(i, str(i)) for i in range(1, 2501)])
+        # Empty result
+        self.assertEqual(list(c.stream('select 1 where false')), [])
+        # Abandoning the iterator cancels the query
+        rows = c.stream('select * from generate_series(1, 10000000)')
+        self.assertEqual(next(rows), (1,))
+        rows.close()
+        self.assertEqual(c.execute('select 1'), [(1,)])
+        # Errors are raised from the iterator
+        rows = c.stream('select 1/(i-5) from generate_series(1, 10) as i', 
+                        chunk_size=2)
+        self.assertRaises(ocpgdb.OperationalError, list, rows)
+        self.assertEqual(c.execute('select 1'), [(1,)])
+        self.assertEqual(c.transactionStatus, ocpgdb.TRANS_IDLE)
+        # As does failing to select the row mode
+        c.setChunkedRowsMode = c.setSingleRowMode = lambda *args: False
+        self.assertRaises(ocpgdb.OperationalError, c.stream, 'select 1')
+        del c.setChunkedRowsMode, c.setSingleRowMode
+        self.assertEqual(c.execute('select 1'), [(1,)])
+
+    def test_statement_cache(self):
+        # The least recently used statement is evicted
+        cache = ocpgdb.stmtcache.StatementCache(2)
+        a, evicted = cache.add('a')
+        b, evicted = cache.add('b')
+        self.assertEqual(cache.get('a'), a)
+        c, evicted = cache.add('c')
+        self.assertEqual(evicted, [b])
+        self.assertEqual(list(cache.statements), ['a', 'c'])
+        c = ocpgdb.connect(statement_cache_size=2, autocommit=True, 
+                           **scratch_db)
+        cache = c.statement_cache
+        for i in range(3):
+            self.assertEqual(c.execute('select %s::int', (i,)), [(i,)])
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        # Different parameter types are prepared separately
+        self.assertEqual(c.execute('select %s::int', ('1',)), [(1,)])
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        c.execute('select 1')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+        # Schema changes invalidate cached plans
+        c.execute('create temp table x (a int)')
+        c.execute('insert into x values (%s)', (1,))
+        self.assertEqual(c.execute('select * from x'), [(1,)])
+        c.execute('alter table x add column b int')
+        self.assertEqual(c.execute('select * from x'), [(1, None)])
+        self.assertEqual(cache.invalidations, 1)
+        # Errors do not leave broken statements in the cache
+        self.assertRaises(ocpgdb.OperationalError, c.execute, 'select * from y')
+        self.assertFalse(('select * from y', ()) in cache.statements)
+        c.close()
+        # A deferred BEGIN is pipelined with the prepared statement
+        c = ocpgdb.connect(statement_cache_size=2, **scratch_db)
+        if c._can_pipeline:
+            c._send_deferred = lambda: self.fail('deferred command sent '
+                                                 'separately')
+        curs = c.cursor()
+        curs.execute('create temp table x (a int)')
+        c.commit()
+        curs.execute('insert into x values (%s)', (1,))
+        self.assertEqual(c.transactionStatus, ocpgdb.TRANS_INTRANS)
+        c.commit()
+        curs.execute('insert into x values (%s)', (2,))
+        self.assertEqual(c.transactionStatus, ocpgdb.TRANS_INTRANS)
+        c.rollback()
+        self.assertEqual(c.execute('select a from x'), [(1,)])
+        self.assertEqual((c.statement_cache.hits, 
+                          c.statement_cache.misses), (1, 2))
+        c.close()
+
+    def test_copy_from(self):
+        c = ocpgdb.connect(**scratch_db)
+        c.execute('create temp table x (a int8, b text, c float4, d varchar)')
+        curs = c.cursor()
+        rows = [(i, str(i), i / 2.0, None) for i in range(1000)]
+        curs.copy_from('x', None, iter(rows))
+        self.assertEqual(curs.rowcount, 1000)
+        curs.execute('select * from x order by a')
+        self.assertEqual(curs.fetchall(), rows)
+        curs.copy_from('x', ['d', 'a'], [('z', 2000)])
+        curs.execute('select a, d from x where b is null')
+        self.assertEqual(curs.fetchall(), [(2000, 'z')])
+        # A failed COPY leaves the connection usable
+        c.execute('savepoint a')
+        self.assertRaises(ocpgdb.DataError, curs.copy_from, 'x', ['a'], 
+                          [(1,), ('a',)])
+        c.execute('rollback to savepoint a')
+        self.assertRaises(ocpgdb.DataError, curs.copy_from, 'x', ['a'], 
+                          [(1, 2)])
+        c.execute('rollback to savepoint a')
+        c.execute('create temp table y (a int2 primary key)')
+        self.assertRaises(ocpgdb.OperationalError, curs.copy_from, 'y', None, 
+                          [(1,), (1,)])
+        c.rollback()
+        self.assertEqual(c.execute('select 1'), [(1,)])
+        c.close()
+
+    def test_copy_to(self):
+        c = ocpgdb.connect(**scratch_db)
+        c.execute('create temp table x (a int, b text)')
+        c.execute("insert into x values (1, 'a'), (2, null)")
+        curs = c.cursor()
+        data = []
+        curs.copy_to('x', data.append, format='text')
+        self.assertEqual(b''.join(data), b'1\ta\n2\t\\N\n')
+        self.assertEqual(curs.rowcount, 2)
+        data = []
+        curs.copy_to('select b, a from x order by a', data.append, 
+                     format='csv')
+        self.assertEqual(b''.join(data), b'a,1\n,2\n')
+        data = []
+        c._copy_buffer_size = 1
+        curs.copy_to('x', data.append)
+        self.assertTrue(data[0].startswith(b'PGCOPY\n\377\r\n\0'))
+        self.assertTrue(len(data) > 1)
+        self.assertRaises(ocpgdb.ProgrammingError, curs.copy_to, 'x', 
+                          data.append, format='xml')
+        # An exception from the sink leaves the connection usable
+        def sink(data):
+            raise ValueError
+        self.assertRaises(ValueError, curs.copy_to, 
+                          'select * from generate_series(1, 100000)', sink)
+        c.rollback()
+        self.assertEqual(c.execute('select 1'), [(1,)])
+        c.close()
+
+    def test_copy_rows(self):
+        c = ocpgdb.connect(**scratch_db)
+        c.execute('create temp table x (a int, b text, c numeric, d bytea)')
+        c.execute("insert into x select i, i::text, i / 4.0, 'a\\\\000b'"
+                  " from generate_series(1, 500) i")
+        c.execute("insert into x values (null, null, null, null)")
+        curs = c.cursor()
+        curs.execute('select * from x')
+        expect = curs.fetchall()
+        for buffer_size in (1, 100, 65536):
+            c._copy_buffer_size = buffer_size
+            self.assertEqual(list(curs.copy_rows('x')), expect)
+        self.assertEqual([d[0] for d in curs.description], 
+                         ['a', 'b', 'c', 'd'])
+        self.assertEqual(list(curs.copy_rows('select b from x where a < 3')),
+                         [('1',), ('2',)])
+        # Closing the iterator early cancels the COPY
+        rows = curs.copy_rows('select * from generate_series(1, 1000000)')
+        self.assertEqual(next(rows), (1,))
+        rows.close()
+        c.rollback()
+        self.assertEqual(c.execute('select 1'), [(1,)])
+        rows = curs.copy_rows('select 1 / (100 - i) from generate_series(1, 200) i')
+        self.assertRaises(ocpgdb.OperationalError, list, rows)
+        c.rollback()
+        self.assertEqual(c.execute('select 1'), [(1,)])
+        c.close()
+
+    def test_aio(self):
+        import asyncio
+        import time
+        from ocpgdb import aio
+        async def run():
+            c = await aio.connect(**scratch_db)
+            self.assertEqual(await c.execute('select %s::int, %s', (1, 'a')),
+                             [(1, 'a')])
+            curs = c.cursor()
+            await curs.execute('select * from generate_series(1, 3)')
+            self.assertEqual(await curs.fetchone(), (1,))
+            self.assertEqual(await curs.fetchall(), [(2,), (3,)])
+            self.assertEqual(c.transactionStatus, ocpgdb.TRANS_INTRANS)
+            await c.rollback()
+            with self.assertRaises(ocpgdb.OperationalError):
+                await c.execute('select * from nonexistent')
+            # The blocking interface would stall the event loop
+            with self.assertRaises(ocpgdb.NotSupportedError):
+                c.prepare('select 1')
+            with self.assertRaises(ocpgdb.NotSupportedError):
+                c.stream('select 1')
+            c.autocommit = True
+            sync_curs = ocpgdb.connection.Cursor(c)
+            with self.assertRaises(ocpgdb.NotSupportedError):
+                sync_curs.execute('select 1')
+            with self.assertRaises(ocpgdb.NotSupportedError):
+                sync_curs.copy_from('x', ['a'], [(1,)])
+            c.autocommit = False
+            # Queries on separate connections run concurrently
+            c2 = await aio.connect(**scratch_db)
+            start = time.time()
+            await asyncio.gather(c.execute('select 1 from pg_sleep(0.3)'),
+                                 c2.execute('select 1 from pg_sleep(0.3)'))
+            self.assertTrue(time.time() - start < 0.55)
+            # A cancelled query leaves the connection usable
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(c.execute('select 1 from pg_sleep(5)'), 0.1)
+            self.assertEqual(await c.execute('select 1'), [(1,)])
+            c.close()
+            c2.close()
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+    def test_pool(self):
+        from ocpgdb import pool
+        p = pool.ConnectionPool(minconn=2, maxconn=3, **scratch_db)
+        self.assertEqual(p.stats()['idle'], 2)
+        c1 = p.getconn()
+        self.assertEqual(c1.status, ocpgdb.CONNECTION_OK)
+        c1.cursor().execute('create temp table x (a int)')
+        self.assertEqual(c1.transactionStatus, ocpgdb.TRANS_INTRANS)
+        p.putconn(c1)
+        # Open transactions are rolled back on return
+        self.assertEqual(c1.transactionStatus, ocpgdb.TRANS_IDLE)
+        c1 = p.getconn()
+        self.assertRaises(ocpgdb.OperationalError, c1.execute, 
+                          'select * from x')
+        c2 = p.getconn()
+        c3 = p.getconn()
+        self.assertRaises(ocpgdb.OperationalError, p.getconn, timeout=0.1)
+        self.assertRaises(ocpgdb.OperationalError, p.getconn, block=False)
+        stats = p.stats()
+        self.assertEqual((stats['in_use'], stats['timeouts']), (3, 2))
+        # Connections closed by the server are detected on checkout
+        pid = c2.execute('select pg_backend_pid()')[0][0]
+        p.putconn(c2)
+        c1.execute('select pg_terminate_backend(%s::int)', (pid,))
+        c1.rollback()
+        import time
+        time.sleep(0.1)
+        c2 = p.getconn()
+        self.assertEqual(c2.execute('select 1'), [(1,)])
+        self.assertEqual(p.stats()['discards'], 1)
+        p.putconn(c2)
+        p.putconn(c3, close=True)
+        self.assertEqual(len(p), 2)
+        with p.connection() as c:
+            self.assertTrue(c is c2)
+        p.putconn(c1)
+        p.close()
+        self.assertTrue(c1.closed)
+        self.assertRaises(ocpgdb.ProgrammingError, p.getconn)
+        # Connections can only be returned once, and only to their pool
+        p = pool.ConnectionPool(minconn=1, maxconn=2, **scratch_db)
+        c1 = p.getconn()
+        p.putconn(c1)
+        self.assertRaises(ocpgdb.ProgrammingError, p.putconn, c1)
+        other = ocpgdb.connect(**scratch_db)
+        self.assertRaises(ocpgdb.ProgrammingError, p.putconn, other)
+        other.close()
+        c1 = p.getconn()
+        c2 = p.getconn()
+        self.assertTrue(c1 is not c2)
+        self.assertEqual(p.stats()['in_use'], 2)
+        p.putconn(c1)
+        p.putconn(c2)
+        p.close()
+        # Connections are closed with the pool lock released
+        locked = []
+        def connect(**kwargs):
+            conn = ocpgdb.connect(**kwargs)
+            close = conn.close
+            def checked_close():
+                free = p._cond.acquire(False)
+                if free:
+                    p._cond.release()
+                locked.append(not free)
+                close()
+            conn.close = checked_close
+            return conn
+        p = pool.ConnectionPool(minconn=1, maxconn=2, connect=connect,
+                                **scratch_db)
+        c1 = p.getconn()
+        c2 = p.getconn()
+        p.putconn(c1, close=True)
+        p.putconn(c2)
+        p.close()
+        self.assertEqual(locked, [False, False])
+
+    def test_aiopool(self):
+        import asyncio
+        from ocpgdb import aio, aiopool
+        async def run():
+            pool = await aiopool.create_pool(minconn=2, maxconn=2, 
+                                             **scratch_db)
+            self.assertEqual(pool.stats()['idle'], 2)
+            c1 = await pool.getconn()
+            c2 = await pool.getconn()
+            with self.assertRaises(ocpgdb.OperationalError):
+                await pool.getconn(timeout=0.05)
+            # Waiters are served in order, and a cancelled waiter does not
+            # consume a connection
+            order = []
+            async def waiter(n):
+                async with pool.connection() as c:
+                    order.append(n)
+                    await asyncio.sleep(0.01)
+            tasks = [asyncio.ensure_future(waiter(n)) for n in range(4)]
+            await asyncio.sleep(0.01)
+            tasks[1].cancel()
+            await pool.putconn(c1)
+            await pool.putconn(c2)
+            await asyncio.wait(tasks)
+            self.assertEqual(order, [0, 2, 3])
+            self.assertEqual(pool.waiting, 0)
+            # A task cancelled mid-query has its connection reset
+            async def query():
+                async with pool.connection() as c:
+                    await c.cursor().execute('select 1 from pg_sleep(5)')
+            task = asyncio.ensure_future(query())
+            await asyncio.sleep(0.1)
+            task.cancel()
+            await asyncio.wait([task])
+            self.assertEqual(pool.stats()['resets'], 1)
+            self.assertEqual(pool.stats()['discards'], 0)
+            c1 = await pool.getconn()
+            c2 = await pool.getconn()
+            for c in (c1, c2):
+                self.assertEqual(c.transactionStatus, ocpgdb.TRANS_IDLE)
+                self.assertEqual(await c.execute('select 1'), [(1,)])
+            await pool.putconn(c1)
+            await pool.putconn(c2)
+            self.assertEqual(len(pool), 2)
+            # Connections can only be returned once, and only to their pool
+            with self.assertRaises(ocpgdb.ProgrammingError):
+                await pool.putconn(c1)
+            other = await aio.connect(**scratch_db)
+            with self.assertRaises(ocpgdb.ProgrammingError):
+                await pool.putconn(other)
+            other.close()
+            c1 = await pool.getconn()
+            c2 = await pool.getconn()
+            self.assertTrue(c1 is not c2)
+            await pool.putconn(c1)
+            await pool.putconn(c2)
+            pool.close()
+            self.assertTrue(c1.closed)
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+    def test_aio_cursor(self):
+        import asyncio
+        from ocpgdb import aio
+        async def run():
+            c = await aio.connect(**scratch_db)
+            curs = c.cursor('test_portal')
+            curs.itersize = 10
+            query = 'select i from generate_series(1, 25) i'
+            await curs.execute(query)
+            self.assertEqual(curs.description[0][0], 'i')
+            # The next batch is fetched in the background
+            self.assertTrue(curs._prefetch is not None)
+            rows = [row async for row in curs]
+            self.assertEqual(rows, [(i,) for i in range(1, 26)])
+            await curs.execute(query)
+            self.assertEqual(await curs.fetchmany(15), 
+                             [(i,) for i in range(1, 16)])
+            self.assertEqual(await curs.fetchall(), 
+                             [(i,) for i in range(16, 26)])
+            # Re-executing part way through closes the server-side cursor
+            await curs.execute(query)
+            await curs.fetchone()
+            await curs.execute('select 1')
+            self.assertEqual([row async for row in curs], [(1,)])
+            # ... or after its transaction has ended
+            for end in (c.commit, c.rollback):
+                await curs.execute(query)
+                await curs.fetchone()
+                await end()
+                await curs.execute('select 1')
+                self.assertEqual([row async for row in curs], [(1,)])
+            await curs.close()
+            await c.rollback()
+            # Unnamed cursors buffer the result, but can also be iterated
+            curs = c.cursor()
+            await curs.execute(query)
+            self.assertEqual(len([row async for row in curs]), 25)
+            await c.rollback()
+            c.autocommit = True
+            curs = c.cursor('test_hold')
+            curs.itersize = 10
+            await curs.execute(query)
+            self.assertEqual(len(await curs.fetchall()), 25)
+            await curs.close()
+            self.assertEqual(c.transactionStatus, ocpgdb.TRANS_IDLE)
+            c.close()
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+    def test_cursor_iter(self):
+        c = ocpgdb.connect(**scratch_db)
+        curs = c.cursor()
+        curs.itersize = 7
+        query = 'select i from generate_series(1, 50) i'
+        expect = [(i,) for i in range(1, 51)]
+        curs.execute(query)
+        self.assertEqual(list(curs), expect)
+        curs.prefetch = True
+        curs.execute(query)
+        self.assertEqual(list(curs), expect)
+        # The connection remains usable during and after iteration
+        curs.execute(query)
+        rows = []
+        for row in curs:
+            rows.append(row)
+            if row[0] == 10:
+                self.assertEqual(c.execute('select 1'), [(1,)])
+            if row[0] == 20:
+                break
+        self.assertEqual(rows, expect[:20])
+        curs.execute('select 2')
+        self.assertEqual(list(curs), [(2,)])
+        # Prefetched results are checked on the consumer's thread
+        import threading
+        threads = []
+        c.result_size = lambda nbytes, ntuples: \
+            threads.append(threading.current_thread())
+        curs.execute(query)
+        self.assertEqual(list(curs), expect)
+        self.assertEqual(set(threads), set([threading.current_thread()]))
+        c.close()
+
+    def test_cursor_batches(self):
+        c = ocpgdb.connect(**scratch_db)
+        result = c._execute('select i from generate_series(1, 10) i')
+        self.assertTrue(result.memorySize > 0)
+        curs = c.cursor()
+        curs.fetch_min = 2
+        curs.itersize = 16
+        self.assertEqual(curs._batch_size(None), 2)
+        self.assertEqual(curs._batch_size(result), 16)
+        curs.fetch_budget = result.memorySize
+        self.assertEqual(curs._batch_size(result), 10)
+        curs.fetch_budget = 1 << 20
+        # Rows are served from the buffered batch where possible
+        curs.execute('select i from generate_series(1, 50) i')
+        self.assertEqual(curs.fetchone(), (1,))
+        self.assertEqual(curs.fetchmany(3), [(2,), (3,), (4,)])
+        self.assertEqual(curs.fetchone(), (5,))
+        self.assertEqual(curs.fetchmany(10), [(i,) for i in range(6, 16)])
+        self.assertEqual(curs.fetchone(), (16,))
+        self.assertEqual(list(curs), [(i,) for i in range(17, 51)])
+        self.assertEqual(curs.fetchone(), None)
+        self.assertEqual(curs.fetchall(), [])
+        curs.execute('select i from generate_series(1, 50) i')
+        self.assertEqual(curs.fetchmany(5), [(i,) for i in range(1, 6)])
+        self.assertEqual(curs.fetchall(), [(i,) for i in range(6, 51)])
+        c.close()
+
+    def test_cursor_declare(self):
+        c = ocpgdb.connect(**scratch_db)
+        curs = c.cursor()
+        curs.execute('select i, i * 2 as j from generate_series(1, 5) i '
+                     'where i > %s', (1,))
+        self.assertEqual([d[0] for d in curs.description], ['i', 'j'])
+        # The first batch is fetched with the DECLARE
+        def no_execute(*args):
+            self.fail('unexpected round trip')
+        c._execute = no_execute
+        self.assertEqual(curs.fetchall(), [(2, 4), (3, 6), (4, 8), (5, 10)])
+        del c._execute
+        # Errors from either command are reported
+        self.assertRaises(ocpgdb.OperationalError, curs.execute,
+                          'select nosuchcolumn')
+        c.rollback()
+        self.assertRaises(ocpgdb.OperationalError, curs.execute,
+                          'select 1 / (i - 3) from generate_series(1, 5) i')
+        c.rollback()
+        curs.execute('select 1')
+        self.assertEqual(curs.fetchall(), [(1,)])
+        c.close()
+
+    def test_cursor_deferred(self):
+        c = ocpgdb.connect(**scratch_db)
+        curs = c.cursor()
+        curs.execute('select 1')
+        self.assertEqual(c.transactionStatus, ocpgdb.TRANS_INTRANS)
+        # CLOSE is sent with the next command, or not at all if the
+        # transaction ends first
+        curs.execute('select 2')
+        self.assertEqual(c._deferred, [])
+        curs.close()
+        self.assertEqual(len(c._deferred), 1)
+        self.assertEqual(c.execute('select 3'), [(3,)])
+        self.assertEqual(c._deferred, [])
+        curs = c.cursor()
+        curs.execute('select 4')
+        c.commit()
+        curs.execute('select 5')
+        self.assertEqual(curs.fetchall(), [(5,)])
+        c.rollback()
+        other = c.cursor()
+        other.execute('select 6')
+        curs.execute('select 7')
+        self.assertEqual(curs.fetchall(), [(7,)])
+        # BEGIN is deferred to the first command
+        curs.close()
+        c.commit()
+        curs = c.cursor()
+        curs.execute('create temp table x (a int)')
+        self.assertEqual(c.transactionStatus, ocpgdb.TRANS_INTRANS)
+        c.commit()
+        curs.executemany('insert into x values (%s)', [(1,), (2,)])
+        self.assertEqual(c.transactionStatus, ocpgdb.TRANS_INTRANS)
+        c.rollback()
+        c.begin()
+        self.assertEqual(c.transactionStatus, ocpgdb.TRANS_INTRANS)
+        c.rollback()
+        c.close()
+
+    def test_cursor_adaptive(self):
+        c = ocpgdb.connect(**scratch_db)
+        curs = c.cursor()
+        curs.fetch_min = 10
+        curs.execute('create temp table x (a int)')
+        curs.executemany('insert into x values (%s)', [(i,) for i in range(5)])
+        # A server-side cursor is used until the result is seen to be
+        # small (cursor rowcount is -1)
+        curs.execute('select a from x')
+        self.assertEqual(curs.rowcount, -1)
+        self.assertEqual(len(curs.fetchall()), 5)
+        curs.execute('select a from x')
+        self.assertEqual(curs.rowcount, 5)
+        self.assertEqual(len(curs.fetchall()), 5)
+        # ... and used again once it grows
+        curs.executemany('insert into x values (%s)', [(i,) for i in range(50)])
+        curs.execute('select a from x')
+        self.assertEqual(curs.rowcount, 55)
+        curs.execute('select a from x')
+        self.assertEqual(curs.rowcount, -1)
+        self.assertEqual(len(curs.fetchall()), 55)
+        # Named cursors always use a server-side cursor
+        named = c.cursor('named')
+        named.execute('select 1')
+        named.execute('select 1')
+        self.assertEqual(named.rowcount, -1)
+        self.assertEqual(named.fetchall(), [(1,)])
+        # WITH queries, but not data-modifying ones
+        query = 'with y as (select 1 as b) select b from y'
+        curs.execute(query)
+        self.assertEqual(curs.rowcount, -1)
+        self.assertEqual(curs.fetchall(), [(1,)])
+        curs.execute('with y as (insert into x values (1) returning a) '
+                     'select a from y')
+        self.assertEqual(curs.fetchall(), [(1,)])
+        c.rollback()
+        c.close()
+        # No cursors in autocommit mode
+        c = ocpgdb.connect(autocommit=True, **scratch_db)
+        curs = c.cursor()
+        curs.execute('select 1')
+        self.assertEqual(curs.fetchall(), [(1,)])
+        c.close()
+
+    def test_max_result_bytes(self):
+        sizes = []
+        class Connection(ocpgdb.Connection):
+            def result_size(self, nbytes, ntuples):
+                sizes.append((nbytes, ntuples))
+        c = Connection(max_result_bytes=100000, **scratch_db)
+        self.assertEqual(c.execute('select 1'), [(1,)])
+        self.assertEqual(sizes[-1][1], 1)
+        self.assertTrue(sizes[-1][0] > 0)
+        big = "select repeat('x', 200000)"
+        self.assertRaises(ocpgdb.OperationalError, c.execute, big)
+        self.assertEqual(sizes[-1][1], 1)
+        self.assertTrue(sizes[-1][0] > 200000)
+        self.assertEqual(c.execute('select 2'), [(2,)])
+        # Streamed results are checked a chunk at a time
+        self.assertRaises(ocpgdb.OperationalError, list, c.stream(big))
+        self.assertEqual(c.execute('select 3'), [(3,)])
+        curs = c.cursor()
+        self.assertRaises(ocpgdb.OperationalError, curs.execute, big)
+        c.rollback()
+        curs.execute('select 4')
+        self.assertEqual(curs.fetchall(), [(4,)])
+        c.close()
+
+    def test_pyformat(self):
+        from ocpgdb import pyformat
+        translate = pyformat.translate
+        self.assertEqual(translate('select %s, %s', (1, 2)), 
+                         ('select $1, $2', (1, 2)))
+        self.assertEqual(translate('select %(a)s, %(b)s, %(a)s', 
+                                   dict(a=1, b=2, c=3)), 
+                         ('select $1, $2, $1', (1, 2)))
+        # Placeholders aren't recognised in literals, identifiers or comments
+        self.assertEqual(translate('select \'%s\', "%s", %s -- %s\n', (1,)),
+                         ('select \'%s\', "%s", $1 -- %s\n', (1,)))
+        self.assertEqual(translate("select 'it''s %s', E'\\'%s', %s /* %s */",
+                                   (1,)),
+                         ("select 'it''s %s', E'\\'%s', $1 /* %s */", (1,)))
+        self.assertEqual(translate('select $$%s$$, $a$ $$ %s $a$, %s', (1,)),
+                         ('select $$%s$$, $a$ $$ %s $a$, $1', (1,)))
+        # %% is a literal %
+        self.assertEqual(translate("select 5 %% %s, '100%%', %%s", (2,)),
+                         ("select 5 % $1, '100%', %s", (2,)))
+        self.assertRaises(ocpgdb.ProgrammingError, translate, 
+                          'select %s', (1, 2))
+        self.assertRaises(ocpgdb.ProgrammingError, translate, 
+                          'select %s', dict(a=1))
+        self.assertRaises(ocpgdb.ProgrammingError, translate, 
+                          'select %(a)s', dict(b=1))
+        self.assertRaises(ocpgdb.ProgrammingError, translate, 
+                          'select %(a)s', (1,))
+
+    def test_prepare(self):
+        c = ocpgdb.connect(**scratch_db)
+        stmt = c.prepare('select %s::int8 + 1, %s::text')
+        self.assertEqual(stmt((2 ** 40, 'a')), [(2 ** 40 + 1, 'a')])
+        name = stmt.name
+        # Compatible types are cast rather than the statement re-prepared
+        self.assertEqual(stmt((1, None)), [(2, None)])
+        self.assertEqual(stmt([3, 'b']), [(4, 'b')])
+        self.assertEqual(stmt.name, name)
+        self.assertRaises(ocpgdb.ProgrammingError, stmt, (1,))
+        stmt = c.prepare('select %(a)s::int + %(b)s, %(a)s::int')
+        self.assertEqual(stmt(dict(a=1, b=2, c=3)), [(3, 1)])
+        self.assertRaises(ocpgdb.ProgrammingError, stmt, dict(a=1))
+        c.execute('create temp table x (a int, b text)')
+        insert = c.prepare('insert into x values (%s, %s)')
+        self.assertEqual(insert.executemany([(i, str(i)) for i in range(10)]), 
+                         10)
+        # Inserting a float means preparing again
+        self.assertEqual(insert.executemany([(10, 'x'), (11.0, 'y'), 
+                                             (12, None)]), 3)
+        self.assertRaises(ocpgdb.OperationalError, insert.executemany, 
+                          [('x', 'b')])
+        count = c.prepare('select count(*) from x')
+        self.assertEqual(count(), [(13,)])
+        # The statement is prepared again if the server loses it
+        c.execute('deallocate all')
+        self.assertEqual(count(), [(13,)])
+        count.close()
+        self.assertEqual(count.name, None)
+        c.close()
+
+    def test_native_params(self):
+        import decimal
+        c = ocpgdb.connect(**scratch_db)
+        values = (True, 1, 2 ** 40, -1.5, 'caf\xe9',
+                  decimal.Decimal('-12345.678900'), decimal.Decimal('1E+5'),
+                  datetime.datetime(1999, 12, 31, 23, 59, 59, 999999),
+                  datetime.date(1900, 3, 1), datetime.time(12, 30, 1, 5),
+                  ocpgdb.bytea(b'a\0b'), None)
+        args = c._args_to_db(values)
+        # The core types are passed to PgConnection unconverted
+        self.assertEqual(args, list(values))
+        self.assertEqual(ocpgdb.param_types(args), 
+                         [16, 20, 20, 701, 25, 1700, 1700, 1114, 1082, 1083,
+                          17, None])
+        self.assertEqual(c.execute('select ' + ','.join(['%s'] * len(values)),
+                                   values), [values])
+        self.assertEqual(c.execute('select %s::int', (1,)), [(1,)])
+        nan, = c.execute('select %s', (decimal.Decimal('NaN'),))[0]
+        self.assertTrue(nan.is_nan())
+        self.assertRaises(ocpgdb.DataError, c.execute, 'select %s', 
+                          (2 ** 64,))
+        # to_db overrides take precedence
+        c.set_to_db(float, lambda v: (ocpgdb.pgoid.text,
+                                        str(v).encode('ascii')))
+        self.assertEqual(c._args_to_db((1.5,)), [(ocpgdb.pgoid.text, b'1.5')])
+        self.assertEqual(c.execute('select %s', (1.5,)), [('1.5',)])
+        # ... including those set directly on the to_db map
+        c.to_db[int] = lambda v: (ocpgdb.pgoid.text, str(v).encode('ascii'))
+        self.assertEqual(c._args_to_db((1, True)), 
+                         [(ocpgdb.pgoid.text, b'1'), True])
+        self.assertEqual(c.execute('select %s', (1,)), [('1',)])
+
+    def test_buffer_params(self):
+        c = ocpgdb.connect(**scratch_db)
+        data = bytearray(b'ab\0cd')
+        # Buffer objects are sent as bytea, in place
+        self.assertEqual(c.execute('select %s, length(%s)', 
+                                   (data, memoryview(data)[1:])),
+                         [(ocpgdb.bytea(b'ab\0cd'), 4)])
+        self.assertEqual(ocpgdb.param_types([data]), [ocpgdb.pgoid.bytea])
+        # .. including as the data of an (oid, data) tuple
+        result = ocpgdb.PgConnection.execute(c, 'select $1::text', 
+                [(ocpgdb.pgoid.text, memoryview(b'abc'))])
+        self.assertEqual(result.rows([bytes], -1), [(b'abc',)])
+        c.execute('create temp table b (b bytea)')
+        c.cursor().executemany('insert into b values (%s)', 
+                               [(bytearray(b'x'),), (memoryview(b'y'),)])
+        c.cursor().copy_from('b', ['b'], [(bytearray(b'z'),)])
+        self.assertEqual(c.execute('select * from b'), 
+                         [(b'x',), (b'y',), (b'z',)])
+
+    def test_raw_cells(self):
+        import struct
+        c = ocpgdb.connect(**scratch_db)
+        c.set_from_db(ocpgdb.pgoid.bytea, memoryview)
+        rows = c.execute("select decode('00ff', 'hex'), null::bytea")
+        value = rows[0][0]
+        self.assertTrue(isinstance(value, memoryview))
+        self.assertTrue(value.readonly)
+        self.assertEqual(value.tobytes(), b'\0\xff')
+        self.assertEqual(rows[0][1], None)
+        # The view keeps the result alive
+        del rows
+        self.assertEqual(value.tobytes(), b'\0\xff')
+        def unpack(buf):
+            self.assertTrue(isinstance(buf, memoryview))
+            return struct.unpack('!q', buf)[0]
+        c.set_from_db(ocpgdb.pgoid.int8, ocpgdb.raw_converter(unpack))
+        self.assertEqual(c.execute('select 5::int8'), [(5,)])
+        c.set_from_db(ocpgdb.pgoid.int8, ocpgdb.raw_converter(lambda b: 1/0))
+        self.assertRaises(ocpgdb.InternalError, c.execute, 'select 5::int8')
+
+    def test_lazy_rows(self):
+        import pickle
+        c = ocpgdb.connect(lazy_rows=True, **scratch_db)
+        rows = c.execute("select 1, 'a'::text, null::int, 2.5::float8 "
+                         "from generate_series(1, 2)")
+        row = rows[0]
+        self.assertTrue(isinstance(row, ocpgdb.PgRow))
+        self.assertEqual(len(row), 4)
+        self.assertEqual(row[-1], 2.5)
+        self.assertEqual(row[1:3], ('a', None))
+        a, b, n, f = row
+        self.assertEqual((a, b, n, f), (1, 'a', None, 2.5))
+        self.assertEqual(row, (1, 'a', None, 2.5))
+        self.assertEqual((1, 'a', None, 2.5), row)
+        self.assertEqual(row, rows[1])
+        self.assertNotEqual(row, (1,))
+        self.assertEqual(hash(row), hash((1, 'a', None, 2.5)))
+        self.assertEqual(repr(row), repr(tuple(row)))
+        self.assertEqual(pickle.loads(pickle.dumps(row)), (1, 'a', None, 2.5))
+        self.assertRaises(IndexError, operator.getitem, row, 4)
+        # Columns are only decoded when accessed (and then cached)
+        calls = []
+        def unpack(value):
+            calls.append(value)
+            return len(calls)
+        c.set_from_db(ocpgdb.pgoid.text, unpack)
+        row = c.execute("select 1, 'x'::text")[0]
+        self.assertEqual(calls, [])
+        self.assertEqual(row[1], 1)
+        self.assertEqual(row[1], 1)
+        self.assertEqual(len(calls), 1)
+        curs = c.cursor()
+        curs.execute('select 1, 2')
+        self.assertEqual(curs.fetchall(), [(1, 2)])
+
+    def test_cursor_iter_fetch(self):
+        # Iteration and the fetch methods share one position
+        query = 'select i from generate_series(1, 50) i'
+        for autocommit, prefetch in ((True, False), (False, False), 
+                                     (False, True)):
+            c = ocpgdb.connect(autocommit=autocommit, **scratch_db)
+            curs = c.cursor()
+            curs.fetch_min = 4
+            curs.prefetch = prefetch
+            curs.execute(query)
+            for row in curs:
+                break
+            self.assertEqual(row, (1,))
+            self.assertEqual(curs.fetchone(), (2,))
+            for row in curs:
+                if row[0] == 10:
+                    break
+            self.assertEqual(curs.fetchmany(2), [(11,), (12,)])
+            self.assertEqual(next(iter(curs)), (13,))
+            self.assertEqual(curs.fetchall(), [(i,) for i in range(14, 51)])
+            self.assertEqual(list(curs), [])
+            c.close()
+
+    def test_executemany(self):
+        c = ocpgdb.connect(**scratch_db)
+        curs = c.cursor()
+        curs.execute('create temp table x (y text, z int)')
+        c.commit()
+        # Mixed parameter types, more than one batch
+        c._pipeline_batch = 2
+        curs.executemany('insert into x values (%s, %s)', 
+                    [('d', None), ('e', 2), (None, 3)])
+        self.assertEqual(curs.rowcount, 3)
+        curs.execute('select * from x')
+        self.assertEqual(curs.fetchall(), 
+                    [('d', None), ('e', 2), (None, 3)])
+        c.rollback()
+        del c._pipeline_batch
+        # The original exception is raised, identifying the parameter set
+        try:
+            curs.executemany('insert into x values (%s, 1/%s)', 
+                        [('f', 1), ('g', 0), ('h', 1)])
+        except ocpgdb.OperationalError as e:
+            self.assertEqual(e.parameter_set, 1)
+            self.assertTrue('division by zero' in str(e))
+        else:
+            self.fail('expected OperationalError')
+        c.rollback()
+        insert = c.prepare('insert into x values (%s, 1/%s)')
+        try:
+            insert.executemany([('f', 1), ('g', 1), ('h', 0)])
+        except ocpgdb.OperationalError as e:
+            self.assertEqual(e.parameter_set, 2)
+        else:
+            self.fail('expected OperationalError')
+        c.rollback()
+        if have_decimal:
+            # A parameter that fails to encode part way through the pipeline
+            # leaves the connection usable
+            self.assertRaises(ocpgdb.DataError, curs.executemany, 
+                              'insert into x values (%s, %s)', 
+                              [('a', 1), ('b', decimal.Decimal('Infinity'))])
+            c.rollback()
+            self.assertEqual(c.execute('select count(*) from x'), [(0,)])
+        c.close()
+
+    def test_convert_error(self):
+        def bad(value):
+            raise ValueError('bad value')
+        def check(fn, *args):
+            try:
+                fn(*args)
+            except ocpgdb.InternalError as e:
+                self.assertTrue("column 'num'" in str(e), str(e))
+                self.assertTrue('bad value' in str(e), str(e))
+            else:
+                self.fail('InternalError not raised')
+        c = ocpgdb.connect(**scratch_db)
+        c.set_from_db(ocpgdb.pgoid.int4, bad)
+        check(c.execute, 'select 1 as num')
+        curs = c.cursor()
+        check(list, curs.copy_rows('select 1 as num'))
+        c.rollback()
+        c.lazy_rows = True
+        row = c.execute('select 2 as other, 1 as num')[0]
+        check(row.__getitem__, 1)
+        c.lazy_rows = False
+        c.set_from_db(ocpgdb.pgoid.int4, ocpgdb.raw_converter(bad))
+        check(c.execute, 'select 1 as num')
+        # A missing converter is still reported as such
+        del c.from_db[ocpgdb.pgoid.int4]
+        self.assertRaises(ocpgdb.InterfaceError, c.execute, 'select 1')
+        c.close()
+
 
 class BasicSuite(unittest.TestSuite):
     tests = [
         'test_module_const',
         'test_connect',
         'test_result',
+        'test_result_rows',
+        'test_result_column',
+        'test_stream',
+        'test_statement_cache',
+        'test_copy_from',
+        'test_copy_to',
+        'test_copy_rows',
+        'test_convert_error',
+        'test_pool',
+        'test_cursor_iter',
+        'test_cursor_batches',
+        'test_cursor_iter_fetch',
+        'test_executemany',
+        'test_cursor_declare',
+        'test_cursor_deferred',
+        'test_cursor_adaptive',
+        'test_max_result_bytes',
+        'test_pyformat',
+        'test_prepare',
+        'test_native_params',
+        'test_buffer_params',
+        'test_raw_cells',
+        'test_lazy_rows',
+        'test_aio',
+        'test_aiopool',
+        'test_aio_cursor',
     ]
     def __init__(self):
         unittest.TestSuite.__init__(self, list(map(BasicTests, self.tests)))
@@ -715,6 +1633,13 @@ class DBAPI2Cursor(DBAPI2Test):
         self.assertEqual(curs.fetchmany(), [('a',), ('b',)])
         self.assertEqual(curs.fetchmany(), [('c',)])
         self.assertEqual(curs.fetchmany(), [])
+        # fetch_columns (extension)
+        curs.execute('select * from x')
+        self.assertEqual(curs.fetchone(), ('a',))
+        values, nulls = curs.fetch_columns()[0]
+        self.assertEqual(values, ['b', 'c'])
+        self.assertEqual(list(nulls), [0, 0])
+        self.assertEqual(curs.fetchone(), None)
         db.rollback()
         curs = db.cursor()
         # multiple rows and cols